@@ -1,4 +1,21 @@
+import contextlib
+import heapq
+import io
 import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import groupby, islice
+
+from recordstore import BackgroundWriter, FileLock, History, Journal, OrderedRecords, RecordStream, Stats, StringColumn, encode_strings, file_checksum, json_snapshot_is_intact, little_endian, pages, render_page, write_file_atomically
 
 def check_email_format(email):
     if email is None:
@@ -31,10 +48,81 @@ def check_valid_contact_id(contact_id):
         raise ValueError("Contact_Id must greater than zero.")
     return contact_id
 
+def check_valid_name(name):
+    if len(name.strip()) <= 0:
+        raise ValueError("Name cannot be empty.")
+    return name
+
+def invalid_lines(valid_line):
+    # Matches every line of a text that valid_line does not match as a whole
+    return re.compile(rf"^(?!(?:{valid_line})$).*$",re.MULTILINE)
+
+# Lines that certainly pass the checks above. validate_contact_columns only runs the
+# checks themselves on the values these miss.
+INVALID_NAME_LINES = invalid_lines(r".*\S.*")
+INVALID_PHONE_LINES = invalid_lines(r"[0-9]{10}")
+INVALID_EMAIL_LINES = invalid_lines(r"[^@\n]*@.*\..*")
+
+def find_suspects(values,lines):
+    # Indexes of the values matched by lines (see invalid_lines). All values are joined into
+    # one text and scanned by a single regex, so Python only loops over the matches.
+    try:
+        text = "\n".join(values)
+    except TypeError:
+        return range(len(values))
+    if text.count("\n") != len(values) - 1:
+        # A value with a line break of its own, the lines no longer match the rows
+        return range(len(values))
+    suspects = []
+    row = 0
+    position = 0
+    for match in lines.finditer(text):
+        row += text.count("\n",position,match.start())
+        position = match.start()
+        suspects.append(row)
+    return suspects
+
+def validate_contact_columns(contact_ids=None,names=None,phones=None,emails=None):
+    # Checks whole columns at once, e.g. from a file or an import, and returns one
+    # {"row","field","error"} per failing value in row order. The error is the one the
+    # single value check would raise. Columns left as None are not checked.
+    failures = []
+
+    def check(field,values,suspects,check_value):
+        for row in suspects:
+            try:
+                check_value(values[row])
+            except (ValueError,TypeError,AttributeError) as e:
+                failures.append({"row":row,"field":field,"error":str(e)})
+
+    if contact_ids is not None:
+        check("contact_id",contact_ids,[row for row, contact_id in enumerate(contact_ids) if type(contact_id) is not int or contact_id <= 0],check_valid_contact_id)
+    if names is not None:
+        check("name",names,find_suspects(names,INVALID_NAME_LINES),check_valid_name)
+    if phones is not None:
+        check("phone",phones,find_suspects(phones,INVALID_PHONE_LINES),check_valid_phone_number)
+    if emails is not None:
+        given = [row for row, email in enumerate(emails) if email is not None]
+        suspects = find_suspects([emails[row] for row in given],INVALID_EMAIL_LINES)
+        check("email",emails,[given[row] for row in suspects],check_email_format)
+    failures.sort(key=lambda failure: failure["row"])
+    return failures
+
+def trusted_contact(name,phone,contact_id,email=None):
+    # A Contact built without the checks in __init__, for values that were already validated
+    contact = Contact.__new__(Contact)
+    contact.name = name
+    contact.phone = phone
+    contact.contact_id = contact_id
+    contact.email = email
+    contact._book = None
+    return contact
+
 class Contact:
+    __slots__ = ("name","phone","contact_id","email","_book")
+
     def __init__(self,name,phone,contact_id,email=None):
-        if len(name.strip()) <= 0:
-            raise ValueError("Name cannot be empty.")
+        check_valid_name(name)
         
         
         valid_phone_number = check_valid_phone_number(phone)
@@ -45,16 +133,27 @@ class Contact:
         self.phone = valid_phone_number
         self.contact_id = valid_contact_id
         self.email = valid_email
+        # The ContactBook holding this contact, so it can keep its indexes in sync
+        self._book = None
 
     def update(self,name=None,phone=None,email=None):
+        # Checked before anything changes, so a bad value leaves the contact and the indexes as they were
+        if name is not None:
+            check_valid_name(name)
+        if phone is not None:
+            check_valid_phone_number(phone)
+        if email is not None:
+            check_email_format(email)
+        old_name = self.name
+        old_phone = self.phone
         if name is not None:
-            if len(name.strip()) <= 0:
-                raise ValueError("Name cannot be empty.")
             self.name = name
         if phone is not None:
-            self.phone = check_valid_phone_number(phone)
+            self.phone = phone
         if email is not None:
-            self.email = check_email_format(email)
+            self.email = email
+        if self._book is not None:
+            self._book._contact_changed(self,old_name,old_phone)
 
     def to_dict(self):
         return {"contact_id":self.contact_id,"name":self.name,"phone":self.phone,"email":self.email}
@@ -62,52 +161,1311 @@ class Contact:
     def __str__(self):
         return f"ID: {self.contact_id} | Name: {self.name} | Phone Number: {self.phone} | Email: {"Not yet provided" if self.email is None else self.email} "
     
+class ContactView:
+    # Stands in for a Contact kept in ContactColumns. It points at a row, so a view taken
+    # before a delete may point at another contact afterwards. The deleted contact's own
+    # view is detached and keeps its values.
+    __slots__ = ("columns","row")
+
+    def __init__(self,columns,row):
+        self.columns = columns
+        self.row = row
+
+    @property
+    def contact_id(self):
+        return self.columns.ids[self.row]
+
+    @contact_id.setter
+    def contact_id(self,contact_id):
+        self.columns.ids[self.row] = contact_id
+
+    @property
+    def name(self):
+        return self.columns.names[self.row]
+
+    @name.setter
+    def name(self,name):
+        self.columns.names[self.row] = name
+
+    @property
+    def phone(self):
+        return unpack_phone(self.columns.phones[self.row])
+
+    @phone.setter
+    def phone(self,phone):
+        self.columns.set_phone(self.row,pack_phone(phone))
+
+    @property
+    def email(self):
+        return self.columns.emails[self.row]
+
+    @email.setter
+    def email(self,email):
+        self.columns.emails[self.row] = email
+
+    @property
+    def _book(self):
+        return self.columns.book
+
+    update = Contact.update
+    to_dict = Contact.to_dict
+    __str__ = Contact.__str__
+
+def pack_phone(phone):
+    # Valid phone numbers are exactly 10 digits, so the integer keeps any leading zeros via unpack_phone
+    if not phone.isascii():
+        raise ValueError("Phone number must use the digits 0-9.")
+    return int(phone)
+
+def unpack_phone(packed_phone):
+    return f"{packed_phone:010d}"
+
+class ContactColumns:
+    # Keeps contacts as parallel columns instead of one object per contact: IDs and
+    # phone numbers packed as integers in arrays, names and emails in plain lists.
+    # Iterating or indexing hands out ContactView objects.
+    def __init__(self,book=None):
+        self.book = book
+        self.ids = array('q')
+        self.phones = array('Q')
+        self.names = []
+        self.emails = []
+        # Set of the packed phones so duplicate checks do not scan the column
+        self.phone_set = set()
+        # IDs only grow while contacts are appended, so lookups can bisect
+        self.ids_sorted = True
+
+    def append(self,contact):
+        phone = pack_phone(contact.phone)
+        if self.ids and contact.contact_id <= self.ids[-1]:
+            self.ids_sorted = False
+        self.ids.append(contact.contact_id)
+        self.phones.append(phone)
+        self.phone_set.add(phone)
+        self.names.append(contact.name)
+        self.emails.append(contact.email)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for row in range(len(self.ids)):
+            yield ContactView(self,row)
+
+    def __getitem__(self,row):
+        if row < 0:
+            row += len(self.ids)
+        if not 0 <= row < len(self.ids):
+            raise IndexError("Contact row out of range.")
+        return ContactView(self,row)
+
+    def row_of(self,contact_id):
+        if self.ids_sorted:
+            row = bisect_left(self.ids,contact_id)
+            return row if row < len(self.ids) and self.ids[row] == contact_id else None
+        try:
+            return self.ids.index(contact_id)
+        except ValueError:
+            return None
+
+    def get(self,contact_id):
+        row = self.row_of(contact_id)
+        return None if row is None else ContactView(self,row)
+
+    @property
+    def phone_set(self):
+        # Columns read from a snapshot build it the first time it is needed
+        if self._phone_set is None:
+            self._phone_set = set(self.phones)
+        return self._phone_set
+
+    @phone_set.setter
+    def phone_set(self,phone_set):
+        self._phone_set = phone_set
+
+    def has_phone(self,phone):
+        return pack_phone(phone) in self.phone_set
+
+    def set_phone(self,row,packed_phone):
+        old_phone = self.phones[row]
+        self.phones[row] = packed_phone
+        self.phone_set.add(packed_phone)
+        if old_phone != packed_phone and old_phone not in self.phones:
+            self.phone_set.discard(old_phone)
+
+    def with_name(self,name):
+        return [ContactView(self,row) for row, contact_name in enumerate(self.names) if contact_name.lower() == name]
+
+    def _detach(self,view):
+        detached = ContactColumns()
+        detached.append(view)
+        view.columns = detached
+        view.row = 0
+
+    def remove(self,view):
+        row = view.row
+        self._detach(view)
+        old_phone = self.phones[row]
+        del self.ids[row]
+        del self.phones[row]
+        del self.names[row]
+        del self.emails[row]
+        if old_phone not in self.phones:
+            self.phone_set.discard(old_phone)
+
+    def remove_many(self,views):
+        # One pass over the columns, however many contacts go
+        rows = {view.row for view in views}
+        kept = ContactColumns(self.book)
+        for view in self:
+            if view.row not in rows:
+                kept.append(view)
+        for view in views:
+            self._detach(view)
+        self.ids, self.phones, self.names, self.emails = kept.ids, kept.phones, kept.names, kept.emails
+        self.phone_set, self.ids_sorted = kept.phone_set, kept.ids_sorted
+
+    def renumber(self):
+        self.ids = array('q',range(1,len(self.ids) + 1))
+        self.ids_sorted = True
+
+# Binary snapshot: the header, then IDs, packed phones, name offsets, email offsets, one byte
+# per contact telling whether the email is missing, the names and the emails. Every block
+# starts on a multiple of 8 bytes, numbers are little-endian.
+SNAPSHOT_MAGIC = b"CBS1"
+SNAPSHOT_HEADER = struct.Struct("<4sIqqqq")
+SNAPSHOT_HAS_NEXT_ID = 1
+SNAPSHOT_IDS_SORTED = 2
+
+def snapshot_format(file_name):
+    # "binary" for a snapshot, "json" for any other file, None if it is missing or empty
+    try:
+        with open(file_name,'rb') as f:
+            magic = f.read(len(SNAPSHOT_MAGIC))
+    except FileNotFoundError:
+        return None
+    if magic == SNAPSHOT_MAGIC:
+        return "binary"
+    return "json" if magic else None
+
+def encode_contact_snapshot(contacts,next_id=None):
+    # next_id is only kept for books with stable IDs
+    if not isinstance(contacts,ContactColumns):
+        columns = ContactColumns()
+        for contact in contacts:
+            columns.append(contact)
+        contacts = columns
+    names, name_offsets, _ = encode_strings(contacts.names)
+    emails, email_offsets, missing_emails = encode_strings(contacts.emails)
+    flags = (SNAPSHOT_HAS_NEXT_ID if next_id is not None else 0) | (SNAPSHOT_IDS_SORTED if contacts.ids_sorted else 0)
+    blocks = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC,flags,len(contacts),next_id or 0,len(names),len(emails))]
+    for block in (little_endian(contacts.ids),little_endian(contacts.phones),little_endian(name_offsets),little_endian(email_offsets),missing_emails,names,emails):
+        block = bytes(block)
+        blocks.append(block + bytes(-len(block) % 8))
+    return b"".join(blocks)
+
+def read_contact_snapshot(buffer,book=None):
+    # Returns ContactColumns and the saved next_id. The numbers are copied out of the buffer
+    # in one go each, names and emails stay encoded until they are used.
+    if len(buffer) < SNAPSHOT_HEADER.size:
+        raise ValueError("The snapshot is cut short.")
+    magic, flags, count, next_id, names_size, emails_size = SNAPSHOT_HEADER.unpack_from(buffer,0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a contact book snapshot.")
+    position = SNAPSHOT_HEADER.size
+
+    def take(size):
+        nonlocal position
+        if position + size > len(buffer):
+            raise ValueError("The snapshot is cut short.")
+        block = view[position:position + size]
+        position += size + -size % 8
+        return block
+
+    def take_array(typecode,length):
+        values = array(typecode)
+        values.frombytes(take(values.itemsize * length))
+        return little_endian(values)
+
+    with memoryview(buffer) as view:
+        columns = ContactColumns(book)
+        columns.ids = take_array('q',count)
+        columns.phones = take_array('Q',count)
+        name_offsets = take_array('q',count + 1)
+        email_offsets = take_array('q',count + 1)
+        missing_emails = bytes(take(count))
+        columns.names = StringColumn(bytes(take(names_size)),name_offsets)
+        columns.emails = StringColumn(bytes(take(emails_size)),email_offsets,missing_emails)
+    columns.phone_set = None
+    columns.ids_sorted = bool(flags & SNAPSHOT_IDS_SORTED)
+    return columns, next_id if flags & SNAPSHOT_HAS_NEXT_ID else None
+
+class SubstringIndex:
+    # Maps every substring of 1 to gram_size characters to the contacts that contain it.
+    # Longer queries intersect the postings of their n-grams, the caller then confirms each candidate.
+    def __init__(self,gram_size=3):
+        self.gram_size = gram_size
+        self.postings = {}
+
+    def grams_of(self,text):
+        grams = set()
+        for size in range(1,self.gram_size + 1):
+            for start in range(len(text) - size + 1):
+                grams.add(text[start:start + size])
+        return grams
+
+    def add(self,text,contact):
+        for gram in self.grams_of(text):
+            self.postings.setdefault(gram,set()).add(contact)
+
+    def remove(self,text,contact):
+        for gram in self.grams_of(text):
+            same_gram = self.postings.get(gram)
+            if same_gram is not None:
+                same_gram.discard(contact)
+                if not same_gram:
+                    del self.postings[gram]
+
+    def candidates(self,query):
+        if len(query) <= self.gram_size:
+            return set(self.postings.get(query,()))
+        gram_postings = []
+        for start in range(len(query) - self.gram_size + 1):
+            same_gram = self.postings.get(query[start:start + self.gram_size])
+            if same_gram is None:
+                return set()
+            gram_postings.append(same_gram)
+        gram_postings.sort(key=len)
+        found = set(gram_postings[0])
+        for same_gram in gram_postings[1:]:
+            found &= same_gram
+            if not found:
+                break
+        return found
+
+# Fuzzy matches need at least this share of trigrams in common with the query
+FUZZY_MIN_SCORE = 0.3
+
+def name_trigrams(text):
+    # Padded like "  ann " so the start of a name weighs more than its middle
+    padded = f"  {text} "
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+def trigram_similarity(grams,other_grams):
+    shared = len(grams & other_grams)
+    return shared / (len(grams) + len(other_grams) - shared)
+
+def edit_distance(text,other):
+    # Levenshtein distance, bit-parallel (Myers, in Hyyro's form): one int holds a whole column
+    # of the table as +1/-1 steps, so each character of other is a handful of int operations
+    # instead of a Python loop over text
+    if not text:
+        return len(other)
+    masks = {}
+    for i, char in enumerate(text):
+        masks[char] = masks.get(char,0) | 1 << i
+    full = (1 << len(text)) - 1
+    last = 1 << (len(text) - 1)
+    up, down = full, 0
+    distance = len(text)
+    for char in other:
+        mask = masks.get(char,0)
+        vertical = mask | down
+        horizontal = (((mask & up) + up) ^ up) | mask
+        right = (down | ~(horizontal | up)) & full
+        left = up & horizontal
+        if right & last:
+            distance += 1
+        elif left & last:
+            distance -= 1
+        right = (right << 1 | 1) & full
+        left = (left << 1) & full
+        up = (left | ~(vertical | right)) & full
+        down = right & vertical
+    return distance
+
+def rank_names(query,scored,limit=None,min_score=FUZZY_MIN_SCORE):
+    # scored: (similarity, name) pairs. Best first, ties broken by edit distance to the query,
+    # then by name. A heap keeps only the names that can still make the top limit, and edit
+    # distances are only worked out among names tied on score.
+    scored = [pair for pair in scored if pair[0] >= min_score]
+    if limit is not None and len(scored) > limit:
+        cutoff = heapq.nlargest(limit,scored,key=lambda pair: pair[0])[-1][0]
+        scored = [pair for pair in scored if pair[0] >= cutoff]
+    scored.sort(key=lambda pair: (-pair[0],pair[1]))
+    ranked = []
+    for _, tied in groupby(scored,key=lambda pair: pair[0]):
+        names = [name for _, name in tied]
+        if len(names) > 1:
+            names.sort(key=lambda name: edit_distance(query,name))
+        ranked.extend(names)
+    return ranked
+
+class FuzzyIndex:
+    # Padded trigrams of every distinct lower-cased name, for ranked fuzzy search. Contacts
+    # sharing a name share one entry, names are counted so the last removal drops it.
+    def __init__(self):
+        self.postings = {}
+        # name -> [number of contacts, number of trigrams]
+        self.names = {}
+
+    def add(self,name):
+        entry = self.names.get(name)
+        if entry is not None:
+            entry[0] += 1
+            return
+        grams = name_trigrams(name)
+        self.names[name] = [1,len(grams)]
+        for gram in grams:
+            self.postings.setdefault(gram,set()).add(name)
+
+    def remove(self,name):
+        entry = self.names.get(name)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if entry[0] > 0:
+            return
+        del self.names[name]
+        for gram in name_trigrams(name):
+            same_gram = self.postings[gram]
+            same_gram.discard(name)
+            if not same_gram:
+                del self.postings[gram]
+
+    def rank(self,query,limit=None,min_score=FUZZY_MIN_SCORE):
+        # A name scoring min_score shares at least min_score * size trigrams with the query, so
+        # it is in one of the rarest size - that + 1 postings. Only those are counted in full,
+        # the common trigrams left over only for the names found there. All counting is done
+        # by Counter and set intersections, in C.
+        grams = name_trigrams(query)
+        size = len(grams)
+        postings = sorted((self.postings.get(gram,()) for gram in grams),key=len)
+        needed = math.ceil(min_score * size - 1e-9)
+        rarest = size - needed + 1
+        shared = Counter()
+        for same_gram in postings[:rarest]:
+            shared.update(same_gram)
+        candidates = set(shared)
+        for same_gram in postings[rarest:]:
+            shared.update(candidates.intersection(same_gram))
+        # Names sharing count trigrams score at most count / size, so going from the highest
+        # count down, the loop stops once that is below min_score or, with a limit, below the
+        # limit-th best score so far. Ties with that score still count.
+        names = self.names
+        scored = []
+        best = []
+        floor = min_score
+        for name, count in shared.most_common():
+            if count / size < floor:
+                break
+            score = count / (size + names[name][1] - count)
+            if score < floor:
+                continue
+            scored.append((score,name))
+            if limit is not None:
+                if len(best) < limit:
+                    heapq.heappush(best,score)
+                else:
+                    heapq.heappushpop(best,score)
+                if len(best) == limit:
+                    floor = max(floor,best[0])
+        return rank_names(query,scored,limit,min_score)
+
+def contact_digest(name,email):
+    return zlib.crc32(f"{name}\n{'' if email is None else email}".encode('utf-8'))
+
+class ChangeFeed:
+    # Per-phone change log of a book for delta sync, see export_delta and apply_delta. Every
+    # change gets the next sequence number of this replica and moves its phone to the end of
+    # entries, so they stay in sequence order and a delta only walks the changes since.
+    # An entry is (seq, time, origin, digest): when and on which replica the change was made,
+    # and contact_digest of the name and email, None once the phone is deleted. Deleted
+    # phones are kept so the delete reaches every replica.
+    #
+    # Kept in <file_name>.changes as one JSON line per change, appended right away, so a
+    # sequence number handed out is never used again even if the contacts were not saved.
+    def __init__(self,file_name):
+        self.file_name = file_name
+        self.replica = None
+        self.seq = 0
+        self.entries = {}
+        # Replica ID -> [its seq applied here, our seq right after]
+        self.peers = {}
+        self.lines = 0
+        self.file = None
+
+    def load(self):
+        is_clean = True
+        try:
+            with open(self.file_name,'r',encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError,TypeError,KeyError):
+                        # The last write was cut off, everything before it is still good
+                        is_clean = False
+                        break
+                    self.lines += 1
+        except FileNotFoundError:
+            pass
+        if self.replica is None:
+            self.replica = os.urandom(8).hex()
+            is_clean = False
+        if is_clean:
+            self.file = open(self.file_name,'a',encoding='utf-8')
+        else:
+            self.compact()
+
+    def _apply(self,record):
+        if isinstance(record,list):
+            phone, seq, changed_at, origin, digest = record
+            entry = self.entries.get(phone)
+            if entry is None or entry[0] != seq:
+                # A new change, a line with the entry's own seq only changes its stamp
+                self.entries.pop(phone,None)
+            self.entries[phone] = (seq,changed_at,origin,digest)
+            self.seq = max(self.seq,seq)
+        elif "peer" in record:
+            self.peers[record["peer"]] = [record["seq"],record["local"]]
+        else:
+            self.replica = record["replica"]
+
+    def _write(self,record):
+        self._apply(record)
+        self.file.write(json.dumps(record,ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.lines += 1
+
+    def change(self,phone,digest):
+        entry = self.entries.get(phone)
+        if entry is not None and entry[3] == digest:
+            return
+        self._write([phone,self.seq + 1,time.time(),self.replica,digest])
+
+    def stamp(self,phone,changed_at,origin,renew=False):
+        # Gives the last change of phone the time and replica it first had elsewhere. With
+        # renew it also gets the next sequence number, so it is sent again to the replicas
+        # that already had it under its old stamp.
+        seq, _, _, digest = self.entries[phone]
+        self._write([phone,self.seq + 1 if renew else seq,changed_at,origin,digest])
+
+    def set_peer(self,replica,seq):
+        self._write({"peer":replica,"seq":seq,"local":self.seq})
+
+    def since(self,seq):
+        # (phone, entry) of the changes after seq, oldest first
+        changes = []
+        for phone in reversed(self.entries):
+            entry = self.entries[phone]
+            if entry[0] <= seq:
+                break
+            changes.append((phone,entry))
+        changes.reverse()
+        return changes
+
+    def compact(self,force=True):
+        # Rewrites the file with one line per phone and peer, without force only once most
+        # lines are outdated
+        if not force and self.lines <= 2 * (len(self.entries) + len(self.peers)) + 1:
+            return
+        self.close()
+        lines = [{"replica":self.replica}]
+        lines += [[phone,*entry] for phone, entry in self.entries.items()]
+        lines += [{"peer":replica,"seq":seq,"local":local} for replica, (seq, local) in self.peers.items()]
+        write_file_atomically(self.file_name,"".join(json.dumps(line,ensure_ascii=False) + "\n" for line in lines).encode('utf-8'))
+        self.lines = len(lines)
+        self.file = open(self.file_name,'a',encoding='utf-8')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# Contacts the menu shows at a time
+LIST_PAGE_SIZE = 20
+CONTACT_SORT_KEYS = ("id","name")
+DELTA_RESOLVE_RULES = ("latest","local","remote")
+
 class ContactBook:
-    def __init__(self, file_name='contacts.json'):
-        self.contacts = []
+    # Set up by the first load, see __getattr__
+    LOADED_ATTRIBUTES = ("contacts","contacts_by_id","contacts_by_phone","contacts_by_name","name_search","phone_search","fuzzy_names",
+                         "next_id","record_versions","pending_changes")
+    # Timed by enable_stats
+    INSTRUMENTED_METHODS = ("load_contacts","save_contacts","contactss","get_contact_by_id","get_contact_by_name","add_contact",
+                            "add_many","update_many","delete_many","reassign_id","export_delta","apply_delta")
+
+    def __init__(self, file_name='contacts.json',stable_ids=False,journal=False,compact_every=1000,progress=None,columnar=False,lazy=True,shared=False,write_behind=None,file_format=None,stats=False,history=False,history_limit=None,change_feed=False):
+        # With columnar, contacts are kept in a ContactColumns instead of a list of Contact objects.
+        # It trades the lookup and search indexes for memory, those become scans over the columns.
+        self.columnar = columnar
         self.file_name = file_name
+        # With stable_ids, IDs are never renumbered or reused and next_id is saved in the file
+        self.stable_ids = stable_ids or shared
+        # With shared, several processes can use the same file. Every contact in it carries a
+        # version, and save_contacts merges the changes made here into what is on disk under
+        # <file_name>.lock instead of overwriting it. Merging needs IDs that never move, so
+        # shared turns on stable_ids. Changes that clash with another process are dropped
+        # and listed in conflicts, the book is then reloaded with the merged contacts.
+        if shared and journal:
+            raise ValueError("A shared contact book cannot use a journal, save_contacts merges instead.")
+        self.shared = shared
+        self.lock_file = file_name + ".lock" if shared else None
+        self.conflicts = []
+        # With write_behind, a background thread saves the contacts write_behind seconds after the
+        # last change, and save_contacts only makes it write right away. The snapshot it saves is
+        # taken under self.lock, so code changing the book while it may run has to hold it
+        # too. Call close() before exiting so a pending write is not lost.
+        if write_behind is not None and (journal or shared):
+            raise ValueError("write_behind cannot be combined with journal or shared.")
+        self.lock = threading.RLock()
+        self.writer = BackgroundWriter(self._write_snapshot,write_behind) if write_behind is not None else None
+        # With journal, every change is appended to <file_name>.journal right away and
+        # folded into the snapshot file every compact_every changes
+        self.journal_file = file_name + ".journal" if journal else None
+        self.compact_every = compact_every
+        self.journal = None
+        # file_format is "json" or "binary" (see encode_contact_snapshot) for a new file, an
+        # existing one is saved again in the format it has. Opening a binary snapshot with
+        # columnar only copies a few arrays, contacts are decoded as they are used.
+        self.file_format = file_format
+        # Filled with the failures from validate_contact_columns when a file fails to load
+        self.invalid_records = []
+        # With lazy, the file is only read the first time the contacts are used
+        self.progress = progress
+        self.is_loaded = False
+        # With stats, calls to the hot path methods are counted and timed, see enable_stats
+        self.stats = None
+        if stats:
+            self.enable_stats()
+        # With history, every change can be undone and redone, see enable_history
+        self.history = None
+        self.keeps_history = history
+        self.history_limit = history_limit
+        # With change_feed, every change is logged by phone for delta sync with other
+        # replicas of the book, see export_delta and apply_delta
+        if shared and change_feed:
+            raise ValueError("A shared contact book cannot keep a change feed, other processes change the file too.")
+        self.feed = None
+        self.keeps_feed = change_feed
+        if not lazy:
+            self._load()
+
+    def __getattr__(self,name):
+        if name in ContactBook.LOADED_ATTRIBUTES and not self.__dict__.get("is_loaded",True):
+            self._load()
+            return getattr(self,name)
+        raise AttributeError(f"'ContactBook' object has no attribute '{name}'")
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def _load(self):
+        self.is_loaded = True
+        self._clear()
+        try:
+            self.load_contacts(self.progress)
+        except ValueError:
+            # Nothing stays loaded, so an empty book is never saved over the file
+            for name in ContactBook.LOADED_ATTRIBUTES:
+                self.__dict__.pop(name,None)
+            self.is_loaded = False
+            raise
+        if self.keeps_history:
+            self.enable_history(self.history_limit)
+        if self.keeps_feed:
+            self.feed = ChangeFeed(self.file_name + ".changes")
+            self.feed.load()
+            self._reconcile_feed()
+
+    def _clear(self):
+        self.contacts = ContactColumns(self) if self.columnar else OrderedRecords()
+        # Indexes for O(1) lookups: ID -> contact, phone -> contact, lower-cased name -> [contacts]
+        self.contacts_by_id = {}
+        self.contacts_by_phone = {}
+        self.contacts_by_name = {}
+        # N-gram indexes used by contactss for substring search
+        self.name_search = SubstringIndex()
+        self.phone_search = SubstringIndex()
+        # Trigram keys of the names for contactss with fuzzy
+        self.fuzzy_names = FuzzyIndex()
         self.next_id = 1
-        self.load_contacts()
+        # Shared mode: ID -> version when loaded, and ID -> "upsert"/"delete" for changes since
+        self.record_versions = {}
+        self.pending_changes = {}
+
+    def _index_contact(self,contact):
+        if self.columnar:
+            return
+        contact._book = self
+        self.contacts_by_id.setdefault(contact.contact_id,contact)
+        self.contacts_by_phone.setdefault(contact.phone,contact)
+        self.contacts_by_name.setdefault(contact.name.lower(),[]).append(contact)
+        self.name_search.add(contact.name.lower(),contact)
+        self.phone_search.add(contact.phone,contact)
+        self.fuzzy_names.add(contact.name.lower())
+
+    def _unindex_contact(self,contact,name=None,phone=None,contact_id=None):
+        if self.columnar:
+            return
+        name = contact.name if name is None else name
+        phone = contact.phone if phone is None else phone
+        contact_id = contact.contact_id if contact_id is None else contact_id
+        if self.contacts_by_id.get(contact_id) is contact:
+            del self.contacts_by_id[contact_id]
+        if self.contacts_by_phone.get(phone) is contact:
+            del self.contacts_by_phone[phone]
+        same_name = self.contacts_by_name.get(name.lower())
+        if same_name is not None:
+            for i, indexed in enumerate(same_name):
+                if indexed is contact:
+                    del same_name[i]
+                    break
+            if not same_name:
+                del self.contacts_by_name[name.lower()]
+        self.name_search.remove(name.lower(),contact)
+        self.phone_search.remove(phone,contact)
+        self.fuzzy_names.remove(name.lower())
+
+    def _contact_changed(self,contact,old_name,old_phone):
+        self._unindex_contact(contact,old_name,old_phone)
+        self._index_contact(contact)
+        if old_phone != contact.phone:
+            self._feed_change(old_phone,None)
+        self._feed_change(contact.phone,contact)
+        self._log({"op":"update","contact":contact.to_dict()})
+
+    def _remove_contact(self,contact):
+        self.contacts.remove(contact)
+        self._unindex_contact(contact)
+        self._feed_change(contact.phone,None)
+        self._log({"op":"delete","contact_id":contact.contact_id})
+        if not self.stable_ids:
+            self.reassign_id()
+
+    def _log(self,entry):
+        if self.history is not None:
+            self._track_history(entry)
+        if self.shared:
+            self._track_change(entry)
+        if self.writer is not None:
+            self.writer.request()
+        if self.journal is None:
+            return
+        self.journal.append(entry)
+        if self.journal.entries >= self.compact_every:
+            self.save_contacts()
+
+    def _track_history(self,entry):
+        if entry["op"] in ("add","update"):
+            data = entry["contact"]
+            self.history.put((data["contact_id"],data["name"],data["phone"],data["email"]),self.next_id)
+        elif entry["op"] == "delete":
+            self.history.remove([entry["contact_id"]])
+        elif entry["op"] == "delete_many":
+            self.history.remove(entry["contact_ids"])
+
+    def _track_change(self,entry):
+        if entry["op"] in ("add","update"):
+            self.pending_changes[entry["contact"]["contact_id"]] = "upsert"
+        elif entry["op"] == "delete":
+            self._track_delete(entry["contact_id"])
+        elif entry["op"] == "delete_many":
+            for contact_id in entry["contact_ids"]:
+                self._track_delete(contact_id)
+
+    def _track_delete(self,contact_id):
+        if contact_id in self.record_versions:
+            self.pending_changes[contact_id] = "delete"
+        else:
+            # Added and deleted again before any save, other processes never saw it
+            self.pending_changes.pop(contact_id,None)
+
+    def _apply_journal_entry(self,entry):
+        data = entry.get("contact")
+        if entry["op"] == "add":
+            contact = Contact(data["name"],data["phone"],data["contact_id"],data["email"])
+            self.contacts.append(contact)
+            self._index_contact(contact)
+            self.next_id = max(self.next_id,contact.contact_id + 1)
+        elif entry["op"] == "update":
+            contact = self.get_contact_by_id(data["contact_id"])
+            if contact is not None:
+                contact.update(data["name"],data["phone"],data["email"])
+        elif entry["op"] == "delete":
+            contact = self.get_contact_by_id(entry["contact_id"])
+            if contact is not None:
+                self._remove_contact(contact)
+        elif entry["op"] == "delete_many":
+            self._remove_many([self.get_contact_by_id(contact_id) for contact_id in entry["contact_ids"]])
+
+    def _remove_many(self,contacts):
+        contacts = [contact for contact in contacts if contact is not None]
+        if self.columnar:
+            self.contacts.remove_many(contacts)
+        else:
+            for contact in set(contacts):
+                self.contacts.remove(contact)
+            for contact in contacts:
+                self._unindex_contact(contact)
+        for contact in contacts:
+            self._feed_change(contact.phone,None)
+        if not self.stable_ids:
+            self.reassign_id()
+
+    def load_contacts(self,progress=None,progress_every=10000):
+        # Contacts are built while the file is parsed, progress(count) is called every progress_every contacts
+        self.file_format = snapshot_format(self.file_name) or self.file_format or "json"
+        if self.file_format == "binary":
+            saved_next_id = self._load_snapshot()
+        else:
+            saved_next_id = self._load_json(progress,progress_every)
+
+        if progress is not None:
+            progress(len(self.contacts))
+
+        if self.stable_ids:
+            highest_id = max(self.contacts.ids if self.columnar else self.contacts_by_id,default=0)
+            self.next_id = max(self.next_id,highest_id + 1,saved_next_id or 1)
+        elif saved_next_id is not None:
+            # A file saved with stable IDs may have gaps, the legacy mode expects 1..n
+            self.reassign_id()
+
+        if self.journal_file is not None:
+            journal = Journal(self.journal_file)
+            for entry in journal.replay(file_checksum(self.file_name)):
+                self._apply_journal_entry(entry)
+            self.journal = journal
+            if journal.is_clean and journal.entries == 0:
+                journal.resume()
+            else:
+                # Fold the replayed changes into the snapshot and start a fresh journal
+                self.save_contacts()
 
-    def load_contacts(self):
+    def _load_json(self,progress,progress_every):
+        # Records are read in batches of progress_every. Unless the file checksum matches,
+        # each batch is validated as a whole first, and after the first invalid contact the
+        # rest of the file is only validated, to report every failing record at the end.
         try:
-            with open(self.file_name,'r',encoding='utf-8') as f:
-                data_contacts = json.load(f)
+            with self._file_lock(exclusive=False), open(self.file_name,'rb') as f:
+                trusted = json_snapshot_is_intact(f)
+                f.seek(0)
+                stream = RecordStream(io.TextIOWrapper(f,encoding='utf-8'),"contacts")
+                records = iter(stream)
+                failures = []
+                first_row = 0
+                while True:
+                    batch = list(islice(records,progress_every))
+                    if not batch:
+                        break
+                    if not trusted:
+                        for failure in validate_contact_columns([data.get("contact_id") for data in batch],[data.get("name") for data in batch],
+                                                                [data.get("phone") for data in batch],[data.get("email") for data in batch]):
+                            failure["row"] += first_row
+                            failures.append(failure)
+                    first_row += len(batch)
+                    if failures:
+                        continue
+                    for data in batch:
+                        self._load_record(data,trusted=True)
+                    self.next_id += len(batch)
+                    if progress is not None and len(batch) == progress_every:
+                        progress(len(self.contacts))
+                if failures:
+                    self.invalid_records = failures
+                    details = "; ".join(f"record {failure['row'] + 1} {failure['field']}: {failure['error']}" for failure in failures[:3])
+                    raise ValueError(f"{self.file_name} has {len(failures)} invalid values and was not loaded ({details}). The full list is in invalid_records.")
+                return stream.header.get("next_id")
+        except FileNotFoundError:
+            try:
+                with open(self.file_name,'x') as f:
+                    json.dump([],f,indent=5,ensure_ascii=False)
+            except FileExistsError:
+                # Another process of a shared book created it first
+                pass
+        except json.decoder.JSONDecodeError as e:
+            if os.path.getsize(self.file_name) > 0:
+                # Starting over from an empty book would overwrite the contacts on the next save
+                raise ValueError(f"{self.file_name} is damaged and was not loaded ({e}). Repair or move it, then try again.")
+            self._clear()
+        return None
+
+    def _load_snapshot(self):
+        if self.shared:
+            raise ValueError("A shared contact book has to be a JSON file.")
+        try:
+            with open(self.file_name,'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as buffer:
+                    columns, saved_next_id = read_contact_snapshot(buffer,self)
         except FileNotFoundError:
-           with open(self.file_name,'x') as f:
-               json.dump([],f,indent=5,ensure_ascii=False)
-               data_contacts = []
-        except json.decoder.JSONDecodeError:
-            data_contacts = []
-
-        if data_contacts:
-            for data in data_contacts:
-                contact_loading = Contact(data["name"],data["phone"],data["contact_id"],data["email"])
+            write_file_atomically(self.file_name,encode_contact_snapshot([]))
+            return None
+        except ValueError as e:
+            raise ValueError(f"{self.file_name} is damaged and was not loaded ({e}). Repair or move it, then try again.")
+        if self.columnar:
+            self.contacts = columns
+        else:
+            # Snapshots are only written from contacts that passed the checks
+            for contact in columns:
+                contact_loading = trusted_contact(contact.name,contact.phone,contact.contact_id,contact.email)
                 self.contacts.append(contact_loading)
-                self.next_id += 1
+                self._index_contact(contact_loading)
+        self.next_id = len(self.contacts) + 1
+        return saved_next_id
+
+    def _load_record(self,data,trusted=False):
+        if trusted:
+            contact_loading = trusted_contact(data["name"],data["phone"],data["contact_id"],data.get("email"))
+        else:
+            contact_loading = Contact(data["name"],data["phone"],data["contact_id"],data["email"])
+        self.contacts.append(contact_loading)
+        self._index_contact(contact_loading)
+        if self.shared:
+            self.record_versions[contact_loading.contact_id] = data.get("version",0)
+
+    def _file_lock(self,exclusive=True):
+        if self.lock_file is None:
+            return contextlib.nullcontext()
+        return FileLock(self.lock_file,exclusive)
+
+    def _merge_and_save(self):
+        # Runs under the exclusive lock: read what is on disk now, apply the changes made here
+        # to the records nobody else touched since they were loaded, write, then reload
+        if not self.is_loaded:
+            # Loading takes the shared lock, so it cannot happen inside the exclusive one
+            self._load()
+        with self._file_lock():
+            try:
+                with open(self.file_name,'r',encoding='utf-8') as f:
+                    stream = RecordStream(f,"contacts")
+                    records = {data["contact_id"]:data for data in stream}
+                    next_id = stream.header.get("next_id") or 1
+            except FileNotFoundError:
+                records = {}
+                next_id = 1
+            next_id = max(next_id,max(records,default=0) + 1,self.next_id)
+            self.conflicts = []
+
+            def unchanged_elsewhere(contact_id):
+                saved = records.get(contact_id)
+                return saved is not None and saved.get("version",0) == self.record_versions[contact_id]
+
+            # Deletes and the old phones of updated contacts go first, so phones can move between contacts
+            upserts = []
+            for contact_id, change in self.pending_changes.items():
+                if contact_id not in self.record_versions:
+                    upserts.append(contact_id)
+                elif not unchanged_elsewhere(contact_id):
+                    if change == "delete" and contact_id not in records:
+                        continue
+                    self.conflicts.append({"contact_id":contact_id,"change":change,"error":f"Contact with ID {contact_id} was changed by another process."})
+                elif change == "delete":
+                    del records[contact_id]
+                else:
+                    upserts.append(contact_id)
+            upserted = {contact_id for contact_id in upserts if contact_id in self.record_versions}
+            phone_owners = {data["phone"]:contact_id for contact_id, data in records.items() if contact_id not in upserted}
+
+            for contact_id in upserts:
+                data = self.get_contact_by_id(contact_id).to_dict()
+                if contact_id in self.record_versions:
+                    data["version"] = self.record_versions[contact_id] + 1
+                else:
+                    if contact_id in records:
+                        # Another process added a contact with the same ID meanwhile
+                        data["contact_id"] = next_id
+                    data["version"] = 1
+                if data["phone"] in phone_owners:
+                    self.conflicts.append({"contact_id":contact_id,"change":"upsert","error":f"Phone number: {data['phone']} already exists."})
+                    if contact_id in self.record_versions:
+                        phone_owners[records[contact_id]["phone"]] = contact_id
+                    continue
+                records[data["contact_id"]] = data
+                phone_owners[data["phone"]] = data["contact_id"]
+                next_id = max(next_id,data["contact_id"] + 1)
+
+            data_to_save = {"next_id":next_id,"contacts":[records[contact_id] for contact_id in sorted(records)]}
+            self._write_file(data_to_save)
+
+            # Start over from the merged contacts, this also brings in what other processes saved
+            self._clear()
+            for data in data_to_save["contacts"]:
+                self._load_record(data)
+            self.next_id = next_id
+
+    def snapshot(self):
+        # What a save writes: bytes for a binary file, the data to dump for JSON. Nothing in it
+        # is shared with the contact book, so it can be written out while they change.
+        if self.stable_ids:
+            next_id = self.next_id
+        else:
+            self.reassign_id()
+            next_id = None
+        if self.file_format == "binary":
+            return encode_contact_snapshot(self.contacts,next_id)
+        contacts = [contact.to_dict() for contact in self.contacts]
+        return {"contacts":contacts} if next_id is None else {"next_id":next_id,"contacts":contacts}
+
+    def _write_snapshot(self):
+        with self.lock:
+            data_to_save = self.snapshot()
+        self._write_file(data_to_save)
+
+    def _write_file(self,data):
+        written = write_file_atomically(self.file_name,data)
+        if self.stats is not None:
+            self.stats.add("bytes_written",written)
+            self.stats.add("saves")
+
+    def enable_history(self,limit=None):
+        # Starts undo/redo from the contacts as they are now, limit caps the number of undo steps
+        # kept. Undoing rebuilds the contact book from the version it goes back to. With a journal
+        # the file is saved right away, otherwise with the next save_contacts.
+        if self.shared:
+            raise ValueError("A shared contact book cannot keep a history, other processes change the file too.")
+        self.history = History([(item.contact_id,item.name,item.phone,item.email) for item in self.contacts],self.next_id,self.stable_ids,limit)
+        return self.history
+
+    def _history(self):
+        if not self.is_loaded:
+            self._load()
+        if self.history is None:
+            raise ValueError("History is off, open the contact book with history=True or call enable_history().")
+        return self.history
+
+    @contextlib.contextmanager
+    def _history_step(self):
+        # Changes made inside become one undo step. History is turned on by the first load,
+        # so that has to happen before the step starts.
+        if not self.is_loaded:
+            self._load()
+        if self.history is None:
+            yield
+            return
+        self.history.depth += 1
+        try:
+            yield
+        finally:
+            self.history.depth -= 1
+            self.history.commit()
+
+    def undo(self):
+        history = self._history()
+        if not history.undo_steps:
+            raise ValueError("Nothing to undo.")
+        history.redo_steps.append(history.committed)
+        self._restore_version(history.undo_steps.pop())
+
+    def redo(self):
+        history = self._history()
+        if not history.redo_steps:
+            raise ValueError("Nothing to redo.")
+        history.undo_steps.append(history.committed)
+        self._restore_version(history.redo_steps.pop())
+
+    def save_version(self,name):
+        # Names the current version, restore_version goes back to it
+        self._history().named[name] = self.history.committed
+
+    def restore_version(self,name):
+        history = self._history()
+        if name not in history.named:
+            raise ValueError(f"No version named {name}.")
+        history.undo_steps.append(history.committed)
+        history.redo_steps.clear()
+        self._restore_version(history.named[name])
+
+    def _restore_version(self,version):
+        records, next_id = version
+        if self.columnar:
+            # Columns have no indexes to keep, they are simply filled again
+            self._clear()
+            for position, (key, record) in enumerate(records.items(),start=1):
+                data = dict(zip(("contact_id","name","phone","email"),record))
+                if not self.stable_ids:
+                    data["contact_id"] = position
+                self._load_record(data,trusted=True)
+            self.history.reset(records,next_id)
+        else:
+            self._apply_version(records,next_id)
+        self.next_id = next_id if self.stable_ids else len(self.contacts) + 1
+        # The journal only logs single changes, a whole version goes straight into the file
+        if self.journal is not None:
+            self.save_contacts()
+        elif self.writer is not None:
+            self.writer.request()
+        if self.feed is not None:
+            self._reconcile_feed()
+
+    def _apply_version(self,records,next_id):
+        # Only the contacts that differ between the current version and records are touched.
+        # All of them leave the indexes before any changes, so phones can swap between contacts.
+        contacts = dict(zip(self.history.keys,self.contacts))
+        removed = set()
+        added = []
+        changed = []
+        for key, old, new in self.history.records.diff(records):
+            if new is None:
+                removed.add(key)
+                self._unindex_contact(contacts[key])
+            elif old is None:
+                added.append((key,trusted_contact(new[1],new[2],new[0],new[3])))
+            else:
+                contact = contacts[key]
+                self._unindex_contact(contact)
+                changed.append((contact,new))
+        for contact, new in changed:
+            contact.name, contact.phone, contact.email = new[1], new[2], new[3]
+            self._index_contact(contact)
+        keys = self.history.keys
+        if removed or added:
+            pairs = [pair for pair in contacts.items() if pair[0] not in removed] + added
+            pairs.sort(key=lambda pair: pair[0])
+            keys = [key for key, _ in pairs]
+            self.contacts = OrderedRecords(contact for _, contact in pairs)
+            for _, contact in added:
+                self._index_contact(contact)
+            if not self.stable_ids:
+                self.reassign_id()
+        self.history.reset(records,next_id,keys,[contact.contact_id for contact in self.contacts])
+
+    def _change_feed(self):
+        if not self.is_loaded:
+            self._load()
+        if self.feed is None:
+            raise ValueError("The change feed is off, open the contact book with change_feed=True.")
+        return self.feed
+
+    def _feed_change(self,phone,contact):
+        # contact is None once phone is deleted
+        if self.feed is not None:
+            self.feed.change(phone,None if contact is None else contact_digest(contact.name,contact.email))
+
+    def _reconcile_feed(self):
+        # Logs the changes that did not go through the change hooks: edits made to the file
+        # elsewhere, changes lost because they were never saved, undo and redo
+        phones = set()
+        for contact in self.contacts:
+            phones.add(contact.phone)
+            self._feed_change(contact.phone,contact)
+        for phone in [phone for phone, entry in self.feed.entries.items() if entry[3] is not None and phone not in phones]:
+            self.feed.change(phone,None)
+
+    def _contacts_with_phones(self,phones):
+        # phone -> contact for those of phones in the book, columnar books scan the phone column once
+        if self.columnar:
+            wanted = {pack_phone(phone) for phone in phones}
+            return {unpack_phone(packed):ContactView(self.contacts,row) for row, packed in enumerate(self.contacts.phones) if packed in wanted}
+        return {phone:self.contacts_by_phone[phone] for phone in phones if phone in self.contacts_by_phone}
+
+    @property
+    def replica_id(self):
+        return self._change_feed().replica
+
+    @property
+    def replica_seq(self):
+        # The sequence number of the last change made to this replica
+        return self._change_feed().seq
+
+    def synced_seq(self,replica_id):
+        # The last sequence number of replica_id applied here, what to ask its export_delta for
+        return self._change_feed().peers.get(replica_id,(0,0))[0]
+
+    def export_delta(self,since=0):
+        # The changes made after sequence number since, one per phone, as a JSON-ready dict
+        # for apply_delta on another replica. Takes time for the changes, not the book.
+        feed = self._change_feed()
+        changes = feed.since(since)
+        contacts = self._contacts_with_phones([phone for phone, entry in changes if entry[3] is not None])
+        return {"replica":feed.replica,"seq":feed.seq,"changes":[self._delta_change(phone,entry,contacts) for phone, entry in changes]}
+
+    def _delta_change(self,phone,entry,contacts):
+        change = {"phone":phone,"seq":entry[0],"time":entry[1],"origin":entry[2]}
+        if entry[3] is None:
+            change["deleted"] = True
+        else:
+            change["name"] = contacts[phone].name
+            change["email"] = contacts[phone].email
+        return change
+
+    def apply_delta(self,delta,resolve="latest"):
+        # Applies export_delta of another replica as one undo step, saved like any other change.
+        # A phone changed on both sides since the last sync with that replica is a conflict,
+        # resolve picks the change kept: "latest" the one made last (by wall clock, then
+        # replica ID), "local" or "remote" always that side, or a function given the local
+        # and the remote change that returns one of them. Replicas that all use "latest" end
+        # up the same whichever way they sync. Returns the number of changes applied and
+        # skipped, the conflicts and the changes that were rejected.
+        feed = self._change_feed()
+        if resolve not in DELTA_RESOLVE_RULES and not callable(resolve):
+            raise ValueError(f"Resolve must be a function or one of: {', '.join(DELTA_RESOLVE_RULES)}.")
+        replica = delta["replica"]
+        if replica == feed.replica:
+            raise ValueError("A delta cannot be applied to the replica it came from.")
+        synced_seq, synced_here = feed.peers.get(replica,(0,0))
+        result = {"applied":0,"skipped":0,"conflicts":[],"rejected":[],"seq":feed.seq}
+        changes = []
+        for change in delta["changes"]:
+            if change.get("origin") == feed.replica:
+                # A change made here coming back, it is either still here or was changed since
+                result["skipped"] += 1
+                continue
+            try:
+                check_valid_phone_number(change["phone"])
+                if not change.get("deleted"):
+                    check_valid_name(change["name"])
+                    check_email_format(change.get("email"))
+            except (ValueError,TypeError,KeyError) as e:
+                result["rejected"].append({"change":change,"error":str(e)})
+                continue
+            changes.append(change)
+        contacts = self._contacts_with_phones([change["phone"] for change in changes])
+
+        taken = []
+        for change in changes:
+            phone = change["phone"]
+            digest = None if change.get("deleted") else contact_digest(change["name"],change.get("email"))
+            stamp = (change["time"],change["origin"])
+            entry = feed.entries.get(phone)
+            if entry is not None and entry[3] == digest:
+                # Both sides hold the same already, the later stamp is kept so they agree on it too.
+                # A replica that took something else in between under an older stamp only gives
+                # way to the later one if it is sent again.
+                if stamp > entry[1:3]:
+                    feed.stamp(phone,*stamp,renew=True)
+                result["skipped"] += 1
+                continue
+            if entry is None:
+                keep_remote = True
+            elif entry[0] > synced_here:
+                local = self._delta_change(phone,entry,contacts)
+                if resolve == "latest":
+                    keep_remote = stamp > entry[1:3]
+                elif resolve in DELTA_RESOLVE_RULES:
+                    keep_remote = resolve == "remote"
+                else:
+                    keep_remote = resolve(local,change) is change
+                result["conflicts"].append({"phone":phone,"local":local,"remote":change,"kept":"remote" if keep_remote else "local"})
+            else:
+                keep_remote = resolve != "latest" or stamp > entry[1:3]
+            if keep_remote:
+                taken.append(change)
+            else:
+                result["skipped"] += 1
+
+        with self._history_step():
+            # Updates first and deletes before adds, so IDs hold and a phone can be deleted and added again
+            deleted = []
+            added = []
+            for change in taken:
+                contact = contacts.get(change["phone"])
+                if change.get("deleted"):
+                    if contact is not None:
+                        deleted.append(contact.contact_id)
+                elif contact is None:
+                    added.append(change)
+                else:
+                    if change.get("email") is None:
+                        contact.email = None
+                    contact.update(change["name"],None,change.get("email"))
+            if deleted:
+                self.delete_many(deleted)
+            refused = set()
+            outcomes = self.add_many([{"name":change["name"],"phone":change["phone"],"email":change.get("email")} for change in added])
+            for change, outcome in zip(added,outcomes):
+                if not outcome["ok"]:
+                    result["rejected"].append({"change":change,"error":outcome["error"]})
+                    refused.add(change["phone"])
+            for change in taken:
+                if change["phone"] in refused:
+                    continue
+                if change["phone"] not in feed.entries:
+                    # Deleted there before it ever got here, kept so the delete travels on
+                    feed.change(change["phone"],None)
+                feed.stamp(change["phone"],change["time"],change["origin"])
+                result["applied"] += 1
+            feed.set_peer(replica,max(synced_seq,delta["seq"]))
+        return result
+
+    def skip_echoes(self,replica_id,seq):
+        # After replica_id applied a delta of this book while the two were otherwise in step,
+        # its changes up to seq are this book's own, so the next sync need not send them back
+        feed = self._change_feed()
+        if seq > feed.peers.get(replica_id,(0,0))[0]:
+            feed.set_peer(replica_id,seq)
+
+    def enable_stats(self,profile=False,trace_memory=False):
+        # Wraps the methods in INSTRUMENTED_METHODS on this book only, so without stats the
+        # plain methods run with nothing in between. Returns the Stats, also kept in self.stats.
+        self.disable_stats()
+        self.stats = Stats(profile,trace_memory)
+        for name in ContactBook.INSTRUMENTED_METHODS:
+            setattr(self,name,self.stats.timed(name,getattr(self,name)))
+        return self.stats
+
+    def disable_stats(self):
+        stats = self.stats
+        if stats is None:
+            return None
+        for name in ContactBook.INSTRUMENTED_METHODS:
+            self.__dict__.pop(name,None)
+        stats.close()
+        self.stats = None
+        return stats
+
+    def close(self):
+        if self.stats is not None:
+            self.stats.stop_dumping()
+        if self.writer is not None:
+            self.writer.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.feed is not None:
+            self.feed.compact(force=False)
+            self.feed.close()
 
     def save_contacts(self):
         try:
-            self.reassign_id()
-            data_to_save = [contact.to_dict() for contact in self.contacts]
-            with open(self.file_name,'w',encoding='utf-8') as f:
-                json.dump(data_to_save,f,indent=5,ensure_ascii=False)
+            if self.shared:
+                self._merge_and_save()
+                for conflict in self.conflicts:
+                    print(f"{conflict['error']} Your change was not saved.")
+                return
+            if self.writer is not None:
+                self.writer.flush_now()
+                return
+            self._write_file(self.snapshot())
+            if self.journal is not None:
+                self.journal.reset(file_checksum(self.file_name))
+            if self.feed is not None:
+                self.feed.compact(force=False)
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
 
     def check_duplicate_phone_number(self,check_phone):
         if check_phone is None:
             return None
-        for contact in self.contacts:
-            if contact.phone == check_phone:
-                raise TypeError(f"Phone number: {check_phone} already exists.")
+        if self.columnar:
+            exists = self.contacts.has_phone(check_phone)
+        else:
+            exists = check_phone in self.contacts_by_phone
+        if exists:
+            raise TypeError(f"Phone number: {check_phone} already exists.")
         return check_phone
     
     def reassign_id(self,):
+        if self.columnar:
+            self.contacts.renumber()
+            self.next_id = len(self.contacts) + 1
+            return
+        self.contacts_by_id = {}
         if self.contacts:
             current_id = 1
             for contact in self.contacts:
                 contact.contact_id = current_id
+                self.contacts_by_id[current_id] = contact
                 current_id += 1 
             
             self.next_id = current_id
@@ -121,23 +1479,86 @@ class ContactBook:
         except (ValueError,TypeError) as e:
             print(e)
         else:
-            self.contacts.append(new_contact)
-            self.next_id += 1
+            self._insert_contact(new_contact)
             print(f"New contact: {name} added successfully.")
 
+    def _insert_contact(self,contact):
+        self.contacts.append(contact)
+        self._index_contact(contact)
+        self.next_id = max(self.next_id,contact.contact_id + 1)
+        self._feed_change(contact.phone,contact)
+        self._log({"op":"add","contact":contact.to_dict()})
+
+    def add_many(self,contacts):
+        # contacts: dicts with "name", "phone" and optional "email". Nothing is printed, the
+        # result holds one dict per item in the same order, with either contact_id or error.
+        # Phones already added earlier in the batch count as duplicates too.
+        with self._history_step():
+            results = []
+            for data in contacts:
+                try:
+                    phone = self.check_duplicate_phone_number(data.get("phone",""))
+                    new_contact = Contact(data.get("name",""),phone,self.next_id,data.get("email"))
+                    self._insert_contact(new_contact)
+                except (ValueError,TypeError) as e:
+                    results.append({"ok":False,"error":str(e)})
+                    continue
+                results.append({"ok":True,"contact_id":new_contact.contact_id})
+            return results
+
+    def update_many(self,updates):
+        # updates: dicts with "contact_id" and any of "name", "phone" and "email"
+        with self._history_step():
+            results = []
+            for data in updates:
+                contact_id = data.get("contact_id")
+                contact = self.get_contact_by_id(contact_id)
+                if contact is None:
+                    results.append({"ok":False,"contact_id":contact_id,"error":f"Contact with ID {contact_id} not found."})
+                    continue
+                try:
+                    phone = self.check_duplicate_phone_number(data.get("phone"))
+                    contact.update(data.get("name"),phone,data.get("email"))
+                except (ValueError,TypeError) as e:
+                    results.append({"ok":False,"contact_id":contact_id,"error":str(e)})
+                    continue
+                results.append({"ok":True,"contact_id":contact_id})
+            return results
+
+    def delete_many(self,contact_ids):
+        # IDs refer to the contacts before this call, the remaining contacts are renumbered only once
+        with self._history_step():
+            results = []
+            contacts = {}
+            for contact_id in contact_ids:
+                contact = self.get_contact_by_id(contact_id)
+                if contact is None or contact_id in contacts:
+                    results.append({"ok":False,"contact_id":contact_id,"error":f"Contact with ID {contact_id} not found."})
+                    continue
+                contacts[contact_id] = contact
+                results.append({"ok":True,"contact_id":contact_id})
+            if contacts:
+                self._remove_many(list(contacts.values()))
+                self._log({"op":"delete_many","contact_ids":list(contacts)})
+            return results
+
     def get_contact_by_id(self,contact_id):
-        for contact in self.contacts:
-            if contact.contact_id == contact_id:
-                return contact
-        return None
+        if self.columnar:
+            return self.contacts.get(contact_id)
+        return self.contacts_by_id.get(contact_id)
     
     def get_contact_by_name(self,name):
-        found_contacts = []
-        for contact in self.contacts:
-            if name.strip().lower() == contact.name.lower():
-               found_contacts.append(contact)
-
-        return found_contacts if found_contacts else None
+        if self.columnar:
+            if self.stats is not None:
+                self.stats.add("records_scanned.get_contact_by_name",len(self.contacts))
+            return self.contacts.with_name(name.strip().lower()) or None
+        found_contacts = self.contacts_by_name.get(name.strip().lower())
+        if self.stats is not None:
+            self.stats.add("records_scanned.get_contact_by_name",len(found_contacts or ()))
+        if not found_contacts:
+            return None
+        # Keep the same order as self.contacts, IDs follow the list order
+        return sorted(found_contacts,key=lambda contact: contact.contact_id)
     
     def update_contact_by_id(self,contact_id,name=None,phone=None,email=None):
         contact = self.get_contact_by_id(contact_id)
@@ -189,8 +1610,7 @@ class ContactBook:
         if contact is None:
             raise ValueError(f"Contact with ID {contact_id} not found.")
         else:
-            self.contacts.remove(contact)
-            self.reassign_id()
+            self._remove_contact(contact)
             print(f"Contact with ID {contact_id} has been removed.")
 
     def delete_contact_by_name(self,name):
@@ -199,8 +1619,7 @@ class ContactBook:
             raise ValueError(f"Contact with Name {name} not found")
         else:
             if len(contact) == 1:
-                self.contacts.remove(contact[0])
-                self.reassign_id()
+                self._remove_contact(contact[0])
                 print(f"Contact with Name {contact[0].name} has been removed")
             else:
                 print("Please check the information again and select by ID")
@@ -208,25 +1627,66 @@ class ContactBook:
                 for duplicate_contact in contact:
                     print(duplicate_contact)
 
-    def display_contacts(self):
-        if len(self.contacts) > 0:
-            for contact in self.contacts:
-                print(contact)
+    def iter_contacts(self,sort_by="id"):
+        # Contacts one at a time in ID order, or by lower-cased name and then ID. Only the
+        # order is worked out up front, the contacts are handed out as they are asked for.
+        if sort_by not in CONTACT_SORT_KEYS:
+            raise ValueError(f"Sort by must be one of: {', '.join(CONTACT_SORT_KEYS)}.")
+        if self.columnar:
+            contacts = self.contacts
+            if sort_by == "id" and contacts.ids_sorted:
+                yield from contacts
+                return
+            key = (lambda row: contacts.ids[row]) if sort_by == "id" else (lambda row: (contacts.names[row].lower(),contacts.ids[row]))
+            for row in sorted(range(len(contacts)),key=key):
+                yield contacts[row]
+        elif sort_by == "id":
+            yield from list(self.contacts)
         else:
+            for name in sorted(self.contacts_by_name):
+                yield from sorted(self.contacts_by_name[name],key=lambda contact: contact.contact_id)
+
+    def display_contacts(self,sort_by="id",page_size=None,more=None):
+        # Prints page_size contacts at a time (all of them when None), a page in one write.
+        # Before each further page more() is asked, the listing stops when it returns False.
+        # Contacts on pages that are never shown are never formatted.
+        shown = False
+        for page in pages(self.iter_contacts(sort_by),page_size):
+            if shown and more is not None and not more():
+                return
+            print(render_page(page))
+            shown = True
+        if not shown:
             print("Your contact book is empty. Add a few contacts first!")
 
-    def contactss(self,query,is_name=False,is_phone=False):
+    def contactss(self,query,is_name=False,is_phone=False,limit=None,fuzzy=False):
+        # With fuzzy, names are ranked by how close they are to the query instead of having to
+        # contain it, so typos still find the contact. The best match comes first.
         if True not in [is_name,is_phone]:
             raise TypeError("Please specify if you are searching by a name, phone number, or email.")
+        if fuzzy and is_phone:
+            raise TypeError("Fuzzy search only works on names.")
         if is_phone and not query.isdigit():
             raise TypeError("Phone number must be a series of numbers.")
+        if limit is not None and limit <= 0:
+            raise ValueError("Limit must be greater than zero.")
         
-        match_query = []
+        if fuzzy:
+            match_query = self._fuzzy_matches(query.strip().lower(),limit)
+            if len(match_query) <= 0:
+                raise ValueError(f"Not found any name match with {query}.")
+            return match_query
 
+        match_query = []
+        scanned = 0
 
-        for contact in self.contacts:
+        for scanned, contact in enumerate(self._search_candidates(query,is_name,is_phone,limit),start=1):
             if (is_name and query in contact.name.lower()) or (is_phone and query in contact.phone):
                 match_query.append(contact)
+                if limit is not None and len(match_query) >= limit:
+                    break
+        if self.stats is not None:
+            self.stats.add("records_scanned.contactss",scanned)
                 
         if len(match_query) <= 0:
             if is_name:
@@ -236,17 +1696,79 @@ class ContactBook:
 
         return match_query
 
+    def _search_candidates(self,query,is_name,is_phone,limit):
+        # Contacts that may match, in contact book order (which is ID order), contactss confirms each one
+        if self.columnar:
+            return self.contacts
+        if len(query) == 0:
+            candidates = set(self.contacts)
+        else:
+            candidates = set()
+            if is_name:
+                candidates |= self.name_search.candidates(query)
+            if is_phone:
+                candidates |= self.phone_search.candidates(query)
+        if limit is None:
+            return sorted(candidates,key=lambda contact: contact.contact_id)
+        return self._pop_in_id_order(candidates)
+
+    def _fuzzy_matches(self,query,limit):
+        matches = []
+        for name in self._fuzzy_names(query,limit):
+            matches.extend(self.get_contact_by_name(name) or ())
+            if limit is not None and len(matches) >= limit:
+                return matches[:limit]
+        return matches
+
+    def _fuzzy_names(self,query,limit):
+        if self.columnar:
+            # No index in columnar mode, score every distinct name
+            grams = name_trigrams(query)
+            names = {name.lower() for name in self.contacts.names}
+            return rank_names(query,((trigram_similarity(grams,name_trigrams(name)),name) for name in names),limit)
+        return self.fuzzy_names.rank(query,limit)
+
+    def _pop_in_id_order(self,contacts):
+        # Heapify is linear, so a limited search only pays log n for the results it actually takes
+        heap = [(contact.contact_id,order,contact) for order, contact in enumerate(contacts)]
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)[2]
+
+def sync_contact_books(book,other,resolve="latest"):
+    # Gives each of two replicas the other's changes since they last synced. With "local" or
+    # "remote", other resolves conflicts the opposite way, so both keep the same side.
+    mirrored = {"local":"remote","remote":"local"}.get(resolve,resolve)
+    delta = other.export_delta(book.synced_seq(other.replica_id))
+    pulled = book.apply_delta(delta,resolve)
+    pushed = other.apply_delta(book.export_delta(other.synced_seq(book.replica_id)),mirrored)
+    if pushed["seq"] == delta["seq"]:
+        book.skip_echoes(other.replica_id,other.replica_seq)
+    return pulled, pushed
+
 def check_action_input(action):
-    action_list = ["view","add","search","delete","exit"]
+    action_list = ["view","add","search","delete","undo","redo","exit"]
     if not action.isalpha() or action not in action_list:
-        raise ValueError("Invalid action. Please choose from (View/Add/Search/Delete/Exit).")
+        raise ValueError("Invalid action. Please choose from (View/Add/Search/Delete/Undo/Redo/Exit).")
     return action       
 
+def check_sort_input(sort_by):
+    if not sort_by.isalpha() or sort_by not in CONTACT_SORT_KEYS:
+        raise ValueError("Invalid order. Please choose from (ID/Name).")
+    return sort_by
+
+def ask_for_more():
+    return input("Press Enter for the next page, or Q to stop: ").strip().lower() != "q"
+
 def main():
-    contactbook = ContactBook()
+    try:
+        contactbook = ContactBook(journal=True,lazy=False,history=True)
+    except ValueError as v:
+        print(v)
+        return
     while True:
         print("How can I help you with your contact book?")
-        daft_action = input("(View/Add/Search/Delete/Exit): ").strip().lower()
+        daft_action = input("(View/Add/Search/Delete/Undo/Redo/Exit): ").strip().lower()
         try:
             action = check_action_input(daft_action)
         except ValueError as v:
@@ -259,7 +1781,29 @@ def main():
             break
 
         if action == "view":
-            contactbook.display_contacts()
+            while True:
+                draft_sort = input("Sort contacts by: (ID/Name)? ").strip().lower()
+                try:
+                    sort_by = check_sort_input(draft_sort)
+                except ValueError as v:
+                    print(f"{v}\nPlease try again.")
+                    continue
+                break
+            contactbook.display_contacts(sort_by,LIST_PAGE_SIZE,ask_for_more)
+
+        elif action == "undo":
+            try:
+                contactbook.undo()
+                print("Your last change has been undone.")
+            except ValueError as v:
+                print(v)
+
+        elif action == "redo":
+            try:
+                contactbook.redo()
+                print("Your last undone change has been made again.")
+            except ValueError as v:
+                print(v)
 
         elif action == "add":
             while True:
@@ -324,6 +1868,13 @@ def main():
                             print(contact)
                 except (ValueError,TypeError) as e:
                     print(e)
+                    try:
+                        close_contacts = contactbook.contactss(query,is_name=True,limit=5,fuzzy=True)
+                        print("Closest names:")
+                        for contact in close_contacts:
+                            print(contact)
+                    except ValueError:
+                        pass
             else:
                 try:
                     found_contact = contactbook.contactss(query,is_phone=True)
@@ -378,4 +1929,5 @@ def main():
                 except ValueError as v:
                     print(v)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,271 @@
+import argparse
+import contextlib
+import os
+import sqlite3
+
+from ContactBookApp import CONTACT_SORT_KEYS, Contact, ContactBook, name_trigrams, rank_names, trigram_similarity, trusted_contact
+
+SQLITE_EXTENSIONS = (".db",".sqlite",".sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    row_key INTEGER PRIMARY KEY,
+    contact_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    phone TEXT NOT NULL UNIQUE,
+    email TEXT
+);
+CREATE INDEX IF NOT EXISTS contacts_by_id ON contacts(contact_id);
+CREATE INDEX IF NOT EXISTS contacts_by_name ON contacts(name_lower);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# Trigram full text index for contactss, kept in sync with the contacts table by triggers
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS contacts_search USING fts5(name_lower, phone, content='contacts', content_rowid='row_key', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS contacts_search_insert AFTER INSERT ON contacts BEGIN
+    INSERT INTO contacts_search(rowid, name_lower, phone) VALUES (new.row_key, new.name_lower, new.phone);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_search_delete AFTER DELETE ON contacts BEGIN
+    INSERT INTO contacts_search(contacts_search, rowid, name_lower, phone) VALUES ('delete', old.row_key, old.name_lower, old.phone);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_search_update AFTER UPDATE OF name_lower, phone ON contacts BEGIN
+    INSERT INTO contacts_search(contacts_search, rowid, name_lower, phone) VALUES ('delete', old.row_key, old.name_lower, old.phone);
+    INSERT INTO contacts_search(rowid, name_lower, phone) VALUES (new.row_key, new.name_lower, new.phone);
+END;
+"""
+
+CONTACT_COLUMNS = "contact_id, name, phone, email"
+JOINED_CONTACT_COLUMNS = "contacts.contact_id, contacts.name, contacts.phone, contacts.email"
+
+class SqliteContactBook(ContactBook):
+    # Keeps the contacts in an SQLite database instead of memory. Lookups, duplicate phone
+    # checks and searches become indexed queries, the menus and batch methods of
+    # ContactBook are inherited unchanged. Contacts handed out are built from the rows,
+    # and Contact.update writes back through _contact_changed.
+    def __init__(self,file_name='contacts.db',stable_ids=False):
+        # Without journal, shared (SQLite does its own locking between processes), write_behind
+        # or change_feed, and lazy so ContactBook never reads the file as JSON
+        super().__init__(file_name,stable_ids=stable_ids)
+        self.is_loaded = True
+        # Autocommit, so every single change is saved right away. Batches and changes made of
+        # several statements run inside one transaction.
+        self.connection = sqlite3.connect(file_name,isolation_level=None)
+        self.connection.executescript(SCHEMA)
+        try:
+            self.connection.executescript(SEARCH_SCHEMA)
+            self.has_search_index = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 or older than 3.34, searches scan the table
+            self.has_search_index = False
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.connection.in_transaction:
+            yield
+            return
+        self.connection.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def enable_history(self,limit=None):
+        raise ValueError("An SQLite contact book keeps no history, back up the database file instead.")
+
+    def _contact_from_row(self,row):
+        # Rows were checked on the way in
+        contact = trusted_contact(row[1],row[2],row[0],row[3])
+        contact._book = self
+        return contact
+
+    def _select(self,where="",parameters=()):
+        cursor = self.connection.execute(f"SELECT {CONTACT_COLUMNS} FROM contacts {where}",parameters)
+        return [self._contact_from_row(row) for row in cursor]
+
+    @property
+    def contacts(self):
+        return self._select("ORDER BY contact_id")
+
+    @property
+    def next_id(self):
+        highest_id = self.connection.execute("SELECT MAX(contact_id) FROM contacts").fetchone()[0] or 0
+        if not self.stable_ids:
+            return highest_id + 1
+        saved = self.connection.execute("SELECT value FROM settings WHERE key = 'next_id'").fetchone()
+        return max(highest_id + 1,saved[0] if saved else 1)
+
+    @next_id.setter
+    def next_id(self,next_id):
+        if self.stable_ids:
+            self.connection.execute("INSERT OR REPLACE INTO settings(key, value) VALUES ('next_id', ?)",(next_id,))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+
+    def load_contacts(self,progress=None,progress_every=10000):
+        if progress is not None:
+            progress(len(self))
+
+    def save_contacts(self):
+        if self.connection.in_transaction:
+            self.connection.commit()
+
+    def _insert_contact(self,contact):
+        try:
+            self.connection.execute("INSERT INTO contacts(contact_id, name, name_lower, phone, email) VALUES (?, ?, ?, ?, ?)",
+                                    (contact.contact_id,contact.name,contact.name.lower(),contact.phone,contact.email))
+        except sqlite3.IntegrityError:
+            raise TypeError(f"Phone number: {contact.phone} already exists.")
+        contact._book = self
+        if self.stable_ids:
+            self.next_id = max(self.next_id,contact.contact_id + 1)
+
+    def _contact_changed(self,contact,old_name,old_phone):
+        try:
+            self.connection.execute("UPDATE contacts SET name = ?, name_lower = ?, phone = ?, email = ? WHERE contact_id = ?",
+                                    (contact.name,contact.name.lower(),contact.phone,contact.email,contact.contact_id))
+        except sqlite3.IntegrityError:
+            # The row still holds the values from before the update, the contact goes back to them
+            phone = contact.phone
+            contact.name, contact.phone, contact.email = self.connection.execute("SELECT name, phone, email FROM contacts WHERE contact_id = ?",(contact.contact_id,)).fetchone()
+            raise TypeError(f"Phone number: {phone} already exists.")
+
+    def _remove_contact(self,contact):
+        with self.transaction():
+            self.connection.execute("DELETE FROM contacts WHERE contact_id = ?",(contact.contact_id,))
+            if not self.stable_ids:
+                # IDs are 1..n in this mode, closing the gap keeps them that way
+                self.connection.execute("UPDATE contacts SET contact_id = contact_id - 1 WHERE contact_id > ?",(contact.contact_id,))
+
+    def _remove_many(self,contacts):
+        contact_ids = [(contact.contact_id,) for contact in contacts if contact is not None]
+        with self.transaction():
+            self.connection.executemany("DELETE FROM contacts WHERE contact_id = ?",contact_ids)
+            if not self.stable_ids:
+                self.reassign_id()
+
+    def reassign_id(self,):
+        rows = self.connection.execute("SELECT row_key, contact_id FROM contacts ORDER BY contact_id, row_key").fetchall()
+        changes = [(new_id,row_key) for new_id, (row_key, contact_id) in enumerate(rows,start=1) if contact_id != new_id]
+        with self.transaction():
+            self.connection.executemany("UPDATE contacts SET contact_id = ? WHERE row_key = ?",changes)
+
+    def add_many(self,contacts):
+        with self.transaction():
+            return super().add_many(contacts)
+
+    def update_many(self,updates):
+        with self.transaction():
+            return super().update_many(updates)
+
+    def delete_many(self,contact_ids):
+        with self.transaction():
+            return super().delete_many(contact_ids)
+
+    def check_duplicate_phone_number(self,check_phone):
+        if check_phone is None:
+            return None
+        if self.connection.execute("SELECT 1 FROM contacts WHERE phone = ?",(check_phone,)).fetchone():
+            raise TypeError(f"Phone number: {check_phone} already exists.")
+        return check_phone
+
+    def get_contact_by_id(self,contact_id):
+        found_contacts = self._select("WHERE contact_id = ? ORDER BY row_key LIMIT 1",(contact_id,))
+        return found_contacts[0] if found_contacts else None
+
+    def get_contact_by_name(self,name):
+        found_contacts = self._select("WHERE name_lower = ? ORDER BY contact_id",(name.strip().lower(),))
+        return found_contacts if found_contacts else None
+
+    def iter_contacts(self,sort_by="id"):
+        # Rows are fetched from the cursor as the pages are shown
+        if sort_by not in CONTACT_SORT_KEYS:
+            raise ValueError(f"Sort by must be one of: {', '.join(CONTACT_SORT_KEYS)}.")
+        order = "contact_id" if sort_by == "id" else "name_lower, contact_id"
+        for row in self.connection.execute(f"SELECT {CONTACT_COLUMNS} FROM contacts ORDER BY {order}"):
+            yield self._contact_from_row(row)
+
+    def _search_candidates(self,query,is_name,is_phone,limit):
+        columns = [column for column, wanted in (("name_lower",is_name),("phone",is_phone)) if wanted]
+        if len(query) == 0:
+            cursor = self.connection.execute(f"SELECT {CONTACT_COLUMNS} FROM contacts ORDER BY contact_id")
+        elif self.has_search_index and len(query) >= 3:
+            # The trigram index folds case, so it can return a few extra rows, contactss filters them out
+            phrase = '"' + query.replace('"','""') + '"'
+            cursor = self.connection.execute(
+                f"SELECT {JOINED_CONTACT_COLUMNS} FROM contacts "
+                "JOIN contacts_search ON contacts_search.rowid = contacts.row_key "
+                "WHERE contacts_search MATCH ? ORDER BY contacts.contact_id",
+                ("{" + " ".join(columns) + "} : " + phrase,))
+        else:
+            conditions = " OR ".join(f"instr({column}, ?) > 0" for column in columns)
+            cursor = self.connection.execute(f"SELECT {CONTACT_COLUMNS} FROM contacts WHERE {conditions} ORDER BY contact_id",(query,) * len(columns))
+        return (self._contact_from_row(row) for row in cursor)
+
+    def _fuzzy_names(self,query,limit):
+        grams = name_trigrams(query)
+        names = [row[0] for row in self.connection.execute("SELECT DISTINCT name_lower FROM contacts")]
+        return rank_names(query,((trigram_similarity(grams,name_trigrams(name)),name) for name in names),limit)
+
+def open_contact_book(file_name,**options):
+    # SQLite for .db/.sqlite/.sqlite3 files, the JSON ContactBook for anything else
+    if file_name.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteContactBook(file_name,stable_ids=options.get("stable_ids",False))
+    return ContactBook(file_name,**options)
+
+def migrate_contacts(source_name,target_name,stable_ids=False):
+    # Copies every contact, with its ID, from one storage file to a new one of the other format.
+    # Returns the number copied and the contacts the target refused (e.g. duplicate phones).
+    if os.path.exists(target_name) and os.path.getsize(target_name) > 0:
+        raise ValueError(f"{target_name} already exists, migrate into a new file.")
+    # With journal, changes a JSON source has not folded into its file yet are replayed first
+    source = open_contact_book(source_name,stable_ids=stable_ids,journal=True)
+    try:
+        target = open_contact_book(target_name,stable_ids=stable_ids)
+        try:
+            copied = 0
+            rejected = []
+            transaction = target.transaction() if isinstance(target,SqliteContactBook) else contextlib.nullcontext()
+            with transaction:
+                for contact in source.contacts:
+                    try:
+                        target._insert_contact(Contact(contact.name,contact.phone,contact.contact_id,contact.email))
+                    except (ValueError,TypeError) as e:
+                        rejected.append({"contact":contact.to_dict(),"error":str(e)})
+                    else:
+                        copied += 1
+                target.next_id = max(target.next_id,source.next_id)
+            target.save_contacts()
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return copied, rejected
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy a contact book between the JSON and SQLite formats.")
+    parser.add_argument("source",help="e.g. contacts.json")
+    parser.add_argument("target",help="e.g. contacts.db, must not exist yet")
+    parser.add_argument("--stable-ids",action="store_true",help="keep IDs and next_id as they are (stable ID mode)")
+    options = parser.parse_args()
+    try:
+        copied, rejected = migrate_contacts(options.source,options.target,options.stable_ids)
+    except ValueError as v:
+        print(v)
+        return
+    print(f"Migrated {copied} contacts from {options.source} to {options.target}.")
+    for row in rejected:
+        print(f"Skipped {row['contact']}: {row['error']}")
+
+if __name__ == "__main__":
+    main()
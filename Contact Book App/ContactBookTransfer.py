@@ -0,0 +1,305 @@
+import argparse
+import contextlib
+import csv
+import io
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from ContactBookApp import trusted_contact, validate_contact_columns
+from ContactBookStorage import CONTACT_COLUMNS, SqliteContactBook, open_contact_book
+
+CSV_EXTENSIONS = (".csv",)
+VCARD_EXTENSIONS = (".vcf",".vcard")
+CSV_COLUMNS = ("contact_id","name","phone","email")
+# Characters people write between the digits of a phone number, dropped before the phone check
+PHONE_SEPARATORS = str.maketrans("",""," -().")
+
+def file_format_of(file_name,file_format=None):
+    if file_format is not None:
+        return file_format
+    if file_name.lower().endswith(CSV_EXTENSIONS):
+        return "csv"
+    if file_name.lower().endswith(VCARD_EXTENSIONS):
+        return "vcard"
+    raise ValueError(f"Cannot tell the format of {file_name}, use a .csv or .vcf file or pass the format.")
+
+def csv_chunks(f,chunk_size):
+    # Splits a CSV file into (first line number, header, text) chunks of about chunk_size rows
+    # without parsing it. A line with an odd number of quotes opens or closes a quoted field,
+    # so chunks only end outside of one and every row stays whole.
+    header_line = f.readline()
+    header = [column.strip().lower() for column in next(csv.reader([header_line]),[])]
+    if "name" not in header or "phone" not in header:
+        raise ValueError("The CSV file needs a header row with name and phone columns.")
+    lines = []
+    rows = 0
+    start = 2
+    in_quotes = False
+    for line_number, line in enumerate(f,start=2):
+        lines.append(line)
+        if line.count('"') % 2:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            rows += 1
+            if rows >= chunk_size:
+                yield start, header, "".join(lines)
+                lines = []
+                rows = 0
+                start = line_number + 1
+    if lines:
+        yield start, header, "".join(lines)
+
+def vcard_chunks(f,chunk_size):
+    # Splits a vCard file into (first line number, None, text) chunks of chunk_size cards
+    lines = []
+    cards = 0
+    start = 1
+    for line_number, line in enumerate(f,start=1):
+        lines.append(line)
+        if line.strip().upper() == "END:VCARD":
+            cards += 1
+            if cards >= chunk_size:
+                yield start, None, "".join(lines)
+                lines = []
+                cards = 0
+                start = line_number + 1
+    if lines:
+        yield start, None, "".join(lines)
+
+def parse_csv(start,header,text):
+    # (line number, name, phone, email) per row, missing cells are empty
+    reader = csv.reader(io.StringIO(text,newline=""))
+    line_number = start
+    for row in reader:
+        row_line = line_number
+        line_number = start + reader.line_num
+        if not any(cell.strip() for cell in row):
+            continue
+        values = dict(zip(header,row))
+        yield row_line, values.get("name",""), values.get("phone",""), values.get("email","")
+
+def unescape_vcard(value):
+    return value.replace("\\n","\n").replace("\\N","\n").replace("\\,",",").replace("\\;",";").replace("\\\\","\\")
+
+def parse_vcard(start,header,text):
+    # Reads FN (or N when there is no FN), the first TEL and the first EMAIL of each card.
+    # Folded lines, which continue with a space or tab, are joined first.
+    lines = []
+    for line_number, line in enumerate(text.splitlines(),start=start):
+        if line[:1] in (" ","\t") and lines:
+            lines[-1][1] += line[1:]
+        elif line.strip():
+            lines.append([line_number,line.strip()])
+    card = None
+    for line_number, line in lines:
+        key, _, value = line.partition(":")
+        name, *parameters = key.split(";")
+        name = name.rsplit(".",1)[-1].upper()
+        if name == "BEGIN" and value.upper() == "VCARD":
+            card = {"line":line_number}
+        elif card is None:
+            continue
+        elif name == "END":
+            full_name = card.get("FN") or " ".join(part for part in reversed(card.get("N","").split(";")[:2]) if part)
+            yield card["line"], full_name, card.get("TEL",""), card.get("EMAIL","")
+            card = None
+        elif name in ("FN","N","TEL","EMAIL"):
+            card.setdefault(name,unescape_vcard(value) if name != "N" else value)
+
+def check_chunk(file_format,start,header,text):
+    # Runs in the worker processes: parses one chunk and validates it with the same checks
+    # as Contact. Returns the valid rows as (line, name, phone, email) and one
+    # {"line","record","error"} per rejected row.
+    parse = parse_csv if file_format == "csv" else parse_vcard
+    rows = []
+    for line_number, name, phone, email in parse(start,header,text):
+        rows.append((line_number,name.strip(),phone.strip().translate(PHONE_SEPARATORS),email.strip() or None))
+    failures = validate_contact_columns(names=[row[1] for row in rows],phones=[row[2] for row in rows],emails=[row[3] for row in rows])
+    errors = {}
+    for failure in failures:
+        errors.setdefault(failure["row"],failure["error"])
+    accepted = []
+    rejected = []
+    for position, row in enumerate(rows):
+        if position in errors:
+            rejected.append({"line":row[0],"record":{"name":row[1],"phone":row[2],"email":row[3]},"error":errors[position]})
+        else:
+            accepted.append(row)
+    return accepted, rejected
+
+def map_in_order(function,jobs,workers):
+    # Results of function(*job) in job order. With workers > 1 the jobs run in a process pool,
+    # with at most two per worker waiting so a large file is never read ahead all at once.
+    if workers <= 1:
+        for job in jobs:
+            yield function(*job)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.submit(function,*job))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def import_contacts(book,file_name,file_format=None,merge=False,workers=None,chunk_size=1000,progress=None,progress_every=10000):
+    # Streams a CSV or vCard file into book. Parsing and validation run in workers processes
+    # (os.cpu_count() when None, 1 to stay in this process), the checked rows are then added
+    # here one by one in file order. A phone that is already in the book, or earlier in the
+    # file, is a duplicate: rejected, or with merge the contact having it takes the new name
+    # and email. The whole import is one undo step and, with SQLite, one transaction.
+    # progress(rows) is called every progress_every rows read. Returns
+    # {"imported","merged","rejected"} with one {"line","record","error"} per rejected row.
+    file_format = file_format_of(file_name,file_format)
+    if file_format not in ("csv","vcard"):
+        raise ValueError(f"Unknown format: {file_format}, use csv or vcard.")
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    report = {"imported":0,"merged":0,"rejected":[]}
+    ids_by_phone = {contact.phone:contact.contact_id for contact in book.contacts} if merge else None
+    rows_read = 0
+    reported = 0
+    transaction = book.transaction() if isinstance(book,SqliteContactBook) else contextlib.nullcontext()
+    with open(file_name,'r',encoding='utf-8-sig',newline='') as f, transaction, book._history_step():
+        chunks = csv_chunks(f,chunk_size) if file_format == "csv" else vcard_chunks(f,chunk_size)
+        jobs = ((file_format,start,header,text) for start, header, text in chunks)
+        for accepted, rejected in map_in_order(check_chunk,jobs,workers):
+            report["rejected"].extend(rejected)
+            for line_number, name, phone, email in accepted:
+                contact_id = ids_by_phone.get(phone) if merge else None
+                if contact_id is not None:
+                    result = book.update_many([{"contact_id":contact_id,"name":name,"email":email}])[0]
+                    if result["ok"]:
+                        report["merged"] += 1
+                    else:
+                        report["rejected"].append({"line":line_number,"record":{"name":name,"phone":phone,"email":email},"error":result["error"]})
+                    continue
+                try:
+                    book.check_duplicate_phone_number(phone)
+                except TypeError as e:
+                    report["rejected"].append({"line":line_number,"record":{"name":name,"phone":phone,"email":email},"error":str(e)})
+                    continue
+                contact = trusted_contact(name,phone,book.next_id,email)
+                book._insert_contact(contact)
+                if merge:
+                    ids_by_phone[phone] = contact.contact_id
+                report["imported"] += 1
+            rows_read += len(accepted) + len(rejected)
+            if progress is not None and rows_read - reported >= progress_every:
+                reported = rows_read
+                progress(rows_read)
+    report["rejected"].sort(key=lambda row: row["line"])
+    if progress is not None:
+        progress(rows_read)
+    book.save_contacts()
+    return report
+
+def contact_rows(book):
+    # (contact_id, name, phone, email) per contact in ID order, read as they are written
+    if isinstance(book,SqliteContactBook):
+        yield from book.connection.execute(f"SELECT {CONTACT_COLUMNS} FROM contacts ORDER BY contact_id")
+        return
+    for contact in book.contacts:
+        yield contact.contact_id, contact.name, contact.phone, contact.email
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(["" if value is None else value for value in row])
+        yield buffer.getvalue()
+
+def escape_vcard(value):
+    return value.replace("\\","\\\\").replace("\n","\\n").replace(",","\\,").replace(";","\\;")
+
+def vcard_lines(rows):
+    for contact_id, name, phone, email in rows:
+        given, _, family = name.strip().rpartition(" ")
+        lines = ["BEGIN:VCARD","VERSION:3.0",f"FN:{escape_vcard(name)}",f"N:{escape_vcard(family)};{escape_vcard(given)};;;",f"TEL;TYPE=CELL:{phone}"]
+        if email is not None:
+            lines.append(f"EMAIL:{escape_vcard(email)}")
+        lines.append("END:VCARD")
+        yield "\r\n".join(lines) + "\r\n"
+
+def export_contacts(book,file_name,file_format=None,progress=None,progress_every=10000):
+    # Writes every contact to a CSV or vCard file as the rows are read, without building the
+    # whole file in memory. Like the saves, it goes to a temporary file renamed over the target.
+    # Returns the number of contacts written.
+    file_format = file_format_of(file_name,file_format)
+    if file_format not in ("csv","vcard"):
+        raise ValueError(f"Unknown format: {file_format}, use csv or vcard.")
+    temp_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    written = 0
+
+    def counted(rows):
+        nonlocal written
+        for row in rows:
+            yield row
+            written += 1
+            if progress is not None and written % progress_every == 0:
+                progress(written)
+
+    lines = csv_lines(counted(contact_rows(book))) if file_format == "csv" else vcard_lines(counted(contact_rows(book)))
+    try:
+        with open(temp_name,'w',encoding='utf-8',newline='') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name,file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    if progress is not None:
+        progress(written)
+    return written
+
+def write_rejected(file_name,rejected):
+    with open(file_name,'w',encoding='utf-8',newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(("line","name","phone","email","error"))
+        for row in rejected:
+            record = row["record"]
+            writer.writerow((row["line"],record["name"],record["phone"],record["email"] or "",row["error"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Import contacts from CSV or vCard files, or export a contact book to one.")
+    parser.add_argument("direction",choices=("import","export"))
+    parser.add_argument("book",help="e.g. contacts.json or contacts.db")
+    parser.add_argument("file",help="e.g. people.csv or people.vcf")
+    parser.add_argument("--format",choices=("csv","vcard"),help="instead of going by the file extension")
+    parser.add_argument("--merge",action="store_true",help="update the contact with the same phone instead of rejecting the row")
+    parser.add_argument("--workers",type=int,help="processes parsing and checking the file, 1 to use none (default: one per CPU)")
+    parser.add_argument("--rejected",help="write the rejected rows to this CSV file")
+    parser.add_argument("--stable-ids",action="store_true",help="keep IDs and next_id as they are (stable ID mode)")
+    options = parser.parse_args()
+
+    def progress(count):
+        print(f"{count} rows done...")
+
+    try:
+        book = open_contact_book(options.book,stable_ids=options.stable_ids,lazy=False)
+        if options.direction == "export":
+            written = export_contacts(book,options.file,options.format,progress)
+            print(f"Exported {written} contacts from {options.book} to {options.file}.")
+            return
+        report = import_contacts(book,options.file,options.format,options.merge,options.workers,progress=progress)
+    except (ValueError,OSError) as e:
+        print(e)
+        return
+    print(f"Imported {report['imported']} contacts and merged {report['merged']} into {options.book}, rejected {len(report['rejected'])}.")
+    if options.rejected:
+        write_rejected(options.rejected,report["rejected"])
+        print(f"The rejected rows are in {options.rejected}.")
+    else:
+        for row in report["rejected"][:20]:
+            print(f"Line {row['line']}: {row['error']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,87 @@
+import calendar
+import contextlib
+import heapq
+import io
 import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from itertools import count
+
+from recordstore import BackgroundWriter, FileLock, History, Journal, OrderedRecords, RecordStream, Stats, StringColumn, encode_strings, file_checksum, json_snapshot_is_intact, little_endian, pages, render_page, write_file_atomically
+
+# How often a repeating task comes back
+REPEAT_RULES = ("hourly","daily","weekly","monthly")
+REPEAT_STEPS = {"hourly":timedelta(hours=1),"daily":timedelta(days=1),"weekly":timedelta(weeks=1)}
+# Due dates are kept in columns as seconds since this, NaN for none
+DUE_EPOCH = datetime(1970,1,1)
+
+def check_due(due):
+    # Due dates are local times to the second, given as a datetime or a string like
+    # "2026-10-18 09:00". One with a time zone is converted to local time.
+    if due is None:
+        return None
+    if isinstance(due,str):
+        try:
+            due = datetime.fromisoformat(due.strip())
+        except ValueError:
+            raise ValueError(f"Invalid due date: {due}, use YYYY-MM-DD HH:MM.")
+    if not isinstance(due,datetime):
+        raise TypeError("Due date must be a datetime or a YYYY-MM-DD HH:MM string.")
+    if due.tzinfo is not None:
+        due = due.astimezone().replace(tzinfo=None)
+    return due.replace(microsecond=0)
+
+def check_repeat(repeat,due):
+    if repeat is None:
+        return None
+    if not isinstance(repeat,str) or repeat.strip().lower() not in REPEAT_RULES:
+        raise ValueError(f"Repeat must be one of: {', '.join(REPEAT_RULES)}.")
+    if due is None:
+        raise ValueError("A repeating task needs a due date.")
+    return sys.intern(repeat.strip().lower())
+
+def due_text(due):
+    return None if due is None else due.isoformat(" ")
+
+def due_seconds(due):
+    return math.nan if due is None else (due - DUE_EPOCH).total_seconds()
+
+def due_from_seconds(seconds):
+    return None if math.isnan(seconds) else DUE_EPOCH + timedelta(seconds=seconds)
+
+def due_slot(due):
+    # The hour a due date falls in, counted from DUE_EPOCH
+    return int(due_seconds(due) // 3600)
+
+def add_months(due,months):
+    month = due.month - 1 + months
+    year = due.year + month // 12
+    month = month % 12 + 1
+    # The 31st falls back to the last day of shorter months
+    return due.replace(year=year,month=month,day=min(due.day,calendar.monthrange(year,month)[1]))
+
+def next_occurrence(due,repeat,now=None):
+    # The first occurrence after both due and now, the ones missed in between are skipped
+    now = max(due,datetime.now() if now is None else now)
+    if repeat == "monthly":
+        months = (now.year - due.year) * 12 + now.month - due.month
+        following = add_months(due,months)
+        return following if following > now else add_months(due,months + 1)
+    step = REPEAT_STEPS[repeat]
+    return due + step * ((now - due) // step + 1)
 
 class Task:
-    def __init__(self,description,task_id,priority_level):
+    __slots__ = ("description","task_id","priority_level","is_completed","due","repeat")
+
+    def __init__(self,description,task_id,priority_level,due=None,repeat=None):
         if len(description.strip()) == 0:
             raise ValueError("Description cannot be empty.")
         if not isinstance(task_id, int):
@@ -11,8 +91,26 @@ class Task:
         
         self.description = description.strip()
         self.task_id = task_id
-        self.priority_level = priority_level
+        # Only a handful of priority levels exist, share one string per level
+        self.priority_level = sys.intern(priority_level) if isinstance(priority_level,str) else priority_level
         self.is_completed = False
+        self.due = check_due(due)
+        self.repeat = check_repeat(repeat,self.due)
+
+    def update(self,description=None,priority_level=None,due=None,repeat=None):
+        # None leaves a field as it is, an empty due or repeat clears it
+        if description is not None and len(description.strip()) == 0:
+            raise ValueError("Description cannot be empty.")
+        # Checked before anything changes, so a bad due date leaves the task as it was
+        due = self.due if due is None else None if due == "" else check_due(due)
+        repeat = self.repeat if repeat is None else None if repeat == "" else repeat
+        repeat = check_repeat(repeat,due)
+        if description is not None:
+            self.description = description.strip()
+        if priority_level is not None:
+            self.priority_level = sys.intern(priority_level) if isinstance(priority_level,str) else priority_level
+        self.due = due
+        self.repeat = repeat
 
     def mark_as_completed(self):
         if not self.is_completed:
@@ -22,98 +120,1146 @@ class Task:
             print(f"Task '{self.description}' (Priority: {self.priority_level}) was already completed.")
 
     def to_dict(self):
-        return {"task_id":self.task_id,"description":self.description,"is_completed":self.is_completed,"priority_level":self.priority_level}
+        task = {"task_id":self.task_id,"description":self.description,"is_completed":self.is_completed,"priority_level":self.priority_level}
+        # Tasks without a due date are saved as before
+        if self.due is not None:
+            task["due"] = due_text(self.due)
+            task["repeat"] = self.repeat
+        return task
     
     def __str__(self):
-        return f"{self.task_id}. {self.priority_level} - {"[X]" if self.is_completed else "[ ]"} {self.description}"
+        schedule = "" if self.due is None else f" (Due: {self.due:%Y-%m-%d %H:%M}{'' if self.repeat is None else ', ' + self.repeat})"
+        return f"{self.task_id}. {self.priority_level} - {"[X]" if self.is_completed else "[ ]"} {self.description}{schedule}"
     
+def trusted_task(description,task_id,priority_level,is_completed=False,due=None,repeat=None):
+    # A Task built without the checks in __init__, for values that were already validated
+    task = Task.__new__(Task)
+    task.description = description
+    task.task_id = task_id
+    task.priority_level = sys.intern(priority_level) if isinstance(priority_level,str) else priority_level
+    task.is_completed = is_completed
+    task.due = due
+    task.repeat = repeat
+    return task
+
+class TaskView:
+    # Stands in for a Task kept in TaskColumns. It points at a row, so a view taken
+    # before a delete may point at another task afterwards. The deleted task's own view
+    # is detached and keeps its values.
+    __slots__ = ("columns","row")
+
+    def __init__(self,columns,row):
+        self.columns = columns
+        self.row = row
+
+    @property
+    def task_id(self):
+        return self.columns.ids[self.row]
+
+    @task_id.setter
+    def task_id(self,task_id):
+        self.columns.ids[self.row] = task_id
+
+    @property
+    def description(self):
+        return self.columns.descriptions[self.row]
+
+    @description.setter
+    def description(self,description):
+        self.columns.descriptions[self.row] = description
+
+    @property
+    def priority_level(self):
+        return self.columns.priority_levels[self.columns.priorities[self.row]]
+
+    @priority_level.setter
+    def priority_level(self,priority_level):
+        self.columns.priorities[self.row] = self.columns.priority_code(priority_level)
+
+    @property
+    def is_completed(self):
+        return bool(self.columns.completed[self.row])
+
+    @is_completed.setter
+    def is_completed(self,is_completed):
+        self.columns.completed[self.row] = bool(is_completed)
+
+    @property
+    def due(self):
+        return due_from_seconds(self.columns.dues[self.row])
+
+    @due.setter
+    def due(self,due):
+        self.columns.dues[self.row] = due_seconds(due)
+
+    @property
+    def repeat(self):
+        code = self.columns.repeats[self.row]
+        return None if code == 0 else REPEAT_RULES[code - 1]
+
+    @repeat.setter
+    def repeat(self,repeat):
+        self.columns.repeats[self.row] = 0 if repeat is None else REPEAT_RULES.index(repeat) + 1
+
+    update = Task.update
+    mark_as_completed = Task.mark_as_completed
+    to_dict = Task.to_dict
+    __str__ = Task.__str__
+
+class TaskColumns:
+    # Keeps tasks as parallel columns instead of one object per task: IDs and completion
+    # flags in arrays and the priority as a small code into self.priority_levels. Due dates
+    # are seconds since DUE_EPOCH (NaN for none), repeats a code into REPEAT_RULES plus one.
+    # Iterating or indexing hands out TaskView objects.
+    def __init__(self):
+        self.ids = array('q')
+        self.completed = array('b')
+        self.priorities = array('H')
+        self.dues = array('d')
+        self.repeats = array('B')
+        self.descriptions = []
+        self.priority_levels = []
+        self.priority_codes = {}
+        # IDs only grow while tasks are appended, so lookups can bisect
+        self.ids_sorted = True
+
+    def priority_code(self,priority_level):
+        code = self.priority_codes.get(priority_level)
+        if code is None:
+            code = len(self.priority_levels)
+            self.priority_levels.append(priority_level)
+            self.priority_codes[priority_level] = code
+        return code
+
+    def append(self,task):
+        if self.ids and task.task_id <= self.ids[-1]:
+            self.ids_sorted = False
+        self.ids.append(task.task_id)
+        self.completed.append(bool(task.is_completed))
+        self.priorities.append(self.priority_code(task.priority_level))
+        self.descriptions.append(task.description)
+        self.dues.append(due_seconds(task.due))
+        self.repeats.append(0 if task.repeat is None else REPEAT_RULES.index(task.repeat) + 1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for row in range(len(self.ids)):
+            yield TaskView(self,row)
+
+    def __getitem__(self,row):
+        if row < 0:
+            row += len(self.ids)
+        if not 0 <= row < len(self.ids):
+            raise IndexError("Task row out of range.")
+        return TaskView(self,row)
+
+    def row_of(self,task_id):
+        if self.ids_sorted:
+            row = bisect_left(self.ids,task_id)
+            return row if row < len(self.ids) and self.ids[row] == task_id else None
+        try:
+            return self.ids.index(task_id)
+        except ValueError:
+            return None
+
+    def get(self,task_id):
+        row = self.row_of(task_id)
+        return None if row is None else TaskView(self,row)
+
+    def _detach(self,view):
+        detached = TaskColumns()
+        detached.append(view)
+        view.columns = detached
+        view.row = 0
+
+    def remove(self,view):
+        row = view.row
+        self._detach(view)
+        del self.ids[row]
+        del self.completed[row]
+        del self.priorities[row]
+        del self.descriptions[row]
+        del self.dues[row]
+        del self.repeats[row]
+
+    def remove_many(self,views):
+        # One pass over the columns, however many tasks go
+        rows = {view.row for view in views}
+        kept = TaskColumns()
+        for view in self:
+            if view.row not in rows:
+                kept.append(view)
+        for view in views:
+            self._detach(view)
+        self.ids, self.completed, self.priorities, self.descriptions = kept.ids, kept.completed, kept.priorities, kept.descriptions
+        self.dues, self.repeats = kept.dues, kept.repeats
+        self.priority_levels, self.priority_codes, self.ids_sorted = kept.priority_levels, kept.priority_codes, kept.ids_sorted
+
+    def remove_completed(self):
+        removed = [view for view in self if view.is_completed]
+        if removed:
+            self.remove_many(removed)
+        return removed
+
+    def renumber(self):
+        self.ids = array('q',range(1,len(self.ids) + 1))
+        self.ids_sorted = True
+
+# Binary snapshot: the header, then IDs, one completed byte per task, priority codes,
+# description offsets, the descriptions and the priority levels as a JSON list. When any task
+# has a due date, the due and repeat columns follow. Every block starts on a multiple of
+# 8 bytes, numbers are little-endian.
+SNAPSHOT_MAGIC = b"TLS1"
+SNAPSHOT_HEADER = struct.Struct("<4sIqqqq")
+SNAPSHOT_HAS_NEXT_ID = 1
+SNAPSHOT_IDS_SORTED = 2
+SNAPSHOT_HAS_SCHEDULE = 4
+
+def snapshot_format(file_name):
+    # "binary" for a snapshot, "json" for any other file, None if it is missing or empty
+    try:
+        with open(file_name,'rb') as f:
+            magic = f.read(len(SNAPSHOT_MAGIC))
+    except FileNotFoundError:
+        return None
+    if magic == SNAPSHOT_MAGIC:
+        return "binary"
+    return "json" if magic else None
+
+def encode_task_snapshot(tasks,next_id=None):
+    # next_id is only kept for lists with stable IDs
+    if not isinstance(tasks,TaskColumns):
+        columns = TaskColumns()
+        for task in tasks:
+            columns.append(task)
+        tasks = columns
+    descriptions, description_offsets, _ = encode_strings(tasks.descriptions)
+    priority_levels = json.dumps(tasks.priority_levels,ensure_ascii=False).encode('utf-8')
+    columns = [little_endian(tasks.ids),tasks.completed,little_endian(tasks.priorities),little_endian(description_offsets),descriptions,priority_levels]
+    has_schedule = any(not math.isnan(due) for due in tasks.dues)
+    if has_schedule:
+        columns += [little_endian(tasks.dues),tasks.repeats]
+    flags = (SNAPSHOT_HAS_NEXT_ID if next_id is not None else 0) | (SNAPSHOT_IDS_SORTED if tasks.ids_sorted else 0) | (SNAPSHOT_HAS_SCHEDULE if has_schedule else 0)
+    blocks = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC,flags,len(tasks),next_id or 0,len(descriptions),len(priority_levels))]
+    for block in columns:
+        block = bytes(block)
+        blocks.append(block + bytes(-len(block) % 8))
+    return b"".join(blocks)
+
+def read_task_snapshot(buffer):
+    # Returns TaskColumns and the saved next_id. The numbers are copied out of the buffer
+    # in one go each, descriptions stay encoded until they are used.
+    if len(buffer) < SNAPSHOT_HEADER.size:
+        raise ValueError("The snapshot is cut short.")
+    magic, flags, count, next_id, descriptions_size, priority_levels_size = SNAPSHOT_HEADER.unpack_from(buffer,0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a to-do list snapshot.")
+    position = SNAPSHOT_HEADER.size
+
+    def take(size):
+        nonlocal position
+        if position + size > len(buffer):
+            raise ValueError("The snapshot is cut short.")
+        block = view[position:position + size]
+        position += size + -size % 8
+        return block
+
+    def take_array(typecode,length):
+        values = array(typecode)
+        values.frombytes(take(values.itemsize * length))
+        return little_endian(values)
+
+    with memoryview(buffer) as view:
+        columns = TaskColumns()
+        columns.ids = take_array('q',count)
+        columns.completed = take_array('b',count)
+        columns.priorities = take_array('H',count)
+        description_offsets = take_array('q',count + 1)
+        columns.descriptions = StringColumn(bytes(take(descriptions_size)),description_offsets)
+        columns.priority_levels = json.loads(bytes(take(priority_levels_size)).decode('utf-8'))
+        if flags & SNAPSHOT_HAS_SCHEDULE:
+            columns.dues = take_array('d',count)
+            columns.repeats = take_array('B',count)
+        else:
+            columns.dues = array('d',[math.nan]) * count
+            columns.repeats = array('B',bytes(count))
+    columns.priority_codes = {priority_level:code for code, priority_level in enumerate(columns.priority_levels)}
+    columns.ids_sorted = bool(flags & SNAPSHOT_IDS_SORTED)
+    return columns, next_id if flags & SNAPSHOT_HAS_NEXT_ID else None
+
+# next_task goes through the priorities in this order, any other level comes after them
+PRIORITY_ORDER = ["High","Medium","Low"]
+
+# Tasks the menu shows at a time
+LIST_PAGE_SIZE = 20
+TASK_SORT_KEYS = ("id","priority","due")
+
 class TodoList:
-    def __init__(self,file_name='tasks.json'):
-        self.tasks = []
+    # Set up by the first load, see __getattr__
+    LOADED_ATTRIBUTES = ("tasks","tasks_by_id","task_buckets","due_heap","due_slots","due_slot_keys","scheduled","due_order","next_id","record_versions","pending_changes")
+    # Timed by enable_stats
+    INSTRUMENTED_METHODS = ("load_tasks","save_tasks","add_task","get_task_by_id","mark_task_completed","delete_task","update_id",
+                            "get_tasks","next_task","next_due","overdue","due_within","add_many","update_many","delete_many")
+
+    def __init__(self,file_name='tasks.json',stable_ids=False,journal=False,compact_every=1000,progress=None,columnar=False,lazy=True,shared=False,write_behind=None,file_format=None,stats=False,history=False,history_limit=None):
+        # With columnar, tasks are kept in a TaskColumns instead of a list of Task objects
+        self.columnar = columnar
         self.file_name = file_name
+        # With stable_ids, IDs are never renumbered or reused and next_id is saved in the file
+        self.stable_ids = stable_ids or shared
+        # With shared, several processes can use the same file, see ContactBook. save_tasks
+        # merges the changes made here into the file under <file_name>.lock, tasks changed
+        # by another process meanwhile keep that version and are listed in conflicts.
+        if shared and journal:
+            raise ValueError("A shared to-do list cannot use a journal, save_tasks merges instead.")
+        self.shared = shared
+        self.lock_file = file_name + ".lock" if shared else None
+        self.conflicts = []
+        # With write_behind, a background thread saves the tasks write_behind seconds after the
+        # last change, and save_tasks only makes it write right away. The snapshot it saves is
+        # taken under self.lock, so code changing the list while it may run has to hold it
+        # too. Call close() before exiting so a pending write is not lost.
+        if write_behind is not None and (journal or shared):
+            raise ValueError("write_behind cannot be combined with journal or shared.")
+        self.lock = threading.RLock()
+        self.writer = BackgroundWriter(self._write_snapshot,write_behind) if write_behind is not None else None
+        # With journal, every change is appended to <file_name>.journal right away and
+        # folded into the snapshot file every compact_every changes
+        self.journal_file = file_name + ".journal" if journal else None
+        self.compact_every = compact_every
+        self.journal = None
+        # file_format is "json" or "binary" (see encode_task_snapshot) for a new file, an
+        # existing one is saved again in the format it has
+        self.file_format = file_format
+        # With lazy, the file is only read the first time the tasks are used
+        self.progress = progress
+        self.is_loaded = False
+        # With stats, calls to the hot path methods are counted and timed, see enable_stats
+        self.stats = None
+        if stats:
+            self.enable_stats()
+        # With history, every change can be undone and redone, see enable_history
+        self.history = None
+        self.keeps_history = history
+        self.history_limit = history_limit
+        if not lazy:
+            self._load()
+
+    def __getattr__(self,name):
+        if name in TodoList.LOADED_ATTRIBUTES and not self.__dict__.get("is_loaded",True):
+            self._load()
+            return getattr(self,name)
+        raise AttributeError(f"'TodoList' object has no attribute '{name}'")
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def _load(self):
+        self.is_loaded = True
+        self._clear()
+        try:
+            self.load_tasks(self.progress)
+        except ValueError:
+            # Nothing stays loaded, so an empty list is never saved over the file
+            for name in TodoList.LOADED_ATTRIBUTES:
+                self.__dict__.pop(name,None)
+            self.is_loaded = False
+            raise
+        if self.keeps_history:
+            self.enable_history(self.history_limit)
+
+    def _clear(self):
+        if self.columnar:
+            self.tasks = TaskColumns()
+            self.tasks_by_id = None
+            self.task_buckets = None
+            self.due_heap = None
+            self.due_slots = None
+            self.due_slot_keys = None
+            self.scheduled = None
+        else:
+            self.tasks = OrderedRecords()
+            self.tasks_by_id = {}
+            # (is_completed, priority_level) -> tasks in that bucket, a dict used as an ordered set
+            self.task_buckets = {}
+            # Heap of (due, task_id, order, task) for the incomplete tasks with a due date. A
+            # changed task gets a new entry, scheduled maps each task to its current one and
+            # the others are skipped when they come up.
+            self.due_heap = []
+            self.scheduled = {}
+            # The same tasks by hour of their due date (see due_slot), a dict used as an ordered
+            # set per hour, so a time window only looks at the hours it covers. due_slot_keys
+            # are its hours in order, for finding the ones in a window by bisecting.
+            self.due_slots = {}
+            self.due_slot_keys = []
+        self.due_order = count()
         self.next_id = 1
-        self.load_tasks()
+        # Shared mode: ID -> version when loaded, and ID -> "upsert"/"delete" for changes since
+        self.record_versions = {}
+        self.pending_changes = {}
+
+    def _index_task(self,task):
+        if self.columnar:
+            return
+        self.tasks_by_id.setdefault(task.task_id,task)
+        self._bucket_task(task)
+
+    def _bucket_task(self,task):
+        key = (task.is_completed,task.priority_level)
+        bucket = self.task_buckets.setdefault(key,{})
+        out_of_order = not task.is_completed and bucket and next(reversed(bucket)).task_id > task.task_id
+        bucket[task] = None
+        if out_of_order:
+            # Incomplete buckets stay in ID order so next_task can take the first task
+            self.task_buckets[key] = dict.fromkeys(sorted(bucket,key=lambda task: task.task_id))
+        if task.due is not None and not task.is_completed:
+            self._schedule_task(task)
+
+    def _schedule_task(self,task):
+        entry = (task.due,task.task_id,next(self.due_order),task)
+        self.scheduled[task] = entry
+        heapq.heappush(self.due_heap,entry)
+        slot = due_slot(task.due)
+        if slot not in self.due_slots:
+            insort(self.due_slot_keys,slot)
+        self.due_slots.setdefault(slot,{})[task] = None
+        if len(self.due_heap) > 2 * len(self.scheduled) + 64:
+            # Drop the entries left behind by changed, completed and deleted tasks
+            self.due_heap = list(self.scheduled.values())
+            heapq.heapify(self.due_heap)
 
-    def load_tasks(self):
+    def _unbucket_task(self,task):
+        if self.columnar:
+            return
+        entry = self.scheduled.pop(task,None)
+        if entry is not None:
+            key = due_slot(entry[0])
+            slot = self.due_slots[key]
+            del slot[task]
+            if not slot:
+                del self.due_slots[key]
+                del self.due_slot_keys[bisect_left(self.due_slot_keys,key)]
+        key = (task.is_completed,task.priority_level)
+        bucket = self.task_buckets.get(key)
+        if bucket is not None:
+            bucket.pop(task,None)
+            if not bucket:
+                del self.task_buckets[key]
+
+    def _complete_task(self,task,announce=True):
+        self._unbucket_task(task)
+        if announce:
+            task.mark_as_completed()
+        else:
+            task.is_completed = True
+        if not self.columnar:
+            self._bucket_task(task)
+
+    def _log(self,entry):
+        if self.history is not None:
+            self._track_history(entry)
+        if self.shared:
+            self._track_change(entry)
+        if self.writer is not None:
+            self.writer.request()
+        if self.journal is None:
+            return
+        self.journal.append(entry)
+        if self.journal.entries >= self.compact_every:
+            self.save_tasks()
+
+    def _track_history(self,entry):
+        if entry["op"] in ("add","update"):
+            data = entry["task"]
+            self.history.put((data["task_id"],data["description"],data["is_completed"],data["priority_level"],check_due(data.get("due")),data.get("repeat")),self.next_id)
+        elif entry["op"] == "complete":
+            record = self.history.get(entry["task_id"])
+            if record is not None:
+                # Legacy IDs in the records can be out of date, put goes by the current one
+                self.history.put((entry["task_id"],record[1],True) + record[3:],self.next_id)
+        elif entry["op"] == "delete":
+            self.history.remove([entry["task_id"]])
+        elif entry["op"] in ("delete_many","delete_completed"):
+            self.history.remove(entry["task_ids"])
+
+    def _track_change(self,entry):
+        if entry["op"] in ("add","update"):
+            self.pending_changes[entry["task"]["task_id"]] = "upsert"
+        elif entry["op"] == "complete":
+            self.pending_changes[entry["task_id"]] = "upsert"
+        elif entry["op"] == "delete":
+            self._track_delete(entry["task_id"])
+        elif entry["op"] in ("delete_completed","delete_many"):
+            for task_id in entry["task_ids"]:
+                self._track_delete(task_id)
+
+    def _track_delete(self,task_id):
+        if task_id in self.record_versions:
+            self.pending_changes[task_id] = "delete"
+        else:
+            # Added and deleted again before any save, other processes never saw it
+            self.pending_changes.pop(task_id,None)
+
+    def _apply_journal_entry(self,entry):
+        if entry["op"] == "add":
+            data = entry["task"]
+            task = Task(data["description"],data["task_id"],data["priority_level"],data.get("due"),data.get("repeat"))
+            task.is_completed = data["is_completed"]
+            self.tasks.append(task)
+            self._index_task(task)
+            self.next_id = max(self.next_id,task.task_id + 1)
+        elif entry["op"] == "complete":
+            task = self.get_task_by_id(entry["task_id"])
+            if task is not None:
+                self._complete_task(task,announce=False)
+        elif entry["op"] == "delete":
+            task = self.get_task_by_id(entry["task_id"])
+            if task is not None:
+                self._remove_task(task)
+        elif entry["op"] == "delete_completed":
+            self._remove_completed()
+        elif entry["op"] == "delete_many":
+            self._remove_many([self.get_task_by_id(task_id) for task_id in entry["task_ids"]])
+        elif entry["op"] == "update":
+            task = self.get_task_by_id(entry["task"]["task_id"])
+            if task is not None:
+                # The whole task is logged, one saved without a due date has none
+                self._update_task(task,{"due":"","repeat":"",**entry["task"]})
+
+    def load_tasks(self,progress=None,progress_every=10000):
+        # Tasks are built while the file is parsed, progress(count) is called every progress_every tasks
+        self.file_format = snapshot_format(self.file_name) or self.file_format or "json"
+        if self.file_format == "binary":
+            saved_next_id = self._load_snapshot()
+        else:
+            saved_next_id = self._load_json(progress,progress_every)
+
+        if progress is not None:
+            progress(len(self.tasks))
+
+        if self.stable_ids:
+            highest_id = max(self.tasks.ids if self.columnar else self.tasks_by_id,default=0)
+            self.next_id = max(self.next_id,highest_id + 1,saved_next_id or 1)
+        elif saved_next_id is not None:
+            # A file saved with stable IDs may have gaps, the legacy mode expects 1..n
+            self.update_id()
+
+        if self.journal_file is not None:
+            journal = Journal(self.journal_file)
+            for entry in journal.replay(file_checksum(self.file_name)):
+                self._apply_journal_entry(entry)
+            self.journal = journal
+            if journal.is_clean and journal.entries == 0:
+                journal.resume()
+            else:
+                # Fold the replayed changes into the snapshot and start a fresh journal
+                self.save_tasks()
+
+    def _load_json(self,progress,progress_every):
         try:
-            with open(self.file_name,'r',encoding='utf-8') as f:
-                data_tasks = json.load(f)
+            with self._file_lock(exclusive=False), open(self.file_name,'rb') as f:
+                trusted = json_snapshot_is_intact(f)
+                f.seek(0)
+                stream = RecordStream(io.TextIOWrapper(f,encoding='utf-8'),"tasks")
+                for task in stream:
+                    self._load_record(task,trusted)
+                    self.next_id += 1
+                    if progress is not None and len(self.tasks) % progress_every == 0:
+                        progress(len(self.tasks))
+                return stream.header.get("next_id")
         except FileNotFoundError:
-           with open(self.file_name,'x') as f:
-               json.dump([],f,indent=5,ensure_ascii=False)
-               data_tasks = []
-        except json.decoder.JSONDecodeError:
-            data_tasks = []
-        
-        if len(data_tasks) > 0:
-            for task in data_tasks:
-                task_loading = Task(task["description"],task["task_id"],task["priority_level"])
-                task_loading.is_completed = task["is_completed"]
+            try:
+                with open(self.file_name,'x') as f:
+                    json.dump([],f,indent=5,ensure_ascii=False)
+            except FileExistsError:
+                # Another process of a shared list created it first
+                pass
+        except json.decoder.JSONDecodeError as e:
+            if os.path.getsize(self.file_name) > 0:
+                # Starting over from an empty list would overwrite the tasks on the next save
+                raise ValueError(f"{self.file_name} is damaged and was not loaded ({e}). Repair or move it, then try again.")
+            self._clear()
+        return None
+
+    def _load_snapshot(self):
+        if self.shared:
+            raise ValueError("A shared to-do list has to be a JSON file.")
+        try:
+            with open(self.file_name,'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as buffer:
+                    columns, saved_next_id = read_task_snapshot(buffer)
+        except FileNotFoundError:
+            write_file_atomically(self.file_name,encode_task_snapshot([]))
+            return None
+        except ValueError as e:
+            raise ValueError(f"{self.file_name} is damaged and was not loaded ({e}). Repair or move it, then try again.")
+        if self.columnar:
+            self.tasks = columns
+        else:
+            # Snapshots are only written from tasks that passed the checks
+            for task in columns:
+                task_loading = trusted_task(task.description,task.task_id,task.priority_level,task.is_completed,task.due,task.repeat)
                 self.tasks.append(task_loading)
-                self.next_id += 1
+                self._index_task(task_loading)
+        self.next_id = len(self.tasks) + 1
+        return saved_next_id
+
+    def _load_record(self,task,trusted=False):
+        if trusted:
+            due = task.get("due")
+            task_loading = trusted_task(task["description"],task["task_id"],task["priority_level"],task["is_completed"],
+                                        None if due is None else check_due(due),task.get("repeat"))
+        else:
+            task_loading = Task(task["description"],task["task_id"],task["priority_level"],task.get("due"),task.get("repeat"))
+            task_loading.is_completed = task["is_completed"]
+        self.tasks.append(task_loading)
+        self._index_task(task_loading)
+        if self.shared:
+            self.record_versions[task_loading.task_id] = task.get("version",0)
+
+    def _file_lock(self,exclusive=True):
+        if self.lock_file is None:
+            return contextlib.nullcontext()
+        return FileLock(self.lock_file,exclusive)
+
+    def _merge_and_save(self):
+        # Same as ContactBook._merge_and_save, without the unique phone check
+        if not self.is_loaded:
+            self._load()
+        with self._file_lock():
+            try:
+                with open(self.file_name,'r',encoding='utf-8') as f:
+                    stream = RecordStream(f,"tasks")
+                    records = {task["task_id"]:task for task in stream}
+                    next_id = stream.header.get("next_id") or 1
+            except FileNotFoundError:
+                records = {}
+                next_id = 1
+            next_id = max(next_id,max(records,default=0) + 1,self.next_id)
+            self.conflicts = []
+
+            new_tasks = []
+            for task_id, change in self.pending_changes.items():
+                if task_id not in self.record_versions:
+                    new_tasks.append(task_id)
+                    continue
+                saved = records.get(task_id)
+                if saved is None or saved.get("version",0) != self.record_versions[task_id]:
+                    if change == "delete" and saved is None:
+                        continue
+                    self.conflicts.append({"task_id":task_id,"change":change,"error":f"Task with ID {task_id} was changed by another process."})
+                elif change == "delete":
+                    del records[task_id]
+                else:
+                    task = self.get_task_by_id(task_id).to_dict()
+                    task["version"] = self.record_versions[task_id] + 1
+                    records[task_id] = task
+            for task_id in new_tasks:
+                task = self.get_task_by_id(task_id).to_dict()
+                if task_id in records:
+                    # Another process added a task with the same ID meanwhile
+                    task["task_id"] = next_id
+                task["version"] = 1
+                records[task["task_id"]] = task
+                next_id = max(next_id,task["task_id"] + 1)
+
+            data_to_save = {"next_id":next_id,"tasks":[records[task_id] for task_id in sorted(records)]}
+            self._write_file(data_to_save)
+
+            # Start over from the merged tasks, this also brings in what other processes saved
+            self._clear()
+            for task in data_to_save["tasks"]:
+                self._load_record(task)
+            self.next_id = next_id
+
+    def snapshot(self):
+        # What a save writes: bytes for a binary file, the data to dump for JSON. Nothing in it
+        # is shared with the to-do list, so it can be written out while they change.
+        next_id = self.next_id if self.stable_ids else None
+        if self.file_format == "binary":
+            return encode_task_snapshot(self.tasks,next_id)
+        tasks = [task.to_dict() for task in self.tasks]
+        return {"tasks":tasks} if next_id is None else {"next_id":next_id,"tasks":tasks}
+
+    def _write_snapshot(self):
+        with self.lock:
+            data_to_save = self.snapshot()
+        self._write_file(data_to_save)
+
+    def _write_file(self,data):
+        written = write_file_atomically(self.file_name,data)
+        if self.stats is not None:
+            self.stats.add("bytes_written",written)
+            self.stats.add("saves")
+
+    def enable_history(self,limit=None):
+        # Starts undo/redo from the tasks as they are now, limit caps the number of undo steps
+        # kept. Undoing rebuilds the to-do list from the version it goes back to. With a journal
+        # the file is saved right away, otherwise with the next save_tasks.
+        if self.shared:
+            raise ValueError("A shared to-do list cannot keep a history, other processes change the file too.")
+        self.history = History([(item.task_id,item.description,item.is_completed,item.priority_level,item.due,item.repeat) for item in self.tasks],self.next_id,self.stable_ids,limit)
+        return self.history
+
+    def _history(self):
+        if not self.is_loaded:
+            self._load()
+        if self.history is None:
+            raise ValueError("History is off, open the to-do list with history=True or call enable_history().")
+        return self.history
+
+    @contextlib.contextmanager
+    def _history_step(self):
+        # Changes made inside become one undo step. History is turned on by the first load,
+        # so that has to happen before the step starts.
+        if not self.is_loaded:
+            self._load()
+        if self.history is None:
+            yield
+            return
+        self.history.depth += 1
+        try:
+            yield
+        finally:
+            self.history.depth -= 1
+            self.history.commit()
+
+    def undo(self):
+        history = self._history()
+        if not history.undo_steps:
+            raise ValueError("Nothing to undo.")
+        history.redo_steps.append(history.committed)
+        self._restore_version(history.undo_steps.pop())
+
+    def redo(self):
+        history = self._history()
+        if not history.redo_steps:
+            raise ValueError("Nothing to redo.")
+        history.undo_steps.append(history.committed)
+        self._restore_version(history.redo_steps.pop())
+
+    def save_version(self,name):
+        # Names the current version, restore_version goes back to it
+        self._history().named[name] = self.history.committed
+
+    def restore_version(self,name):
+        history = self._history()
+        if name not in history.named:
+            raise ValueError(f"No version named {name}.")
+        history.undo_steps.append(history.committed)
+        history.redo_steps.clear()
+        self._restore_version(history.named[name])
+
+    def _restore_version(self,version):
+        records, next_id = version
+        if self.columnar:
+            # Columns have no indexes to keep, they are simply filled again
+            self._clear()
+            for position, (key, record) in enumerate(records.items(),start=1):
+                data = dict(zip(("task_id","description","is_completed","priority_level","due","repeat"),record))
+                if not self.stable_ids:
+                    data["task_id"] = position
+                self._load_record(data,trusted=True)
+            self.history.reset(records,next_id)
+        else:
+            self._apply_version(records,next_id)
+        self.next_id = next_id if self.stable_ids else len(self.tasks) + 1
+        # The journal only logs single changes, a whole version goes straight into the file
+        if self.journal is not None:
+            self.save_tasks()
+        elif self.writer is not None:
+            self.writer.request()
+
+    def _apply_version(self,records,next_id):
+        # Only the tasks that differ between the current version and records are touched
+        tasks = dict(zip(self.history.keys,self.tasks))
+        removed = set()
+        added = []
+        for key, old, new in self.history.records.diff(records):
+            if new is None:
+                removed.add(key)
+                task = tasks[key]
+                self._unbucket_task(task)
+                if self.tasks_by_id.get(task.task_id) is task:
+                    del self.tasks_by_id[task.task_id]
+            elif old is None:
+                added.append((key,trusted_task(new[1],new[0],new[3],new[2],new[4],new[5])))
+            else:
+                task = tasks[key]
+                self._unbucket_task(task)
+                task.description, task.is_completed, task.priority_level, task.due, task.repeat = new[1:]
+                self._bucket_task(task)
+        keys = self.history.keys
+        if removed or added:
+            pairs = [pair for pair in tasks.items() if pair[0] not in removed] + added
+            pairs.sort(key=lambda pair: pair[0])
+            keys = [key for key, _ in pairs]
+            self.tasks = OrderedRecords(task for _, task in pairs)
+            for _, task in added:
+                self._index_task(task)
+            if not self.stable_ids:
+                self.update_id()
+        self.history.reset(records,next_id,keys,[task.task_id for task in self.tasks])
+
+    def enable_stats(self,profile=False,trace_memory=False):
+        # Wraps the methods in INSTRUMENTED_METHODS on this list only, so without stats the
+        # plain methods run with nothing in between. Returns the Stats, also kept in self.stats.
+        self.disable_stats()
+        self.stats = Stats(profile,trace_memory)
+        for name in TodoList.INSTRUMENTED_METHODS:
+            setattr(self,name,self.stats.timed(name,getattr(self,name)))
+        return self.stats
+
+    def disable_stats(self):
+        stats = self.stats
+        if stats is None:
+            return None
+        for name in TodoList.INSTRUMENTED_METHODS:
+            self.__dict__.pop(name,None)
+        stats.close()
+        self.stats = None
+        return stats
+
+    def close(self):
+        if self.stats is not None:
+            self.stats.stop_dumping()
+        if self.writer is not None:
+            self.writer.close()
+        if self.journal is not None:
+            self.journal.close()
 
     def save_tasks(self):
         try:
-            data_to_save = [task.to_dict() for task in self.tasks]
-            with open(self.file_name,'w',encoding='utf-8') as f:
-                json.dump(data_to_save,f,indent=5,ensure_ascii=False)
+            if self.shared:
+                self._merge_and_save()
+                for conflict in self.conflicts:
+                    print(f"{conflict['error']} Your change was not saved.")
+                return
+            if self.writer is not None:
+                self.writer.flush_now()
+                return
+            self._write_file(self.snapshot())
+            if self.journal is not None:
+                self.journal.reset(file_checksum(self.file_name))
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
 
     def update_id(self):
+        if self.columnar:
+            self.tasks.renumber()
+            self.next_id = len(self.tasks) + 1
+            return
+        self.tasks_by_id = {}
         current_id = 1
         for task in self.tasks:
             task.task_id = current_id
+            self.tasks_by_id[current_id] = task
             current_id += 1
         self.next_id = current_id
+        self._reorder_by_id()
+
+    def _reorder_by_id(self):
+        # Incomplete buckets are kept in ID order, tasks restored by undo were bucketed by the
+        # IDs they had before, so after renumbering the buckets are sorted by the new ones
+        for key, bucket in self.task_buckets.items():
+            if not key[0]:
+                self.task_buckets[key] = dict.fromkeys(sorted(bucket,key=lambda task: task.task_id))
+        # Due heap entries hold the task ID as it was when pushed, they get the new ones too
+        self.scheduled = {task:(task.due,task.task_id,next(self.due_order),task) for task in self.scheduled}
+        self.due_heap = list(self.scheduled.values())
+        heapq.heapify(self.due_heap)
                 
-    def add_task(self,description,priority_level):
+    def add_task(self,description,priority_level,due=None,repeat=None):
         try:
-            new_task = Task(description,self.next_id,priority_level)
+            new_task = Task(description,self.next_id,priority_level,due,repeat)
         except (ValueError, TypeError) as e:
             print(e)
         else:
-            self.tasks.append(new_task)
-            self.next_id += 1
+            self._insert_task(new_task)
             print(f"Task '{description}' (Priority: {priority_level}) added successfully.")
 
+    def _insert_task(self,task):
+        self.tasks.append(task)
+        self._index_task(task)
+        self.next_id = max(self.next_id,task.task_id + 1)
+        self._log({"op":"add","task":task.to_dict()})
+
     def get_task_by_id(self,task_id):
-        for task in self.tasks:
-            if task.task_id == task_id:
-                return task
-        return None
+        if self.columnar:
+            return self.tasks.get(task_id)
+        return self.tasks_by_id.get(task_id)
 
     def mark_task_completed(self,task_id):
         task_mark = self.get_task_by_id(task_id)
         if task_mark is not None:
-            task_mark.mark_as_completed()
+            with self._history_step():
+                was_completed = task_mark.is_completed
+                self._complete_task(task_mark)
+                self._log({"op":"complete","task_id":task_id})
+                following = None if was_completed else self._repeat_task(task_mark)
+            if following is not None:
+                print(f"It comes back as task {following.task_id}, due {following.due:%Y-%m-%d %H:%M}.")
         else:
             print(f"Task with ID {task_id} not found.")
 
-    def delete_task(self,task_id,all_completed=False):
+    def _repeat_task(self,task):
+        # A completed repeating task is followed by a new task for its next occurrence. Only
+        # that one exists until it is completed in turn, however long the rule runs.
+        if task.repeat is None:
+            return None
+        following = trusted_task(task.description,self.next_id,task.priority_level,False,next_occurrence(task.due,task.repeat),task.repeat)
+        self._insert_task(following)
+        return following
+
+    def _remove_task(self,task):
+        task_id = task.task_id
+        self.tasks.remove(task)
+        self._unbucket_task(task)
+        if not self.stable_ids:
+            self.update_id()
+        elif not self.columnar:
+            del self.tasks_by_id[task_id]
+
+    def _remove_completed(self):
+        if self.columnar:
+            tasks = self.tasks.remove_completed()
+            if len(tasks) > 0 and not self.stable_ids:
+                self.update_id()
+            return tasks
+        tasks = self.get_tasks(status=True)
+        if len(tasks) > 0:
+            for key in [key for key in self.task_buckets if key[0]]:
+                del self.task_buckets[key]
+            for task in tasks:
+                self.tasks.remove(task)
+            if self.stable_ids:
+                for task in tasks:
+                    self.tasks_by_id.pop(task.task_id,None)
+            else:
+                self.update_id()
+        return tasks
+
+    def _remove_many(self,tasks):
+        tasks = [task for task in tasks if task is not None]
+        if self.columnar:
+            self.tasks.remove_many(tasks)
+        else:
+            for task in set(tasks):
+                self.tasks.remove(task)
+            for task in tasks:
+                self._unbucket_task(task)
+                if self.tasks_by_id.get(task.task_id) is task:
+                    del self.tasks_by_id[task.task_id]
+        if not self.stable_ids:
+            self.update_id()
+
+    def _update_task(self,task,data):
+        self._unbucket_task(task)
+        try:
+            task.update(data.get("description"),data.get("priority_level"),data.get("due"),data.get("repeat"))
+            if data.get("is_completed"):
+                task.is_completed = True
+        finally:
+            if not self.columnar:
+                self._bucket_task(task)
+
+    def add_many(self,tasks):
+        # tasks: dicts with "description", "priority_level" and optional "due" and "repeat".
+        # Nothing is printed, the result holds one dict per item in the same order, with
+        # either task_id or error.
+        with self._history_step():
+            results = []
+            for data in tasks:
+                try:
+                    new_task = Task(data.get("description",""),self.next_id,data.get("priority_level"),data.get("due"),data.get("repeat"))
+                    self._insert_task(new_task)
+                except (ValueError,TypeError) as e:
+                    results.append({"ok":False,"error":str(e)})
+                    continue
+                results.append({"ok":True,"task_id":new_task.task_id})
+            return results
+
+    def update_many(self,updates):
+        # updates: dicts with "task_id" and any of "description", "priority_level", "due",
+        # "repeat" and "is_completed" (tasks can only be completed, not reopened). Completing
+        # a repeating task adds its next occurrence, its ID is in the result as next_task_id.
+        with self._history_step():
+            results = []
+            for data in updates:
+                task_id = data.get("task_id")
+                task = self.get_task_by_id(task_id)
+                if task is None:
+                    results.append({"ok":False,"task_id":task_id,"error":f"Task with ID {task_id} not found."})
+                    continue
+                was_completed = task.is_completed
+                try:
+                    self._update_task(task,data)
+                except (ValueError,TypeError) as e:
+                    results.append({"ok":False,"task_id":task_id,"error":str(e)})
+                    continue
+                self._log({"op":"update","task":task.to_dict()})
+                result = {"ok":True,"task_id":task_id}
+                if task.is_completed and not was_completed:
+                    following = self._repeat_task(task)
+                    if following is not None:
+                        result["next_task_id"] = following.task_id
+                results.append(result)
+            return results
+
+    def delete_many(self,task_ids):
+        # IDs refer to the tasks before this call, the remaining tasks are renumbered only once
+        with self._history_step():
+            results = []
+            tasks = {}
+            for task_id in task_ids:
+                task = self.get_task_by_id(task_id)
+                if task is None or task_id in tasks:
+                    results.append({"ok":False,"task_id":task_id,"error":f"Task with ID {task_id} not found."})
+                    continue
+                tasks[task_id] = task
+                results.append({"ok":True,"task_id":task_id})
+            if tasks:
+                self._remove_many(list(tasks.values()))
+                self._log({"op":"delete_many","task_ids":list(tasks)})
+            return results
+
+    def delete_task(self,task_id=None,all_completed=False):
         if not all_completed:
             task_del = self.get_task_by_id(task_id)
             if task_del is not None:
-                self.tasks.remove(task_del)
-                self.update_id()
+                deleted_id = task_del.task_id
+                self._remove_task(task_del)
+                self._log({"op":"delete","task_id":deleted_id})
                 print(f"Task '{task_del.description}' (Priority: {task_del.priority_level}) has been removed.")
             else:
                 print(f"Task with ID {task_id} not found.")
         else:
-            tasks = [task for task in self.tasks if task.is_completed]
+            tasks = self._remove_completed()
             if len(tasks) > 0:
-                self.tasks = [task for task in self.tasks if task not in tasks]
-                self.update_id()
+                self._log({"op":"delete_completed","task_ids":[task.task_id for task in tasks]})
                 print("All completed tasks deleted.")
             else:
                 print("No completed tasks to delete. Get some tasks done!")
 
-    def display_tasks(self,status):
-        tasks = [task for task in self.tasks if task.is_completed == status] if status is not None else self.tasks
-        if len(tasks) > 0:
-            for task in tasks:
-                print(task)
-        else:
+    def get_tasks(self,status=None,priority_level=None):
+        # Tasks in ID order, status None/True/False and priority_level None mean any
+        if self.columnar:
+            if self.stats is not None:
+                self.stats.add("records_scanned.get_tasks",len(self.tasks))
+            return [task for task in self.tasks if (status is None or task.is_completed == status) and (priority_level is None or task.priority_level == priority_level)]
+        if status is None and priority_level is None:
+            if self.stats is not None:
+                self.stats.add("records_scanned.get_tasks",len(self.tasks))
+            return list(self.tasks)
+        tasks = []
+        for (is_completed, level), bucket in self.task_buckets.items():
+            if (status is None or is_completed == status) and (priority_level is None or level == priority_level):
+                tasks.extend(bucket)
+        tasks.sort(key=lambda task: task.task_id)
+        if self.stats is not None:
+            self.stats.add("records_scanned.get_tasks",len(tasks))
+        return tasks
+
+    def next_task(self):
+        # The oldest incomplete task with the highest priority, or None when everything is done
+        if self.columnar:
+            incomplete = self.get_tasks(status=False)
+            return min(incomplete,key=lambda task: self._priority_rank(task.priority_level),default=None)
+        best = None
+        for (is_completed, level), bucket in self.task_buckets.items():
+            if is_completed:
+                continue
+            # Incomplete buckets are kept in ID order, so the first task is the oldest
+            task = next(iter(bucket))
+            rank = (self._priority_rank(level),task.task_id)
+            if best is None or rank < best[0]:
+                best = (rank,task)
+        return None if best is None else best[1]
+
+    def next_due(self):
+        # The incomplete task due first, or None when no incomplete task has a due date
+        if self.columnar:
+            rows = self._due_rows(-math.inf,math.inf)
+            row = min(rows,key=lambda row: (self.tasks.dues[row],self.tasks.ids[row]),default=None)
+            return None if row is None else self.tasks[row]
+        heap = self.due_heap
+        while heap and self.scheduled.get(heap[0][3]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0][3] if heap else None
+
+    def overdue(self,now=None):
+        # Incomplete tasks due before now, the most overdue first
+        now = check_due(datetime.now() if now is None else now)
+        return self._due_before(None,now)
+
+    def due_within(self,seconds=3600,now=None):
+        # Incomplete tasks due from now until seconds later, soonest first
+        now = check_due(datetime.now() if now is None else now)
+        return self._due_before(now,now + timedelta(seconds=seconds))
+
+    def _due_before(self,start,end):
+        # Incomplete tasks with start <= due < end (no lower bound when start is None) in due order
+        if self.columnar:
+            rows = self._due_rows(-math.inf if start is None else due_seconds(start),due_seconds(end))
+            rows.sort(key=lambda row: (self.tasks.dues[row],self.tasks.ids[row]))
+            return [self.tasks[row] for row in rows]
+        # Only the hours between start and end that have tasks are looked at, all of a slot's
+        # tasks match except in the first and last hour
+        first, last = (None if start is None else due_slot(start)), due_slot(end)
+        keys = self.due_slot_keys
+        slots = keys[0 if first is None else bisect_left(keys,first):bisect_right(keys,last)]
+        found = []
+        for slot in slots:
+            tasks = self.due_slots[slot]
+            if slot == first or slot == last:
+                found.extend(task for task in tasks if (start is None or start <= task.due) and task.due < end)
+            else:
+                found.extend(tasks)
+        if self.stats is not None:
+            self.stats.add("records_scanned.due",len(found))
+        found.sort(key=lambda task: (task.due,task.task_id))
+        return found
+
+    def _due_rows(self,low,high):
+        # Columnar: rows of the incomplete tasks with low <= due < high, NaN (no due date) never matches
+        if self.stats is not None:
+            self.stats.add("records_scanned.due",len(self.tasks))
+        completed = self.tasks.completed
+        return [row for row, due in enumerate(self.tasks.dues) if low <= due < high and not completed[row]]
+
+    def _priority_rank(self,priority_level):
+        if priority_level in PRIORITY_ORDER:
+            return PRIORITY_ORDER.index(priority_level)
+        return len(PRIORITY_ORDER)
+
+    def iter_tasks(self,status=None,sort_by="id"):
+        # Tasks one at a time in ID order, by priority (High, Medium, Low, then any other) or
+        # by due date (tasks without one last), ties in ID order. Only the order is worked out
+        # up front, the tasks are handed out as they are asked for.
+        if sort_by not in TASK_SORT_KEYS:
+            raise ValueError(f"Sort by must be one of: {', '.join(TASK_SORT_KEYS)}.")
+        tasks = self.get_tasks(status)
+        if sort_by == "priority":
+            tasks.sort(key=lambda task: self._priority_rank(task.priority_level))
+        elif sort_by == "due":
+            tasks.sort(key=lambda task: (task.due is None,task.due or DUE_EPOCH))
+        yield from tasks
+
+    def display_tasks(self,status,sort_by="id",page_size=None,more=None):
+        # Prints page_size tasks at a time (all of them when None), a page in one write.
+        # Before each further page more() is asked, the listing stops when it returns False.
+        # Tasks on pages that are never shown are never formatted.
+        shown = False
+        for page in pages(self.iter_tasks(status,sort_by),page_size):
+            if shown and more is not None and not more():
+                return
+            print(render_page(page))
+            shown = True
+        if not shown:
             if status:
                 print("No completed tasks found. Get some tasks done!")
             elif status is False:
@@ -122,11 +1268,19 @@ class TodoList:
                 print("Your task list is empty. Add a few tasks to get started!")
 
 def check_action_input(action):
-    action_list = ["view","add","complete","delete","exit"]
+    action_list = ["view","add","complete","delete","due","undo","redo","exit"]
     if not action.isalpha() or action not in action_list:
-        raise ValueError("Invalid action. Please choose from (View/Add/Complete/Delete/Exit).")
+        raise ValueError("Invalid action. Please choose from (View/Add/Complete/Delete/Due/Undo/Redo/Exit).")
     return action
 
+def check_sort_input(sort_by):
+    if not sort_by.isalpha() or sort_by not in TASK_SORT_KEYS:
+        raise ValueError("Invalid order. Please choose from (ID/Priority/Due).")
+    return sort_by
+
+def ask_for_more():
+    return input("Press Enter for the next page, or Q to stop: ").strip().lower() != "q"
+
 def check_status_input(status):
     status_list = ["all","completed","incomplete"]
     if not status.isalpha() or status not in status_list:
@@ -134,10 +1288,14 @@ def check_status_input(status):
     return status
 
 def main():
-    todo_list = TodoList()
+    try:
+        todo_list = TodoList(journal=True,lazy=False,history=True)
+    except ValueError as v:
+        print(v)
+        return
     while True:
         print("How can I help you with your to-do list?")
-        daft_action = input("(View/Add/Complete/Delete/Exit): ").strip().lower()
+        daft_action = input("(View/Add/Complete/Delete/Due/Undo/Redo/Exit): ").strip().lower()
         try:
             action = check_action_input(daft_action)
         except ValueError as v:
@@ -166,7 +1324,45 @@ def main():
             elif status_str == "incomplete":
                 status = False
 
-            todo_list.display_tasks(status)
+            while True:
+                draft_sort = input("Sort tasks by: (ID/Priority/Due)? ").strip().lower()
+                try:
+                    sort_by = check_sort_input(draft_sort)
+                except ValueError as v:
+                    print(f"{v}\nPlease try again.")
+                    continue
+                break
+
+            todo_list.display_tasks(status,sort_by,LIST_PAGE_SIZE,ask_for_more)
+
+        elif action == "due":
+            overdue_tasks = todo_list.overdue()
+            soon_tasks = todo_list.due_within(3600)
+            for title, tasks in (("Overdue:",overdue_tasks),("Due in the next hour:",soon_tasks)):
+                if len(tasks) > 0:
+                    print(title)
+                    for task in tasks:
+                        print(task)
+            if len(overdue_tasks) == 0 and len(soon_tasks) == 0:
+                upcoming = todo_list.next_due()
+                if upcoming is None:
+                    print("No open task has a due date.")
+                else:
+                    print(f"Nothing due in the next hour. Next up:\n{upcoming}")
+
+        elif action == "undo":
+            try:
+                todo_list.undo()
+                print("Your last change has been undone.")
+            except ValueError as v:
+                print(v)
+
+        elif action == "redo":
+            try:
+                todo_list.redo()
+                print("Your last undone change has been made again.")
+            except ValueError as v:
+                print(v)
 
         elif action == "add":
             description = input("Describe your task please: ")
@@ -179,7 +1375,22 @@ def main():
                     print("Priority must be High, Medium, or Low.")
             
             priority_level = priority_level.capitalize()
-            todo_list.add_task(description,priority_level)
+            while True:
+                due = input("When is it due? (YYYY-MM-DD HH:MM, leave empty for none): ").strip()
+                try:
+                    due = check_due(due) if due else None
+                    break
+                except ValueError as v:
+                    print(f"{v}\nPlease try again.")
+            repeat = None
+            if due is not None:
+                while True:
+                    repeat = input("Does it repeat? (No/Hourly/Daily/Weekly/Monthly): ").strip().lower()
+                    if repeat == "no" or repeat in REPEAT_RULES:
+                        break
+                    print("Please choose No, Hourly, Daily, Weekly or Monthly.")
+                repeat = None if repeat == "no" else repeat
+            todo_list.add_task(description,priority_level,due,repeat)
 
         elif action == "delete":
             while True:
@@ -221,4 +1432,5 @@ def main():
                     
             todo_list.mark_task_completed(task_id)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import os
+import sqlite3
+
+from ToDoListApp import PRIORITY_ORDER, TASK_SORT_KEYS, Task, TodoList, check_due, due_text, trusted_task
+
+SQLITE_EXTENSIONS = (".db",".sqlite",".sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    row_key INTEGER PRIMARY KEY,
+    task_id INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    is_completed INTEGER NOT NULL,
+    priority_level TEXT,
+    due TEXT,
+    repeat TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_by_id ON tasks(task_id);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks(is_completed, priority_level, task_id);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# Due dates are stored as "YYYY-MM-DD HH:MM:SS", which sorts in time order
+DUE_SCHEMA = """
+CREATE INDEX IF NOT EXISTS tasks_by_due ON tasks(is_completed, due, task_id);
+"""
+
+TASK_COLUMNS = "task_id, description, is_completed, priority_level, due, repeat"
+
+class SqliteTodoList(TodoList):
+    # Keeps the tasks in an SQLite database instead of memory. Lookups and the status and
+    # priority filters become indexed queries, the menus and batch methods of TodoList are
+    # inherited unchanged. Tasks handed out are built from the rows.
+    def __init__(self,file_name='tasks.db',stable_ids=False):
+        # Without journal, shared (SQLite does its own locking between processes) or
+        # write_behind, and lazy so TodoList never reads the file as JSON
+        super().__init__(file_name,stable_ids=stable_ids)
+        self.is_loaded = True
+        # Autocommit, so every single change is saved right away. Batches and changes made of
+        # several statements run inside one transaction.
+        self.connection = sqlite3.connect(file_name,isolation_level=None)
+        self.connection.executescript(SCHEMA)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(tasks)")}
+        for column in ("due","repeat"):
+            if column not in columns:
+                # A database made before tasks had due dates
+                self.connection.execute(f"ALTER TABLE tasks ADD COLUMN {column} TEXT")
+        self.connection.executescript(DUE_SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.connection.in_transaction:
+            yield
+            return
+        self.connection.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def enable_history(self,limit=None):
+        raise ValueError("An SQLite to-do list keeps no history, back up the database file instead.")
+
+    def _task_from_row(self,row):
+        # Rows were checked on the way in
+        return trusted_task(row[1],row[0],row[3],bool(row[2]),None if row[4] is None else check_due(row[4]),row[5])
+
+    def _select(self,where="",parameters=()):
+        cursor = self.connection.execute(f"SELECT {TASK_COLUMNS} FROM tasks {where}",parameters)
+        return [self._task_from_row(row) for row in cursor]
+
+    @property
+    def tasks(self):
+        return self._select("ORDER BY task_id")
+
+    @property
+    def next_id(self):
+        highest_id = self.connection.execute("SELECT MAX(task_id) FROM tasks").fetchone()[0] or 0
+        if not self.stable_ids:
+            return highest_id + 1
+        saved = self.connection.execute("SELECT value FROM settings WHERE key = 'next_id'").fetchone()
+        return max(highest_id + 1,saved[0] if saved else 1)
+
+    @next_id.setter
+    def next_id(self,next_id):
+        if self.stable_ids:
+            self.connection.execute("INSERT OR REPLACE INTO settings(key, value) VALUES ('next_id', ?)",(next_id,))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def load_tasks(self,progress=None,progress_every=10000):
+        if progress is not None:
+            progress(len(self))
+
+    def save_tasks(self):
+        if self.connection.in_transaction:
+            self.connection.commit()
+
+    def _insert_task(self,task):
+        self.connection.execute("INSERT INTO tasks(task_id, description, is_completed, priority_level, due, repeat) VALUES (?, ?, ?, ?, ?, ?)",
+                                (task.task_id,task.description,bool(task.is_completed),task.priority_level,due_text(task.due),task.repeat))
+        if self.stable_ids:
+            self.next_id = max(self.next_id,task.task_id + 1)
+
+    def _save_task(self,task):
+        self.connection.execute("UPDATE tasks SET description = ?, is_completed = ?, priority_level = ?, due = ?, repeat = ? WHERE task_id = ?",
+                                (task.description,bool(task.is_completed),task.priority_level,due_text(task.due),task.repeat,task.task_id))
+
+    def _complete_task(self,task,announce=True):
+        if announce:
+            task.mark_as_completed()
+        else:
+            task.is_completed = True
+        self._save_task(task)
+
+    def _update_task(self,task,data):
+        task.update(data.get("description"),data.get("priority_level"),data.get("due"),data.get("repeat"))
+        if data.get("is_completed"):
+            task.is_completed = True
+        self._save_task(task)
+
+    def _remove_task(self,task):
+        with self.transaction():
+            self.connection.execute("DELETE FROM tasks WHERE task_id = ?",(task.task_id,))
+            if not self.stable_ids:
+                # IDs are 1..n in this mode, closing the gap keeps them that way
+                self.connection.execute("UPDATE tasks SET task_id = task_id - 1 WHERE task_id > ?",(task.task_id,))
+
+    def _remove_many(self,tasks):
+        task_ids = [(task.task_id,) for task in tasks if task is not None]
+        with self.transaction():
+            self.connection.executemany("DELETE FROM tasks WHERE task_id = ?",task_ids)
+            if not self.stable_ids:
+                self.update_id()
+
+    def _remove_completed(self):
+        with self.transaction():
+            tasks = self.get_tasks(status=True)
+            if len(tasks) > 0:
+                self.connection.execute("DELETE FROM tasks WHERE is_completed = 1")
+                if not self.stable_ids:
+                    self.update_id()
+        return tasks
+
+    def update_id(self):
+        rows = self.connection.execute("SELECT row_key, task_id FROM tasks ORDER BY task_id, row_key").fetchall()
+        changes = [(new_id,row_key) for new_id, (row_key, task_id) in enumerate(rows,start=1) if task_id != new_id]
+        with self.transaction():
+            self.connection.executemany("UPDATE tasks SET task_id = ? WHERE row_key = ?",changes)
+
+    def mark_task_completed(self,task_id):
+        # Completing a repeating task also adds its next occurrence
+        with self.transaction():
+            return super().mark_task_completed(task_id)
+
+    def add_many(self,tasks):
+        with self.transaction():
+            return super().add_many(tasks)
+
+    def update_many(self,updates):
+        with self.transaction():
+            return super().update_many(updates)
+
+    def delete_many(self,task_ids):
+        with self.transaction():
+            return super().delete_many(task_ids)
+
+    def get_task_by_id(self,task_id):
+        found_tasks = self._select("WHERE task_id = ? ORDER BY row_key LIMIT 1",(task_id,))
+        return found_tasks[0] if found_tasks else None
+
+    def get_tasks(self,status=None,priority_level=None):
+        conditions = []
+        parameters = []
+        if status is not None:
+            conditions.append("is_completed = ?")
+            parameters.append(bool(status))
+        if priority_level is not None:
+            conditions.append("priority_level = ?")
+            parameters.append(priority_level)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        return self._select(f"{where} ORDER BY task_id",parameters)
+
+    def iter_tasks(self,status=None,sort_by="id"):
+        # Rows are fetched from the cursor as the pages are shown
+        if sort_by not in TASK_SORT_KEYS:
+            raise ValueError(f"Sort by must be one of: {', '.join(TASK_SORT_KEYS)}.")
+        where = "" if status is None else "WHERE is_completed = ?"
+        parameters = () if status is None else (bool(status),)
+        if sort_by == "priority":
+            ranks = " ".join(f"WHEN ? THEN {rank}" for rank in range(len(PRIORITY_ORDER)))
+            order = f"CASE priority_level {ranks} ELSE {len(PRIORITY_ORDER)} END, task_id"
+            parameters += tuple(PRIORITY_ORDER)
+        elif sort_by == "due":
+            order = "due IS NULL, due, task_id"
+        else:
+            order = "task_id"
+        for row in self.connection.execute(f"SELECT {TASK_COLUMNS} FROM tasks {where} ORDER BY {order}",parameters):
+            yield self._task_from_row(row)
+
+    def next_task(self):
+        # One indexed lookup per known priority, then the oldest task of any other level
+        for priority_level in PRIORITY_ORDER:
+            found_tasks = self._select("WHERE is_completed = 0 AND priority_level = ? ORDER BY task_id LIMIT 1",(priority_level,))
+            if found_tasks:
+                return found_tasks[0]
+        placeholders = ", ".join("?" * len(PRIORITY_ORDER))
+        found_tasks = self._select(f"WHERE is_completed = 0 AND (priority_level IS NULL OR priority_level NOT IN ({placeholders})) ORDER BY task_id LIMIT 1",PRIORITY_ORDER)
+        return found_tasks[0] if found_tasks else None
+
+    def next_due(self):
+        found_tasks = self._select("WHERE is_completed = 0 AND due IS NOT NULL ORDER BY due, task_id LIMIT 1")
+        return found_tasks[0] if found_tasks else None
+
+    def _due_before(self,start,end):
+        if start is None:
+            return self._select("WHERE is_completed = 0 AND due < ? ORDER BY due, task_id",(due_text(end),))
+        return self._select("WHERE is_completed = 0 AND due >= ? AND due < ? ORDER BY due, task_id",(due_text(start),due_text(end)))
+
+def open_todo_list(file_name,**options):
+    # SQLite for .db/.sqlite/.sqlite3 files, the JSON TodoList for anything else
+    if file_name.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteTodoList(file_name,stable_ids=options.get("stable_ids",False))
+    return TodoList(file_name,**options)
+
+def migrate_tasks(source_name,target_name,stable_ids=False):
+    # Copies every task, with its ID, from one storage file to a new one of the other format.
+    # Returns the number copied and the tasks the target refused.
+    if os.path.exists(target_name) and os.path.getsize(target_name) > 0:
+        raise ValueError(f"{target_name} already exists, migrate into a new file.")
+    # With journal, changes a JSON source has not folded into its file yet are replayed first
+    source = open_todo_list(source_name,stable_ids=stable_ids,journal=True)
+    try:
+        target = open_todo_list(target_name,stable_ids=stable_ids)
+        try:
+            copied = 0
+            rejected = []
+            transaction = target.transaction() if isinstance(target,SqliteTodoList) else contextlib.nullcontext()
+            with transaction:
+                for task in source.tasks:
+                    try:
+                        copy = Task(task.description,task.task_id,task.priority_level,task.due,task.repeat)
+                        copy.is_completed = task.is_completed
+                        target._insert_task(copy)
+                    except (ValueError,TypeError) as e:
+                        rejected.append({"task":task.to_dict(),"error":str(e)})
+                    else:
+                        copied += 1
+                target.next_id = max(target.next_id,source.next_id)
+            target.save_tasks()
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return copied, rejected
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy a to-do list between the JSON and SQLite formats.")
+    parser.add_argument("source",help="e.g. tasks.json")
+    parser.add_argument("target",help="e.g. tasks.db, must not exist yet")
+    parser.add_argument("--stable-ids",action="store_true",help="keep IDs and next_id as they are (stable ID mode)")
+    options = parser.parse_args()
+    try:
+        copied, rejected = migrate_tasks(options.source,options.target,options.stable_ids)
+    except ValueError as v:
+        print(v)
+        return
+    print(f"Migrated {copied} tasks from {options.source} to {options.target}.")
+    for row in rejected:
+        print(f"Skipped {row['task']}: {row['error']}")
+
+if __name__ == "__main__":
+    main()
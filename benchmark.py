@@ -0,0 +1,191 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from ContactBookApp import ContactBook, encode_contact_snapshot
+from ToDoListApp import TodoList, encode_task_snapshot
+
+FIRST_NAMES = ["Anna","Binh","Carlos","Dana","Emil","Fatima","Goro","Hana","Ivan","Julia","Khoa","Linh","Minh","Nora","Omar","Phuc"]
+LAST_NAMES = ["Le","Nguyen","Tran","Smith","Garcia","Kim","Ivanova","Rossi","Muller","Sato"]
+PRIORITY_LEVELS = ["High","Medium","Low"]
+BENCH_NOW = datetime(2026,1,1,12)
+
+def make_contacts(count,rnd):
+    phones = rnd.sample(range(10 ** 9,10 ** 10),count)
+    contacts = []
+    for contact_id, phone in enumerate(phones,start=1):
+        name = f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}"
+        email = f"user{contact_id}@example.com" if rnd.random() < 0.5 else None
+        contacts.append({"contact_id":contact_id,"name":name,"phone":str(phone),"email":email})
+    return contacts
+
+def make_tasks(count,rnd):
+    # A third of the tasks are due somewhere in the four weeks around BENCH_NOW
+    tasks = []
+    for task_id in range(1,count + 1):
+        task = {"task_id":task_id,"description":f"Task number {task_id}","is_completed":rnd.random() < 0.5,"priority_level":rnd.choice(PRIORITY_LEVELS)}
+        if rnd.random() < 1 / 3:
+            task["due"] = (BENCH_NOW + timedelta(minutes=rnd.randint(-20160,20160))).isoformat(" ")
+            task["repeat"] = rnd.choice([None,"daily","weekly"])
+        tasks.append(task)
+    return tasks
+
+def write_json(file_name,records):
+    with open(file_name,'w',encoding='utf-8') as f:
+        json.dump(records,f,indent=5,ensure_ascii=False)
+
+def measure(name,records,operations,setup,run,with_memory=True):
+    # setup() builds fresh state and returns what run() needs, only run() is timed.
+    # Peak memory comes from a second, separate run under tracemalloc so it does not skew the timing.
+    with contextlib.redirect_stdout(io.StringIO()):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        seconds = time.perf_counter() - start
+        peak_memory = None
+        if with_memory:
+            state = setup()
+            tracemalloc.start()
+            run(state)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    result = {"benchmark":name,"records":records,"operations":operations,"seconds":round(seconds,6),
+              "operations_per_second":round(operations / seconds,1) if seconds > 0 else None,"peak_memory_bytes":peak_memory}
+    print(f"{name:<34} {records:>9} records {seconds:>10.4f}s",file=sys.stderr)
+    return result
+
+def bench_contacts(count,queries,work_dir,rnd,options):
+    results = []
+    data = make_contacts(count,rnd)
+    file_name = os.path.join(work_dir,f"contacts_{count}.json")
+    write_json(file_name,data)
+
+    def open_book():
+        return ContactBook(file_name,columnar=options.columnar,lazy=False)
+
+    results.append(measure("load_contacts",count,count,lambda: None,lambda state: open_book(),options.memory))
+
+    book = open_book()
+    binary_name = os.path.join(work_dir,f"contacts_{count}.cbs")
+    with open(binary_name,'wb') as f:
+        f.write(encode_contact_snapshot(book.contacts))
+    results.append(measure("load_contacts_binary",count,count,lambda: None,
+                           lambda state: ContactBook(binary_name,columnar=options.columnar,lazy=False),options.memory))
+
+    save_name = os.path.join(work_dir,f"contacts_save_{count}.json")
+    def setup_save():
+        book.file_name = save_name
+        return book
+    results.append(measure("save_contacts",count,count,setup_save,lambda book: book.save_contacts(),options.memory))
+
+    name_queries = [rnd.choice(data)["name"].lower()[:rnd.randint(2,6)] for _ in range(queries)]
+    phone_queries = [rnd.choice(data)["phone"][rnd.randint(0,5):][:4] for _ in range(queries)]
+    id_queries = [rnd.randint(1,count) for _ in range(queries)]
+
+    def search(queries,is_name):
+        for query in queries:
+            try:
+                book.contactss(query,is_name=is_name,is_phone=not is_name)
+            except ValueError:
+                pass
+    results.append(measure("contactss_by_name",count,queries,lambda: name_queries,lambda queries: search(queries,True),options.memory))
+    results.append(measure("contactss_by_phone",count,queries,lambda: phone_queries,lambda queries: search(queries,False),options.memory))
+
+    def typo(name):
+        position = rnd.randrange(len(name))
+        return name[:position] + rnd.choice("abcdefghijklmnopqrstuvwxyz") + name[position + 1:]
+    fuzzy_queries = [typo(rnd.choice(data)["name"].lower()) for _ in range(queries)]
+    def fuzzy_search(queries):
+        for query in queries:
+            try:
+                book.contactss(query,is_name=True,limit=10,fuzzy=True)
+            except ValueError:
+                pass
+    results.append(measure("contactss_fuzzy",count,queries,lambda: fuzzy_queries,fuzzy_search,options.memory))
+
+    def lookups(queries):
+        for contact_id in queries:
+            book.get_contact_by_id(contact_id)
+    results.append(measure("get_contact_by_id",count,queries,lambda: id_queries,lookups,options.memory))
+
+    empty_name = os.path.join(work_dir,f"contacts_empty_{count}.json")
+    def setup_bulk_add():
+        if os.path.exists(empty_name):
+            os.remove(empty_name)
+        return ContactBook(empty_name,columnar=options.columnar,lazy=False)
+    def bulk_add(empty_book):
+        # Every add_contact goes through check_duplicate_phone_number
+        for contact in data:
+            empty_book.add_contact(contact["name"],contact["phone"],contact["email"])
+    results.append(measure("add_contact_bulk",count,count,setup_bulk_add,bulk_add,options.memory))
+    return results
+
+def bench_tasks(count,work_dir,rnd,options):
+    results = []
+    file_name = os.path.join(work_dir,f"tasks_{count}.json")
+    write_json(file_name,make_tasks(count,rnd))
+
+    def open_list():
+        return TodoList(file_name,columnar=options.columnar,lazy=False)
+
+    results.append(measure("load_tasks",count,count,lambda: None,lambda state: open_list(),options.memory))
+
+    todo_list = open_list()
+    binary_name = os.path.join(work_dir,f"tasks_{count}.tls")
+    with open(binary_name,'wb') as f:
+        f.write(encode_task_snapshot(todo_list.tasks))
+    results.append(measure("load_tasks_binary",count,count,lambda: None,
+                           lambda state: TodoList(binary_name,columnar=options.columnar,lazy=False),options.memory))
+
+    save_name = os.path.join(work_dir,f"tasks_save_{count}.json")
+    def setup_save():
+        todo_list.file_name = save_name
+        return todo_list
+    results.append(measure("save_tasks",count,count,setup_save,lambda todo_list: todo_list.save_tasks(),options.memory))
+
+    def due_queries(queries):
+        for _ in range(queries):
+            todo_list.next_due()
+            todo_list.due_within(3600,BENCH_NOW)
+    results.append(measure("next_due_and_due_within",count,1000,lambda: 1000,due_queries,options.memory))
+
+    results.append(measure("delete_task_all_completed",count,1,open_list,lambda todo_list: todo_list.delete_task(all_completed=True),options.memory))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Contact Book and Todo List hot paths on synthetic data.")
+    parser.add_argument("--sizes",default="1000,10000,100000",help="comma separated record counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--queries",type=int,default=1000,help="lookups and searches per size")
+    parser.add_argument("--seed",type=int,default=42)
+    parser.add_argument("--columnar",action="store_true",help="use the columnar storage backends")
+    parser.add_argument("--no-memory",dest="memory",action="store_false",help="skip the tracemalloc peak memory runs")
+    parser.add_argument("--output",help="write the JSON report here instead of stdout")
+    options = parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(",") if size.strip()]
+    report = {"python":platform.python_version(),"platform":platform.platform(),"seed":options.seed,
+              "columnar":options.columnar,"results":[]}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in sizes:
+            rnd = random.Random(f"{options.seed}-{count}")
+            report["results"].extend(bench_contacts(count,options.queries,work_dir,rnd,options))
+            report["results"].extend(bench_tasks(count,work_dir,rnd,options))
+
+    text = json.dumps(report,indent=2)
+    if options.output:
+        with open(options.output,'w',encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,718 @@
+import codecs
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import accumulate, islice
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+class StringColumn:
+    # A column of strings (or None) kept as UTF-8 in one buffer, as read from a snapshot.
+    # Each string is decoded when it is asked for, the first change decodes them all into
+    # a plain list.
+    def __init__(self,buffer,offsets,missing=None):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.missing = missing
+        self.values = None
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.values is None else len(self.values)
+
+    def __getitem__(self,row):
+        if self.values is not None:
+            return self.values[row]
+        if row < 0:
+            row += len(self)
+        if self.missing is not None and self.missing[row]:
+            return None
+        return self.buffer[self.offsets[row]:self.offsets[row + 1]].decode('utf-8','surrogatepass')
+
+    def __iter__(self):
+        if self.values is not None:
+            return iter(self.values)
+        return (self[row] for row in range(len(self)))
+
+    def _writable(self):
+        if self.values is None:
+            self.values = list(self)
+            self.buffer = self.offsets = self.missing = None
+        return self.values
+
+    def __setitem__(self,row,value):
+        self._writable()[row] = value
+
+    def __delitem__(self,row):
+        del self._writable()[row]
+
+    def append(self,value):
+        self._writable().append(value)
+
+def encode_strings(values):
+    # The buffer, offsets and missing flags a StringColumn of these values is made of
+    if isinstance(values,StringColumn) and values.values is None:
+        return values.buffer, values.offsets, values.missing or bytes(len(values))
+    encoded = [b"" if value is None else value.encode('utf-8','surrogatepass') for value in values]
+    return b"".join(encoded), array('q',accumulate(map(len,encoded),initial=0)), bytes(value is None for value in values)
+
+def little_endian(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode,values)
+        values.byteswap()
+    return values
+
+def file_checksum(file_name):
+    checksum = 0
+    try:
+        with open(file_name,'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20),b""):
+                checksum = zlib.crc32(chunk,checksum)
+    except FileNotFoundError:
+        return None
+    return checksum
+
+def write_file_atomically(file_name,data):
+    # bytes are written as they are, a dict as a checksummed JSON snapshot and anything else
+    # as plain JSON, returns the number of bytes written. Written to a temporary file next
+    # to the target, flushed to disk and renamed over it, so a crash leaves either the old
+    # or the new file behind, never a half written one
+    temp_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_name,'wb') as f:
+            if isinstance(data,bytes):
+                f.write(data)
+            elif isinstance(data,dict):
+                f.write(encode_json_snapshot(data))
+            else:
+                json.dump(data,codecs.getwriter('utf-8')(f),indent=5,ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+            written = f.tell()
+        try:
+            os.chmod(temp_name,os.stat(file_name).st_mode)
+        except FileNotFoundError:
+            pass
+        os.replace(temp_name,file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    if os.name == "posix":
+        # The rename itself is only durable once the directory is flushed too
+        directory = os.open(os.path.dirname(os.path.abspath(file_name)),os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    return written
+
+# JSON files saved by this version start with the schema version and a CRC-32 of the rest of
+# the file. When both match, load_contacts and load_tasks take the records as they are
+# instead of checking each one again.
+SCHEMA_VERSION = 1
+JSON_SNAPSHOT_HEADER = re.compile(rb'\{\s*"schema": (\d+),\s*"checksum": (\d+),')
+
+def encode_json_snapshot(data):
+    # data is a dict such as {"next_id": 5, "contacts": [...]}
+    body = json.dumps(data,indent=5,ensure_ascii=False)[1:].encode('utf-8')
+    return f'{{\n     "schema": {SCHEMA_VERSION},\n     "checksum": {zlib.crc32(body)},'.encode('utf-8') + body
+
+def json_snapshot_is_intact(f):
+    # f is a file opened in binary mode, it is left at an unknown position
+    f.seek(0)
+    match = JSON_SNAPSHOT_HEADER.match(f.read(256))
+    if match is None or int(match.group(1)) != SCHEMA_VERSION:
+        return False
+    f.seek(match.end())
+    checksum = 0
+    for chunk in iter(lambda: f.read(1 << 20),b""):
+        checksum = zlib.crc32(chunk,checksum)
+    return checksum == int(match.group(2))
+
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+class RecordStream:
+    # Reads a saved list of records one element at a time instead of json.load-ing the whole file.
+    # Accepts a plain JSON array or an object such as {"next_id": 5, "<records_key>": [...]},
+    # the other keys of that object end up in self.header.
+    def __init__(self,f,records_key,chunk_size=1 << 16):
+        self.f = f
+        self.records_key = records_key
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.header = {}
+
+    def _read_more(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self.position = JSON_WHITESPACE.match(self.buffer,self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read_more():
+                return ""
+
+    def _expect(self,char):
+        if self._peek() != char:
+            raise json.decoder.JSONDecodeError(f"Expecting '{char}'",self.buffer,self.position)
+        self.position += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer,self.position)
+            except json.decoder.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            # A number cut at the end of the chunk may go on in the next one
+            if end == len(self.buffer) and self._read_more():
+                continue
+            self.position = end
+            return value
+
+    def _array(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield self._value()
+            if self._peek() == "]":
+                self.position += 1
+                return
+            self._expect(",")
+
+    def __iter__(self):
+        first = self._peek()
+        if first == "[":
+            yield from self._array()
+        elif first == "{":
+            self.position += 1
+            while self._peek() != "}":
+                key = self._value()
+                self._expect(":")
+                if key == self.records_key:
+                    yield from self._array()
+                else:
+                    self.header[key] = self._value()
+                if self._peek() == ",":
+                    self.position += 1
+            self.position += 1
+        elif first != "":
+            raise json.decoder.JSONDecodeError("Expecting '[' or '{'",self.buffer,self.position)
+
+class OrderedRecords:
+    # The records of a list mode store in order, a dict used as an ordered set, so removing
+    # one takes O(1) where a list would search and shift all that follow it
+    __slots__ = ("records",)
+
+    def __init__(self,records=()):
+        self.records = dict.fromkeys(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self,record):
+        return record in self.records
+
+    def append(self,record):
+        self.records[record] = None
+
+    def remove(self,record):
+        try:
+            del self.records[record]
+        except KeyError:
+            raise ValueError("Record not found.")
+
+class Journal:
+    # Append-only JSON-lines log of the changes made since the snapshot file was last saved.
+    # The first line holds the snapshot checksum, so a journal that is older than the
+    # snapshot (crash between saving and resetting the journal) is never replayed twice.
+    def __init__(self,file_name):
+        self.file_name = file_name
+        self.file = None
+        self.entries = 0
+        self.is_clean = False
+
+    def replay(self,snapshot_checksum):
+        self.entries = 0
+        self.is_clean = False
+        try:
+            f = open(self.file_name,'r',encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            try:
+                header = json.loads(f.readline())
+            except json.decoder.JSONDecodeError:
+                return
+            if header.get("snapshot") != snapshot_checksum:
+                return
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # The last write was cut off, everything before it is still good
+                    return
+                self.entries += 1
+                yield entry
+        self.is_clean = True
+
+    def resume(self):
+        self.file = open(self.file_name,'a',encoding='utf-8')
+
+    def reset(self,snapshot_checksum):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.file_name,'w',encoding='utf-8')
+        self.file.write(json.dumps({"snapshot":snapshot_checksum}) + "\n")
+        self.file.flush()
+        self.entries = 0
+
+    def append(self,entry):
+        self.file.write(json.dumps(entry,ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.entries += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class BackgroundWriter:
+    # Runs flush() on a daemon thread once no new request came in for delay seconds, so a
+    # burst of changes ends in a single write and the caller never waits for the disk
+    def __init__(self,flush,delay=1.0):
+        self.flush = flush
+        self.delay = delay
+        self.due = None
+        self.closed = False
+        self.condition = threading.Condition()
+        # Held for a whole flush, so flush_now and the thread never write at the same time
+        self.write_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+
+    def request(self):
+        with self.condition:
+            self.due = time.monotonic() + self.delay
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (self.due is None or self.due > time.monotonic()):
+                    self.condition.wait(None if self.due is None else self.due - time.monotonic())
+                if self.closed:
+                    return
+                self.due = None
+            self._flush()
+
+    def _flush(self):
+        with self.write_lock:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"An unexpected error occurred: {e}")
+
+    def flush_now(self):
+        with self.condition:
+            self.due = None
+        self._flush()
+
+    def close(self):
+        # Stops the thread, writing right away if a flush was still waiting
+        with self.condition:
+            pending = self.due is not None
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        if pending:
+            self._flush()
+
+class FileLock:
+    # Advisory lock held on a separate <file_name>.lock file, so the data file itself can be
+    # rewritten while it is held. Shared for reading, exclusive for read-merge-write.
+    # Windows only has exclusive byte range locks, readers take those too there.
+    def __init__(self,file_name,exclusive=True):
+        self.file_name = file_name
+        self.exclusive = exclusive
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.file_name,'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(),fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(),msvcrt.LK_LOCK,1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after about 10 seconds, keep waiting
+                    pass
+        return self
+
+    def __exit__(self,*exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(),fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(),msvcrt.LK_UNLCK,1)
+        self.file.close()
+        self.file = None
+
+TRIE_BITS = 5
+TRIE_WIDTH = 1 << TRIE_BITS
+TRIE_MASK = TRIE_WIDTH - 1
+EMPTY_NODE = (None,) * TRIE_WIDTH
+
+def trie_set(node,shift,key,value):
+    # Returns the new node and whether the key is new, only the nodes on the path are copied
+    node = node or EMPTY_NODE
+    index = (key >> shift) & TRIE_MASK
+    if shift == 0:
+        added = node[index] is None
+        child = value
+    else:
+        child, added = trie_set(node[index],shift - TRIE_BITS,key,value)
+    return node[:index] + (child,) + node[index + 1:], added
+
+def trie_remove(node,shift,key):
+    # Returns the new node, None once it is empty, and whether the key was there
+    if node is None:
+        return None, False
+    index = (key >> shift) & TRIE_MASK
+    if shift == 0:
+        if node[index] is None:
+            return node, False
+    else:
+        child, removed = trie_remove(node[index],shift - TRIE_BITS,key)
+        if not removed:
+            return node, False
+    node = node[:index] + ((None if shift == 0 else child),) + node[index + 1:]
+    return (None if node.count(None) == TRIE_WIDTH else node), True
+
+def trie_grow(node):
+    # One level up, the node becomes the first child of the new root
+    return None if node is None else (node,) + EMPTY_NODE[1:]
+
+def trie_diff(node,other,shift,prefix=0):
+    if node is other:
+        return
+    node = node or EMPTY_NODE
+    other = other or EMPTY_NODE
+    for index in range(TRIE_WIDTH):
+        child = node[index]
+        other_child = other[index]
+        if child is other_child:
+            continue
+        key = prefix | (index << shift)
+        if shift > 0:
+            yield from trie_diff(child,other_child,shift - TRIE_BITS,key)
+        elif child != other_child:
+            yield key, child, other_child
+
+def trie_items(node,shift,prefix=0):
+    if node is None:
+        return
+    for index, child in enumerate(node):
+        if child is None:
+            continue
+        key = prefix | (index << shift)
+        if shift == 0:
+            yield key, child
+        else:
+            yield from trie_items(child,shift - TRIE_BITS,key)
+
+class PersistentMap:
+    # An immutable map from small int keys to values, kept as a 32-way trie of tuples. set()
+    # and remove() return a new map that copies only the few nodes on the way to the key and
+    # shares all the others with the map it came from.
+    __slots__ = ("root","shift","count")
+
+    def __init__(self,root=None,shift=0,count=0):
+        self.root = root
+        self.shift = shift
+        self.count = count
+
+    @classmethod
+    def from_values(cls,values):
+        # Keys 0, 1, 2, ... in the order of values, built bottom up instead of one set() each
+        values = list(values)
+        nodes = [tuple(values[start:start + TRIE_WIDTH]) for start in range(0,len(values),TRIE_WIDTH)]
+        shift = 0
+        while len(nodes) > 1:
+            nodes[-1] += (None,) * (TRIE_WIDTH - len(nodes[-1]))
+            nodes = [tuple(nodes[start:start + TRIE_WIDTH]) for start in range(0,len(nodes),TRIE_WIDTH)]
+            shift += TRIE_BITS
+        if not nodes:
+            return cls()
+        return cls(nodes[0] + (None,) * (TRIE_WIDTH - len(nodes[0])),shift,len(values))
+
+    def __len__(self):
+        return self.count
+
+    def get(self,key):
+        if key >> (self.shift + TRIE_BITS):
+            return None
+        node = self.root
+        shift = self.shift
+        while node is not None:
+            node = node[(key >> shift) & TRIE_MASK]
+            if shift == 0:
+                return node
+            shift -= TRIE_BITS
+        return None
+
+    def set(self,key,value):
+        root = self.root
+        shift = self.shift
+        while key >> (shift + TRIE_BITS):
+            root = trie_grow(root)
+            shift += TRIE_BITS
+        root, added = trie_set(root,shift,key,value)
+        return PersistentMap(root,shift,self.count + added)
+
+    def remove(self,key):
+        if key >> (self.shift + TRIE_BITS):
+            return self
+        root, removed = trie_remove(self.root,self.shift,key)
+        return PersistentMap(root,self.shift,self.count - removed) if removed else self
+
+    def items(self):
+        # In key order
+        return trie_items(self.root,self.shift)
+
+    def diff(self,other):
+        # (key, value here, value in other) for every key whose value differs. Subtrees the two
+        # maps share are skipped without looking inside, so close versions compare quickly.
+        root, shift = self.root, self.shift
+        other_root, other_shift = other.root, other.shift
+        while shift < other_shift:
+            root = trie_grow(root)
+            shift += TRIE_BITS
+        while other_shift < shift:
+            other_root = trie_grow(other_root)
+            other_shift += TRIE_BITS
+        return trie_diff(root,other_root,shift)
+
+class History:
+    # Undo/redo steps and named versions of a book or list, see enable_history. A version is a
+    # (PersistentMap, next_id) pair. The map goes from a record key, handed out in list order,
+    # to the record's fields as a tuple starting with its ID. Versions share every record and
+    # trie node they have in common, so a step only costs memory for what it changed.
+    def __init__(self,records,next_id,stable_ids,limit=None):
+        self.stable_ids = stable_ids
+        self.undo_steps = deque(maxlen=limit)
+        self.redo_steps = []
+        self.named = {}
+        # Batch methods group their changes into one step, see _history_step
+        self.depth = 0
+        self.reset(PersistentMap.from_values(records),next_id)
+
+    def reset(self,records,next_id,keys=None,ids=None):
+        # keys and ids, in list order, are read from records unless given
+        self.records = records
+        self.next_id = next_id
+        self.committed = (records,next_id)
+        if keys is None:
+            keys = []
+            ids = []
+            for key, record in records.items():
+                keys.append(key)
+                ids.append(record[0])
+        self.keys = keys
+        self.ids = ids
+        self.next_key = self.keys[-1] + 1 if self.keys else 0
+
+    def _position(self,record_id):
+        # Legacy IDs are 1..n in list order, stable IDs are increasing
+        if not self.stable_ids:
+            return record_id - 1 if 0 < record_id <= len(self.keys) else None
+        position = bisect_left(self.ids,record_id)
+        return position if position < len(self.ids) and self.ids[position] == record_id else None
+
+    def get(self,record_id):
+        position = self._position(record_id)
+        return None if position is None else self.records.get(self.keys[position])
+
+    def put(self,record,next_id):
+        position = self._position(record[0])
+        if position is None:
+            self.records = self.records.set(self.next_key,record)
+            self.keys.append(self.next_key)
+            self.ids.append(record[0])
+            self.next_key += 1
+        elif self.records.get(self.keys[position])[1:] != record[1:]:
+            # The ID is left out, legacy IDs shift and are worked out again on restore
+            self.records = self.records.set(self.keys[position],record)
+        self.next_id = next_id
+        self.commit()
+
+    def remove(self,record_ids):
+        # IDs refer to the records before this call
+        positions = sorted({position for position in map(self._position,record_ids) if position is not None},reverse=True)
+        for position in positions:
+            self.records = self.records.remove(self.keys[position])
+            del self.keys[position]
+            del self.ids[position]
+        self.commit()
+
+    def commit(self):
+        if self.depth > 0 or self.records is self.committed[0]:
+            return
+        self.undo_steps.append(self.committed)
+        self.redo_steps.clear()
+        self.committed = (self.records,self.next_id)
+
+# Upper bounds, in seconds, of the latency histogram buckets. Slower calls go in a last "slower" bucket.
+LATENCY_BUCKETS = (0.00001,0.0001,0.001,0.01,0.1,1.0)
+
+class Stats:
+    # Opt-in counters for the hot paths, see enable_stats. Timed methods get a call count,
+    # total and slowest time and a latency histogram, add() keeps running totals such as
+    # records scanned and bytes written. With profile, the timed calls also run under
+    # cProfile, and with trace_memory tracemalloc follows the memory they use.
+    def __init__(self,profile=False,trace_memory=False):
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.totals = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.profiling = 0
+        self.trace_memory = trace_memory
+        # Tracing someone else started is left running on close
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.dumper = None
+
+    def timed(self,name,method):
+        def timed_method(*args,**kwargs):
+            profiler = self.profiler
+            if profiler is not None:
+                # Nested timed calls run inside the outer one's profile
+                self.profiling += 1
+                if self.profiling == 1:
+                    profiler.enable()
+            start = time.perf_counter()
+            try:
+                return method(*args,**kwargs)
+            finally:
+                self.record(name,time.perf_counter() - start)
+                if profiler is not None:
+                    self.profiling -= 1
+                    if self.profiling == 0:
+                        profiler.disable()
+        return timed_method
+
+    def record(self,name,seconds):
+        with self.lock:
+            entry = self.methods.get(name)
+            if entry is None:
+                entry = self.methods[name] = {"calls":0,"seconds":0.0,"slowest":0.0,"buckets":[0] * (len(LATENCY_BUCKETS) + 1)}
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["slowest"] = max(entry["slowest"],seconds)
+            entry["buckets"][bisect_left(LATENCY_BUCKETS,seconds)] += 1
+
+    def add(self,name,amount=1):
+        with self.lock:
+            self.totals[name] = self.totals.get(name,0) + amount
+
+    def as_dict(self):
+        with self.lock:
+            methods = {}
+            for name, entry in self.methods.items():
+                labels = [f"<={bound * 1000:g}ms" for bound in LATENCY_BUCKETS] + ["slower"]
+                methods[name] = {"calls":entry["calls"],"seconds":round(entry["seconds"],6),
+                                 "average_seconds":round(entry["seconds"] / entry["calls"],9),"slowest_seconds":round(entry["slowest"],6),
+                                 "histogram":dict(zip(labels,entry["buckets"]))}
+            stats = {"methods":methods,"totals":dict(self.totals)}
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            stats["memory"] = {"current_bytes":current,"peak_bytes":peak}
+        return stats
+
+    def profile_report(self,limit=20):
+        # The slowest functions by cumulative time, as printed by pstats
+        if self.profiler is None:
+            return ""
+        text = io.StringIO()
+        pstats.Stats(self.profiler,stream=text).sort_stats("cumulative").print_stats(limit)
+        return text.getvalue()
+
+    def dump(self,file_name=None):
+        # To file_name as JSON, or to stderr
+        if file_name is None:
+            print(json.dumps(self.as_dict(),indent=2),file=sys.stderr)
+        else:
+            write_file_atomically(file_name,json.dumps(self.as_dict(),indent=2).encode('utf-8'))
+
+    def dump_every(self,seconds,file_name=None):
+        self.stop_dumping()
+        stopped = threading.Event()
+        def run():
+            while not stopped.wait(seconds):
+                self.dump(file_name)
+        thread = threading.Thread(target=run,daemon=True)
+        self.dumper = (stopped,thread)
+        thread.start()
+
+    def stop_dumping(self):
+        if self.dumper is not None:
+            stopped, thread = self.dumper
+            stopped.set()
+            thread.join()
+            self.dumper = None
+
+    def close(self):
+        self.stop_dumping()
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.started_tracing = False
+
+def pages(records,page_size=None):
+    # Lists of up to page_size records (all of them when None), taken from records only as
+    # each page is asked for
+    records = iter(records)
+    while True:
+        page = list(islice(records,page_size))
+        if not page:
+            return
+        yield page
+
+def render_page(page):
+    # The whole page as one string, so it is printed in a single write
+    return "\n".join(map(str,page))
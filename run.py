@@ -0,0 +1,25 @@
+import importlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Where the modules live, the apps import recordstore and the root modules import the apps
+PATHS = (ROOT,os.path.join(ROOT,"Contact Book App"),os.path.join(ROOT,"Todo List App"))
+# Name given on the command line -> module whose main() runs
+PROGRAMS = {"contacts":"ContactBookApp","contacts-storage":"ContactBookStorage","contacts-transfer":"ContactBookTransfer",
+            "todo":"ToDoListApp","todo-storage":"ToDoListStorage","service":"service","benchmark":"benchmark"}
+
+def main():
+    # python run.py <program> [arguments], e.g. python run.py todo or
+    # python run.py contacts-storage contacts.json contacts.db
+    if len(sys.argv) < 2 or sys.argv[1] not in PROGRAMS:
+        print(f"Usage: python run.py <program> [arguments], where program is one of: {', '.join(PROGRAMS)}.")
+        return
+    name = sys.argv.pop(1)
+    sys.path[:0] = [path for path in PATHS if path not in sys.path]
+    # Shown as the program name in argparse usage messages
+    sys.argv[0] = f"run.py {name}"
+    importlib.import_module(PROGRAMS[name]).main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import signal
+from itertools import islice
+
+from recordstore import write_file_atomically
+from ContactBookStorage import SqliteContactBook, open_contact_book
+from ToDoListStorage import SqliteTodoList, open_todo_list
+
+# A response can hold a whole list, allow far longer lines than the 64 KiB asyncio default
+LINE_LIMIT = 2 ** 26
+# Mutations applied in one go before the writer lets reads in again
+WRITE_BATCH = 64
+
+class StoreService:
+    # Serves one ContactBook or TodoList inside an event loop. Mutations are queued and applied
+    # by a single writer task in arrival order. Reads run straight on the loop between two writer
+    # batches, so they see every change of a batch or none of it and never wait on a lock.
+    # JSON and binary files are saved once save_delay seconds pass without new changes: the
+    # store's snapshot is taken in a worker thread between two writer batches, while reads go
+    # on, and written out from another. SQLite stores commit every change themselves.
+    def __init__(self,store,reads,writes,save_delay=0.5):
+        if store.journal is not None or store.shared or store.writer is not None:
+            raise ValueError("The service saves the file itself, open it without journal, shared or write_behind.")
+        self.store = store
+        self.reads = reads
+        self.writes = writes
+        self.save_delay = save_delay
+        self.persist = not isinstance(store,(SqliteContactBook,SqliteTodoList))
+        self.queue = asyncio.Queue()
+        # Held by the writer while it applies a batch and by a save while it takes its snapshot
+        self.store_lock = asyncio.Lock()
+        # Set by close() before it queues the stop, so no write can end up behind it
+        self.closed = False
+        self.flushing = asyncio.Event()
+        self.dirty = False
+        self.save_task = None
+        self.writer_task = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < WRITE_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            # One SQLite transaction per batch instead of one commit per change
+            async with self.store_lock:
+                with contextlib.nullcontext() if self.persist else self.store.transaction():
+                    for item in batch:
+                        if item is None:
+                            break
+                        operation, arguments, future = item
+                        if future.cancelled():
+                            continue
+                        try:
+                            future.set_result(operation(**arguments))
+                        except Exception as e:
+                            future.set_exception(e)
+                        self.dirty = True
+            if None in batch:
+                # Anything behind the stop is refused rather than left waiting forever
+                leftovers = batch[batch.index(None) + 1:]
+                while not self.queue.empty():
+                    leftovers.append(self.queue.get_nowait())
+                for item in leftovers:
+                    if item is not None and not item[2].done():
+                        item[2].set_exception(ValueError("The service is closing, the change was not made."))
+                return
+            self._schedule_save()
+            # Let the reads waiting on the loop in before the next batch
+            await asyncio.sleep(0)
+
+    def _schedule_save(self):
+        if self.persist and self.dirty and (self.save_task is None or self.save_task.done()):
+            self.save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        while self.dirty:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.flushing.wait(),self.save_delay)
+            self.dirty = False
+            try:
+                # No writer batch can be half applied in the snapshot, the next one waits for it
+                async with self.store_lock:
+                    data = await asyncio.to_thread(self.store.snapshot)
+                await asyncio.to_thread(write_file_atomically,self.store.file_name,data)
+            except Exception as e:
+                self.dirty = True
+                print(f"An unexpected error occurred: {e}")
+                return
+
+    async def read(self,name,**arguments):
+        return self.reads[name](**arguments)
+
+    async def write(self,name,**arguments):
+        if self.closed:
+            raise ValueError("The service is closing, the change was not made.")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((self.writes[name],arguments,future))
+        return await future
+
+    def is_read(self,name):
+        if name in self.reads:
+            return True
+        if name in self.writes:
+            return False
+        raise ValueError(f"Unknown operation: {name}.")
+
+    async def close(self):
+        # Applies what is still queued, saves right away and closes the store
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put_nowait(None)
+        await self.writer_task
+        self.flushing.set()
+        self._schedule_save()
+        if self.save_task is not None:
+            await self.save_task
+        self.store.close()
+
+def contact_service(file_name,save_delay=0.5,**options):
+    options.setdefault("stable_ids",True)
+    options.setdefault("lazy",False)
+    book = open_contact_book(file_name,**options)
+
+    def to_dicts(contacts):
+        return [contact.to_dict() for contact in contacts or []]
+
+    def get(contact_id):
+        contact = book.get_contact_by_id(contact_id)
+        return None if contact is None else contact.to_dict()
+
+    def search(query,is_name=False,is_phone=False,limit=None,fuzzy=False):
+        return to_dicts(book.contactss(query,is_name,is_phone,limit,fuzzy))
+
+    def list_contacts(offset=0,limit=None):
+        stop = None if limit is None else offset + limit
+        return to_dicts(islice(book.contacts,offset,stop))
+
+    reads = {"get":get,"find":lambda name: to_dicts(book.get_contact_by_name(name)),"search":search,
+             "list":list_contacts,"count":lambda: len(book)}
+    writes = {"add_many":book.add_many,"update_many":book.update_many,"delete_many":book.delete_many}
+    return StoreService(book,reads,writes,save_delay)
+
+def task_service(file_name,save_delay=0.5,**options):
+    options.setdefault("stable_ids",True)
+    options.setdefault("lazy",False)
+    todo_list = open_todo_list(file_name,**options)
+
+    def get(task_id):
+        task = todo_list.get_task_by_id(task_id)
+        return None if task is None else task.to_dict()
+
+    def next_task():
+        task = todo_list.next_task()
+        return None if task is None else task.to_dict()
+
+    def list_tasks(status=None,priority_level=None):
+        return [task.to_dict() for task in todo_list.get_tasks(status,priority_level)]
+
+    def next_due():
+        task = todo_list.next_due()
+        return None if task is None else task.to_dict()
+
+    def delete_completed():
+        return todo_list.delete_many([task.task_id for task in todo_list.get_tasks(status=True)])
+
+    reads = {"get":get,"next":next_task,"list":list_tasks,"count":lambda: len(todo_list),"next_due":next_due,
+             "overdue":lambda now=None: [task.to_dict() for task in todo_list.overdue(now)],
+             "due_within":lambda seconds=3600,now=None: [task.to_dict() for task in todo_list.due_within(seconds,now)]}
+    writes = {"add_many":todo_list.add_many,"update_many":todo_list.update_many,"delete_many":todo_list.delete_many,
+              "delete_completed":delete_completed}
+    return StoreService(todo_list,reads,writes,save_delay)
+
+class Server:
+    # One JSON object per line each way. A request is {"id": .., "store": "contacts" or "tasks",
+    # "op": .., "args": {..}}, the response {"id": .., "ok": true, "result": ..} or
+    # {"id": .., "ok": false, "error": ..}. Requests on one connection are pipelined: reads are
+    # answered right away, writes once the writer applied them, so match responses by id.
+    def __init__(self,services):
+        self.services = services
+
+    async def handle(self,reader,writer):
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError,ConnectionError):
+                    break
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.get("id")
+                    service = self.services.get(request.get("store"))
+                    if service is None:
+                        raise ValueError(f"Unknown store: {request.get('store')}.")
+                    name = request.get("op")
+                    arguments = request.get("args") or {}
+                    if service.is_read(name):
+                        self._respond(writer,request_id,service.reads[name],arguments)
+                        await writer.drain()
+                        continue
+                except (ValueError,TypeError,AttributeError) as e:
+                    self._send(writer,{"id":request.get("id") if isinstance(request,dict) else None,"ok":False,"error":str(e)})
+                    continue
+                task = asyncio.create_task(self._respond_later(writer,request_id,service,name,arguments))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+    def _respond(self,writer,request_id,operation,arguments):
+        try:
+            result = operation(**arguments)
+        except Exception as e:
+            self._send(writer,{"id":request_id,"ok":False,"error":str(e)})
+        else:
+            self._send(writer,{"id":request_id,"ok":True,"result":result})
+
+    async def _respond_later(self,writer,request_id,service,name,arguments):
+        try:
+            result = await service.write(name,**arguments)
+        except Exception as e:
+            self._send(writer,{"id":request_id,"ok":False,"error":str(e)})
+        else:
+            self._send(writer,{"id":request_id,"ok":True,"result":result})
+
+    def _send(self,writer,response):
+        if not writer.is_closing():
+            writer.write(json.dumps(response,ensure_ascii=False).encode('utf-8') + b"\n")
+
+    async def close(self):
+        for service in self.services.values():
+            await service.close()
+
+class ServiceClient:
+    # Any number of calls can be waiting on one connection, responses are matched by id
+    def __init__(self,reader,writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 1
+        self.waiting = {}
+        self.reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.waiting.pop(response.get("id"),None)
+                if future is None or future.done():
+                    continue
+                if response.get("ok"):
+                    future.set_result(response.get("result"))
+                else:
+                    future.set_exception(ValueError(response.get("error")))
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("The service closed the connection."))
+            self.waiting.clear()
+
+    async def call(self,store,op,**arguments):
+        if self.reader_task.done():
+            raise ConnectionError("The service closed the connection.")
+        request_id = self.next_id
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = future
+        request = {"id":request_id,"store":store,"op":op,"args":arguments}
+        self.writer.write(json.dumps(request,ensure_ascii=False).encode('utf-8') + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self.writer.wait_closed()
+        await self.reader_task
+
+async def connect(host="127.0.0.1",port=8765,path=None):
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path,limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(host,port,limit=LINE_LIMIT)
+    return ServiceClient(reader,writer)
+
+async def serve(options):
+    services = {}
+    if options.contacts:
+        services["contacts"] = contact_service(options.contacts,options.save_delay,columnar=options.columnar)
+    if options.tasks:
+        services["tasks"] = task_service(options.tasks,options.save_delay,columnar=options.columnar)
+    server = Server(services)
+    if options.socket:
+        listener = await asyncio.start_unix_server(server.handle,options.socket,limit=LINE_LIMIT)
+        print(f"Serving {', '.join(services)} on {options.socket}")
+    else:
+        listener = await asyncio.start_server(server.handle,options.host,options.port,limit=LINE_LIMIT)
+        print(f"Serving {', '.join(services)} on {options.host}:{options.port}")
+
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGINT,signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(signal_number,stop.set)
+    try:
+        await stop.wait()
+    finally:
+        listener.close()
+        await server.close()
+        print("Saved and stopped.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a contact book and a to-do list to many clients over a local socket.")
+    parser.add_argument("--contacts",default="contacts.json",help="contact book file, empty to leave it out")
+    parser.add_argument("--tasks",default="tasks.json",help="to-do list file, empty to leave it out")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=8765)
+    parser.add_argument("--socket",help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--save-delay",type=float,default=0.5,help="seconds without changes before the files are saved")
+    parser.add_argument("--columnar",action="store_true",help="use the columnar storage backends")
+    options = parser.parse_args()
+    try:
+        asyncio.run(serve(options))
+    except ValueError as v:
+        print(v)
+
+if __name__ == "__main__":
+    main()
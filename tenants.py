@@ -0,0 +1,238 @@
+import contextlib
+import io
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
+
+from ContactBookStorage import SQLITE_EXTENSIONS, SqliteContactBook, open_contact_book
+from ToDoListStorage import SqliteTodoList, open_todo_list
+
+TENANT_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+# (kind, columnar) -> memory per loaded record, measured once per process (see record_bytes)
+RECORD_BYTES = {}
+# Memory per store before any record, mostly the journal's file buffer
+STORE_BYTES = 8 << 10
+# Open files left to the rest of the process when the store count comes from the file limit
+SPARE_FILES = 64
+
+def check_tenant_name(tenant):
+    # Tenant names become directory names, so nothing that could leave the root
+    if not isinstance(tenant,str) or not TENANT_NAME.fullmatch(tenant):
+        raise ValueError(f"Invalid tenant name: {tenant!r}. Use up to 64 letters, digits, '_', '.' and '-', starting with a letter or digit.")
+    return tenant
+
+def sample_record(kind,number):
+    if kind == "contacts":
+        return {"name":f"Contact {number:05}","phone":f"555{number:07}","email":f"contact{number}@example.com"}
+    return {"description":f"Task number {number:05}","priority_level":("High","Medium","Low")[number % 3]}
+
+def record_bytes(kind,columnar,count=200):
+    # Memory per loaded record, measured with tracemalloc on a throwaway store of made up
+    # records the first time it is asked for. A list mode contact is large because of its
+    # lookup and substring search indexes.
+    key = (kind,columnar)
+    if key not in RECORD_BYTES:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+                opener = open_contact_book if kind == "contacts" else open_todo_list
+                store = opener(os.path.join(directory,f"{kind}.json"),columnar=columnar,lazy=False)
+                try:
+                    before = tracemalloc.get_traced_memory()[0]
+                    store.add_many([sample_record(kind,number) for number in range(count)])
+                    RECORD_BYTES[key] = max(1,(tracemalloc.get_traced_memory()[0] - before) // count)
+                finally:
+                    store.close()
+        finally:
+            if started:
+                tracemalloc.stop()
+    return RECORD_BYTES[key]
+
+def estimated_size(kind,store):
+    # SQLite stores keep their records on disk
+    if isinstance(store,(SqliteContactBook,SqliteTodoList)):
+        return STORE_BYTES
+    return STORE_BYTES + len(store) * record_bytes(kind,store.columnar)
+
+def default_max_stores():
+    # Every loaded store keeps a file open, its journal or its SQLite database (which may add
+    # a rollback journal while writing), so at most a quarter of the open file limit is used
+    if resource is None:
+        return 128
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limit == resource.RLIM_INFINITY:
+        return 4096
+    return max(1,(limit - SPARE_FILES) // 4)
+
+class StoreManager:
+    # Holds the contact books and to-do lists of many tenants, each in its own directory
+    # <root>/<tenant>/. A store is loaded the first time it is asked for and kept while the
+    # estimated memory of all loaded stores fits in memory_budget bytes and there are at most
+    # max_stores of them (by default as many as the open file limit allows, see
+    # default_max_stores). Beyond that the least recently used ones are saved and closed, and
+    # so are ones left unused for idle_timeout seconds (see evict_idle). They are loaded again
+    # when next asked for. The memory of a store is estimated from its record count and the
+    # memory per record measured once at startup (see record_bytes).
+    #
+    # A store is only handed out inside a with block and is never evicted while one is open
+    # on it, do not keep it past the block. options go to ContactBook and TodoList, with a
+    # journal by default, so every change is on disk right away and a store without
+    # journal entries needs no save before it is closed. Like the stores, a manager is
+    # meant for one thread.
+    def __init__(self,root,memory_budget=256 << 20,idle_timeout=None,contacts_file="contacts.json",tasks_file="tasks.json",max_stores=None,**options):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.max_stores = default_max_stores() if max_stores is None else max_stores
+        if self.max_stores < 1:
+            raise ValueError("max_stores must be at least 1.")
+        self.idle_timeout = idle_timeout
+        self.file_names = {"contacts":contacts_file,"tasks":tasks_file}
+        if "lazy" in options:
+            raise ValueError("Stores are always loaded when first asked for, lazy cannot be set.")
+        options.setdefault("journal",True)
+        self.options = options
+        for kind, file_name in self.file_names.items():
+            if not file_name.lower().endswith(SQLITE_EXTENSIONS):
+                record_bytes(kind,options.get("columnar",False))
+        # (kind, tenant) -> store, least recently used first
+        self.stores = OrderedDict()
+        self.sizes = {}
+        self.last_used = {}
+        self.pins = {}
+        self.loads = 0
+        self.evictions = 0
+        os.makedirs(root,exist_ok=True)
+
+    @contextlib.contextmanager
+    def contact_book(self,tenant):
+        key = ("contacts",check_tenant_name(tenant))
+        store = self._acquire(key)
+        try:
+            yield store
+        finally:
+            self._release(key)
+
+    @contextlib.contextmanager
+    def todo_list(self,tenant):
+        key = ("tasks",check_tenant_name(tenant))
+        store = self._acquire(key)
+        try:
+            yield store
+        finally:
+            self._release(key)
+
+    def _acquire(self,key):
+        store = self.stores.get(key)
+        if store is None:
+            self._make_room()
+            store = self._open(key)
+        else:
+            self.stores.move_to_end(key)
+        self.pins[key] = self.pins.get(key,0) + 1
+        return store
+
+    def _open(self,key):
+        kind, tenant = key
+        directory = os.path.join(self.root,tenant)
+        os.makedirs(directory,exist_ok=True)
+        file_name = os.path.join(directory,self.file_names[kind])
+        opener = open_contact_book if kind == "contacts" else open_todo_list
+        store = opener(file_name,**self.options,lazy=False)
+        self.stores[key] = store
+        self.sizes[key] = estimated_size(kind,store)
+        self.loads += 1
+        return store
+
+    def _release(self,key):
+        self.pins[key] -= 1
+        if self.pins[key] == 0:
+            del self.pins[key]
+        if key not in self.stores:
+            return
+        self.sizes[key] = estimated_size(key[0],self.stores[key])
+        self.last_used[key] = time.monotonic()
+        self._fit()
+        if self.idle_timeout is not None:
+            self.evict_idle()
+
+    def _make_room(self):
+        # Closes the least recently used stores not in use until one more can be opened
+        while len(self.stores) >= self.max_stores:
+            key = next((key for key in self.stores if key not in self.pins),None)
+            if key is None:
+                return
+            self._evict(key)
+
+    def _fit(self):
+        # The most recently used store always stays, even when it alone is over the budget
+        while self.memory_used > self.memory_budget and len(self.stores) > 1:
+            key = next((key for key in self.stores if key not in self.pins),None)
+            if key is None or key == next(reversed(self.stores)):
+                return
+            self._evict(key)
+
+    @property
+    def memory_used(self):
+        return sum(self.sizes.values())
+
+    def _flush(self,key):
+        store = self.stores[key]
+        if isinstance(store,(SqliteContactBook,SqliteTodoList)):
+            return
+        if store.journal is not None and store.journal.entries == 0:
+            return
+        if key[0] == "contacts":
+            store.save_contacts()
+        else:
+            store.save_tasks()
+
+    def _evict(self,key):
+        self._flush(key)
+        self.stores.pop(key).close()
+        del self.sizes[key]
+        self.last_used.pop(key,None)
+        self.evictions += 1
+
+    def evict(self,tenant):
+        # Saves and closes both stores of tenant unless one of them is in use
+        for kind in ("contacts","tasks"):
+            key = (kind,check_tenant_name(tenant))
+            if key in self.stores and key not in self.pins:
+                self._evict(key)
+
+    def evict_idle(self,idle_timeout=None):
+        # Saves and closes the stores not used for idle_timeout seconds (the manager's own by
+        # default), returns how many went
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        if idle_timeout is None:
+            raise ValueError("No idle_timeout given.")
+        cutoff = time.monotonic() - idle_timeout
+        idle = [key for key in self.stores if key not in self.pins and self.last_used.get(key,cutoff) < cutoff]
+        for key in idle:
+            self._evict(key)
+        return len(idle)
+
+    def flush(self):
+        # Saves every loaded store with unsaved changes, all stay loaded
+        for key in list(self.stores):
+            self._flush(key)
+
+    def tenants(self):
+        # Names of all tenants with a directory under root, loaded or not
+        return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir() and TENANT_NAME.fullmatch(entry.name))
+
+    def close(self):
+        for key in list(self.stores):
+            self._evict(key)
+        self.pins.clear()
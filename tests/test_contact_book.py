@@ -0,0 +1,706 @@
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT,os.path.join(ROOT,"Contact Book App")]
+
+from ContactBookApp import Contact, ContactBook, ContactView, FuzzyIndex, check_email_format, check_valid_contact_id, check_valid_name, check_valid_phone_number, edit_distance, name_trigrams, rank_names, sync_contact_books, trigram_similarity, validate_contact_columns
+from ContactBookStorage import SqliteContactBook, migrate_contacts, open_contact_book
+from ContactBookTransfer import import_contacts
+from recordstore import StringColumn, write_file_atomically
+
+class ContactBookTestCase(unittest.TestCase):
+    # Every test gets its own directory, the books print their messages into a buffer
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def path(self,name):
+        return os.path.join(self.directory,name)
+
+    def open_book(self,name="contacts.json",**options):
+        book = ContactBook(self.path(name),**options)
+        self.addCleanup(book.close)
+        return book
+
+class IndexConsistencyTest(ContactBookTestCase):
+    def check_indexes(self,book):
+        for contact in book.contacts:
+            self.assertIs(book.get_contact_by_id(contact.contact_id).name,contact.name)
+            self.assertIn(contact.contact_id,[found.contact_id for found in book.get_contact_by_name(contact.name)])
+        if not book.columnar:
+            self.assertEqual(sorted(book.contacts_by_phone),sorted(contact.phone for contact in book.contacts))
+            self.assertEqual(sorted(book.contacts_by_name),sorted({contact.name.lower() for contact in book.contacts}))
+
+    def test_failed_update_changes_nothing(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                book = self.open_book(f"{columnar}.json",columnar=columnar)
+                book.add_contact("Alice","0123456789","alice@example.com")
+                book.update_contact_by_id(1,name="Zed",phone="abc")
+                results = book.update_many([{"contact_id":1,"name":"Zed","email":"not an email"}])
+                self.assertFalse(results[0]["ok"])
+                contact = book.get_contact_by_id(1)
+                self.assertEqual((contact.name,contact.phone,contact.email),("Alice","0123456789","alice@example.com"))
+                self.assertIsNone(book.get_contact_by_name("Zed"))
+                self.assertEqual(len(book.contactss("ali",is_name=True)),1)
+                self.check_indexes(book)
+
+    def test_delete_after_failed_update(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                book = self.open_book(f"{columnar}.json",columnar=columnar)
+                book.add_contact("Alice","0123456789")
+                book.add_contact("Bob","0123456780")
+                book.update_contact_by_id(1,name="Zed",phone="abc")
+                book.delete_contact_by_id(1)
+                self.assertIsNone(book.get_contact_by_name("Alice"))
+                with self.assertRaises(ValueError):
+                    book.delete_contact_by_name("Alice")
+                self.assertEqual([contact.name for contact in book.contacts],["Bob"])
+                self.check_indexes(book)
+
+    def test_update_moves_indexes(self):
+        book = self.open_book()
+        book.add_contact("Alice","0123456789")
+        book.update_contact_by_id(1,name="Alicia",phone="0123456780")
+        self.assertIsNone(book.get_contact_by_name("Alice"))
+        self.assertEqual(book.get_contact_by_name("alicia")[0].phone,"0123456780")
+        book.add_contact("Other","0123456789")
+        self.assertEqual(len(book.contacts),2)
+        self.check_indexes(book)
+
+class JournalTest(ContactBookTestCase):
+    def crash(self,book):
+        # Like a process dying: the journal file is left as it is and nothing is saved
+        book.journal.close()
+
+    def state(self,book):
+        return [contact.to_dict() for contact in book.contacts]
+
+    def test_replay_after_crash(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                name = f"{columnar}.json"
+                book = ContactBook(self.path(name),journal=True,columnar=columnar)
+                book.add_many([{"name":"Alice","phone":"0123456789"},{"name":"Bob","phone":"0123456780"},{"name":"Carol","phone":"0123456781"}])
+                book.update_contact_by_id(2,name="Robert",email="bob@example.com")
+                book.delete_contact_by_id(1)
+                expected = self.state(book)
+                self.crash(book)
+                reopened = self.open_book(name,journal=True,columnar=columnar)
+                self.assertEqual(self.state(reopened),expected)
+                self.assertEqual(reopened.get_contact_by_name("robert")[0].phone,"0123456780")
+
+    def test_undo_survives_crash(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                name = f"{columnar}.json"
+                book = ContactBook(self.path(name),journal=True,columnar=columnar,history=True,stable_ids=True)
+                book.add_contact("Alice","0123456789")
+                book.add_contact("Bob","0123456780")
+                book.undo()
+                expected = (self.state(book),book.next_id)
+                self.crash(book)
+                reopened = self.open_book(name,journal=True,columnar=columnar,stable_ids=True)
+                self.assertEqual((self.state(reopened),reopened.next_id),expected)
+
+class StreamingLoadTest(ContactBookTestCase):
+    def test_legacy_file_loads_with_progress(self):
+        # As saved before schema headers: a plain indented array
+        contacts = [{"contact_id":number,"name":f"Person {number}","phone":f"0{number:09}","email":f"p{number}@example.com" if number % 2 else None}
+                    for number in range(1,20002)]
+        with open(self.path("contacts.json"),'w',encoding='utf-8') as f:
+            json.dump(contacts,f,indent=5,ensure_ascii=False)
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                progress = []
+                book = self.open_book(columnar=columnar,progress=progress.append,lazy=False)
+                self.assertEqual(progress,[10000,20000,20001])
+                self.assertEqual([contact.to_dict() for contact in book.contacts],contacts)
+                self.assertEqual(book.get_contact_by_id(20001).phone,"0000020001")
+
+class ColumnarTest(ContactBookTestCase):
+    CONTACTS = [{"name":"Alice","phone":"0000000001","email":"alice@example.com"},{"name":"Bob","phone":"0123456789"},
+                {"name":"Zoë","phone":"9999999999","email":"zoe@example.com"}]
+
+    def test_no_instance_dicts(self):
+        book = self.open_book(columnar=True)
+        book.add_many(self.CONTACTS)
+        for contact in (Contact("Alice","0123456789",1),book.get_contact_by_id(1)):
+            self.assertFalse(hasattr(contact,"__dict__"))
+            with self.assertRaises(AttributeError):
+                contact.note = "x"
+
+    def test_views_behave_like_contacts(self):
+        contacts = self.open_book("list.json",stable_ids=True)
+        columns = self.open_book("columns.json",stable_ids=True,columnar=True)
+        for book in (contacts,columns):
+            book.add_many(self.CONTACTS)
+            book.get_contact_by_id(2).update("Robert","0000000002","bob@example.com")
+        self.assertIsInstance(columns.get_contact_by_id(1),ContactView)
+        self.assertEqual([contact.to_dict() for contact in columns.contacts],[contact.to_dict() for contact in contacts.contacts])
+        self.assertEqual([str(contact) for contact in columns.contacts],[str(contact) for contact in contacts.contacts])
+        # Phones are packed as integers, leading zeros come back
+        self.assertEqual([contact.phone for contact in columns.contacts],["0000000001","0000000002","9999999999"])
+        self.assertEqual(columns.get_contact_by_name("robert")[0].contact_id,2)
+
+    def test_removed_view_keeps_its_values(self):
+        book = self.open_book(stable_ids=True,columnar=True)
+        book.add_many(self.CONTACTS)
+        columns = book.contacts
+        view = columns.get(2)
+        columns.remove(view)
+        self.assertEqual(view.to_dict(),{"contact_id":2,"name":"Bob","phone":"0123456789","email":None})
+        self.assertEqual(columns.get(3).name,"Zoë")
+        self.assertIsNone(columns.get(2))
+        self.assertEqual([contact.contact_id for contact in columns],[1,3])
+
+    def test_columns_take_less_memory(self):
+        def measure(columnar):
+            tracemalloc.start()
+            try:
+                book = self.open_book(f"{columnar}.json",columnar=columnar,lazy=False)
+                before = tracemalloc.get_traced_memory()[0]
+                book.add_many([{"name":f"Person {number}","phone":f"0{number:09}"} for number in range(3000)])
+                return tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+        self.assertLess(measure(True) * 3,measure(False))
+
+class SnapshotTest(ContactBookTestCase):
+    CONTACTS = [{"name":"Alice","phone":"0000000001","email":"alice@example.com"},{"name":"Bob","phone":"0123456789"},
+                {"name":"Zoë","phone":"9999999999","email":"zoe@example.com"}]
+
+    def fill(self,book):
+        book.add_many(self.CONTACTS)
+        book.save_contacts()
+        return [contact.to_dict() for contact in book.contacts]
+
+    def test_round_trip(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                name = f"{columnar}.bin"
+                saved = self.fill(self.open_book(name,columnar=columnar,file_format="binary"))
+                self.assertEqual(len(saved),3)
+                with open(self.path(name),'rb') as f:
+                    self.assertEqual(f.read(4),b"CBS1")
+                for reopened in (self.open_book(name),self.open_book(name,columnar=True)):
+                    self.assertEqual([contact.to_dict() for contact in reopened.contacts],saved)
+                    self.assertEqual(reopened.file_format,"binary")
+                    # The phone index is rebuilt from the packed phones
+                    self.assertEqual(reopened.add_many([{"name":"Alicia","phone":"0000000001"}]),[{"ok":False,"error":"Phone number: 0000000001 already exists."}])
+
+    def test_names_are_decoded_when_used(self):
+        self.fill(self.open_book("contacts.bin",file_format="binary"))
+        book = self.open_book("contacts.bin",columnar=True)
+        self.assertIsInstance(book.contacts.names,StringColumn)
+        self.assertEqual(book.get_contact_by_id(3).name,"Zoë")
+        self.assertIsNone(book.contacts.names.values)
+        self.assertIsNone(book.get_contact_by_id(2).email)
+
+    def test_damaged_snapshot_is_not_overwritten(self):
+        self.fill(self.open_book("contacts.bin",file_format="binary"))
+        with open(self.path("contacts.bin"),'rb') as f:
+            data = f.read()
+        with open(self.path("contacts.bin"),'wb') as f:
+            f.write(data[:-16])
+        book = self.open_book("contacts.bin")
+        with self.assertRaises(ValueError):
+            len(book)
+        book.save_contacts()
+        with open(self.path("contacts.bin"),'rb') as f:
+            self.assertEqual(f.read(),data[:-16])
+
+class ValidationTest(ContactBookTestCase):
+    CONTACTS = [{"contact_id":1,"name":"Alice","phone":"0123456789","email":"alice@example.com"},
+                {"contact_id":2,"name":"Bob","phone":"0123456780","email":None}]
+
+    def test_batch_matches_single_checks(self):
+        random.seed(15)
+        pools = {"contact_id":[1,2,0,-3,"4",None,2.0,True],"name":["Alice"," Zoë ","","  ","\n","a\nb",None,5],
+                 "phone":["0123456789","012345678","01234567890","01234 5678","０１２３４５６７８９","0123456789\n",None,123],
+                 "email":["alice@example.com","a@b.c","alice","@.","a@b","a\n@b.c","",None,7]}
+        checks = {"contact_id":check_valid_contact_id,"name":check_valid_name,"phone":check_valid_phone_number,"email":check_email_format}
+        for _ in range(50):
+            columns = {field:[random.choice(pool) for _ in range(random.randrange(30))] for field, pool in pools.items()}
+            rows = min(len(values) for values in columns.values())
+            columns = {field:values[:rows] for field, values in columns.items()}
+            expected = []
+            for row in range(rows):
+                for field, check in checks.items():
+                    if field == "email" and columns[field][row] is None:
+                        continue
+                    try:
+                        check(columns[field][row])
+                    except (ValueError,TypeError,AttributeError) as e:
+                        expected.append({"row":row,"field":field,"error":str(e)})
+            self.assertEqual(validate_contact_columns(columns["contact_id"],columns["name"],columns["phone"],columns["email"]),expected)
+
+    def test_unchecked_columns(self):
+        self.assertEqual(validate_contact_columns(names=["Alice",""]),[{"row":1,"field":"name","error":"Name cannot be empty."}])
+        self.assertEqual(validate_contact_columns(),[])
+
+    def test_checksummed_file_is_taken_as_it_is(self):
+        # Nothing but this version writes a matching checksum, so the values are not checked again
+        write_file_atomically(self.path("contacts.json"),{"next_id":3,"contacts":[dict(self.CONTACTS[0],name=""),self.CONTACTS[1]]})
+        book = self.open_book()
+        self.assertEqual([contact.name for contact in book.contacts],["","Bob"])
+        self.assertEqual(book.invalid_records,[])
+
+    def test_changed_file_is_checked(self):
+        write_file_atomically(self.path("contacts.json"),{"next_id":3,"contacts":self.CONTACTS})
+        with open(self.path("contacts.json"),encoding='utf-8') as f:
+            text = f.read()
+        with open(self.path("contacts.json"),'w',encoding='utf-8') as f:
+            f.write(text.replace('"Alice"','""').replace('"0123456780"','"12345"'))
+        book = self.open_book()
+        with self.assertRaises(ValueError):
+            len(book)
+        self.assertEqual([(failure["row"],failure["field"]) for failure in book.invalid_records],[(0,"name"),(1,"phone")])
+
+    def test_every_invalid_record_is_reported(self):
+        contacts = [{"contact_id":number,"name":f"Person {number}","phone":f"{number:010}","email":None} for number in range(1,12001)]
+        contacts[3]["phone"] = "123"
+        contacts[11000]["email"] = "nope"
+        with open(self.path("contacts.json"),'w') as f:
+            json.dump(contacts,f)
+        book = self.open_book()
+        with self.assertRaises(ValueError) as raised:
+            len(book)
+        self.assertIn("has 2 invalid values",str(raised.exception))
+        self.assertEqual([(failure["row"],failure["field"]) for failure in book.invalid_records],[(3,"phone"),(11000,"email")])
+        # Nothing was loaded, so nothing is saved over the file
+        book.save_contacts()
+        with open(self.path("contacts.json")) as f:
+            self.assertEqual(json.load(f),contacts)
+
+class PagingTest(ContactBookTestCase):
+    CONTACTS = [{"name":"bob","phone":"0000000001"},{"name":"Alice","phone":"0000000002"},{"name":"Bob","phone":"0000000003"},
+                {"name":"Zoë","phone":"0000000004"},{"name":"alice","phone":"0000000005"}]
+
+    def open_books(self):
+        books = [self.open_book("list.json",stable_ids=True),self.open_book("columns.json",stable_ids=True,columnar=True),
+                 SqliteContactBook(self.path("contacts.db"),stable_ids=True)]
+        self.addCleanup(books[2].close)
+        for book in books:
+            book.add_many(self.CONTACTS)
+            book.delete_many([3])
+            book.add_many([{"name":"Ann","phone":"0000000006"}])
+        return books
+
+    def listing(self,book,*args):
+        asked = []
+        def more():
+            asked.append(len(asked))
+            return len(asked) < 2
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            book.display_contacts(*args,more=more)
+        return out.getvalue(), len(asked)
+
+    def test_sort_orders(self):
+        for book in self.open_books():
+            with self.subTest(book=type(book).__name__,columnar=getattr(book,"columnar",None)):
+                self.assertEqual([contact.contact_id for contact in book.iter_contacts()],[1,2,4,5,6])
+                self.assertEqual([(contact.name,contact.contact_id) for contact in book.iter_contacts("name")],
+                                 [("Alice",2),("alice",5),("Ann",6),("bob",1),("Zoë",4)])
+                with self.assertRaises(ValueError):
+                    next(book.iter_contacts("phone"))
+
+    def test_display_pages(self):
+        for book in self.open_books():
+            with self.subTest(book=type(book).__name__,columnar=getattr(book,"columnar",None)):
+                # Three pages of two, more() stops the listing before the third
+                text, asked = self.listing(book,"name",2)
+                self.assertEqual(text.splitlines(),[str(contact) for contact in list(book.iter_contacts("name"))[:4]])
+                self.assertEqual(asked,2)
+                text, asked = self.listing(book,"id",None)
+                self.assertEqual(len(text.splitlines()),5)
+                self.assertEqual(asked,0)
+
+    def test_empty_book(self):
+        text, asked = self.listing(self.open_book(),"id",2)
+        self.assertEqual(text,"Your contact book is empty. Add a few contacts first!\n")
+
+class SharedTest(ContactBookTestCase):
+    def open_shared(self):
+        return self.open_book(shared=True)
+
+    def names(self,book):
+        return [(contact.contact_id,contact.name) for contact in book.contacts]
+
+    def test_adds_from_both_are_merged(self):
+        first, second = self.open_shared(), self.open_shared()
+        first.add_many([{"name":"Alice","phone":"0123456789"}])
+        second.add_many([{"name":"Bob","phone":"0123456780"}])
+        first.save_contacts()
+        second.save_contacts()
+        # Bob's ID was taken by Alice meanwhile, he gets the next one
+        self.assertEqual(self.names(second),[(1,"Alice"),(2,"Bob")])
+        self.assertEqual(self.names(self.open_shared()),[(1,"Alice"),(2,"Bob")])
+        self.assertEqual(second.conflicts,[])
+
+    def test_changed_contact_is_a_conflict(self):
+        first = self.open_shared()
+        first.add_many([{"name":"Alice","phone":"0123456789"},{"name":"Bob","phone":"0123456780"}])
+        first.save_contacts()
+        second = self.open_shared()
+        self.assertEqual(len(second.contacts),2)
+        first.update_many([{"contact_id":1,"name":"Alicia"}])
+        first.save_contacts()
+        second.update_many([{"contact_id":1,"name":"Ally"},{"contact_id":2,"name":"Robert"}])
+        second.delete_many([1])
+        second.save_contacts()
+        self.assertEqual([conflict["contact_id"] for conflict in second.conflicts],[1])
+        # The change from the other process is kept and this one is reloaded with it
+        self.assertEqual(self.names(second),[(1,"Alicia"),(2,"Robert")])
+        self.assertEqual(self.names(self.open_shared()),[(1,"Alicia"),(2,"Robert")])
+
+    def test_same_phone_added_twice_is_a_conflict(self):
+        first, second = self.open_shared(), self.open_shared()
+        first.add_many([{"name":"Alice","phone":"0123456789"}])
+        second.add_many([{"name":"Alicia","phone":"0123456789"}])
+        first.save_contacts()
+        second.save_contacts()
+        self.assertEqual([conflict["error"] for conflict in second.conflicts],["Phone number: 0123456789 already exists."])
+        self.assertEqual(self.names(second),[(1,"Alice")])
+
+class ChangeFeedTest(ContactBookTestCase):
+    def open_replica(self,name,**options):
+        return self.open_book(name,stable_ids=True,change_feed=True,**options)
+
+    def state(self,book):
+        return sorted((contact.phone,contact.name,contact.email) for contact in book.contacts)
+
+    def test_changes_travel(self):
+        first, second = self.open_replica("first.json"), self.open_replica("second.json",columnar=True)
+        first.add_many([{"name":"Alice","phone":"0123456789","email":"alice@example.com"},{"name":"Bob","phone":"0123456780"}])
+        second.add_many([{"name":"Carol","phone":"0123456781"}])
+        self.assertEqual(first.replica_seq,2)
+        delta = first.export_delta()
+        self.assertEqual([(change["phone"],change["seq"],change["origin"]) for change in delta["changes"]],
+                         [("0123456789",1,first.replica_id),("0123456780",2,first.replica_id)])
+        result = second.apply_delta(delta)
+        self.assertEqual((result["applied"],result["skipped"],result["conflicts"],result["rejected"]),(2,0,[],[]))
+        self.assertEqual(second.synced_seq(first.replica_id),2)
+        # Only what changed since the last sync is sent
+        self.assertEqual(first.export_delta(first.replica_seq)["changes"],[])
+        first.update_many([{"contact_id":1,"name":"Alicia"}])
+        first.delete_many([2])
+        delta = first.export_delta(second.synced_seq(first.replica_id))
+        self.assertEqual([(change["phone"],change.get("deleted",False)) for change in delta["changes"]],[("0123456789",False),("0123456780",True)])
+        second.apply_delta(delta)
+        self.assertEqual(self.state(second),[("0123456781","Carol",None),("0123456789","Alicia","alice@example.com")])
+
+    def test_replicas_agree_after_syncing(self):
+        books = [self.open_replica("first.json"),self.open_replica("second.json",columnar=True),self.open_replica("third.json")]
+        random.seed(24)
+        names = ["Alice","Bob","Carol","Dan"]
+        for _ in range(20):
+            for book in books:
+                for _ in range(3):
+                    phone = f"012345678{random.randrange(6)}"
+                    action = random.random()
+                    contact = next((contact for contact in book.contacts if contact.phone == phone),None)
+                    if contact is None:
+                        book.add_many([{"name":random.choice(names),"phone":phone}])
+                    elif action < 0.3:
+                        book.delete_many([contact.contact_id])
+                    else:
+                        book.update_many([{"contact_id":contact.contact_id,"name":random.choice(names)}])
+            first, second = random.sample(books,2)
+            sync_contact_books(first,second)
+        for first, second in ((books[0],books[1]),(books[1],books[2]),(books[0],books[1])):
+            sync_contact_books(first,second)
+        self.assertEqual(self.state(books[0]),self.state(books[1]))
+        self.assertEqual(self.state(books[1]),self.state(books[2]))
+
+    def test_conflicts(self):
+        for resolve, expected in (("latest","Remote"),("local","Local"),("remote","Remote"),(lambda local, remote: local,"Local")):
+            with self.subTest(resolve=resolve):
+                here, there = self.open_replica(f"here{id(resolve)}.json"), self.open_replica(f"there{id(resolve)}.json")
+                here.add_many([{"name":"Alice","phone":"0123456789"}])
+                there.apply_delta(here.export_delta())
+                here.update_many([{"contact_id":1,"name":"Local"}])
+                # The later change wins with "latest"
+                time.sleep(0.01)
+                there.update_many([{"contact_id":1,"name":"Remote"}])
+                result = here.apply_delta(there.export_delta(here.synced_seq(there.replica_id)),resolve)
+                self.assertEqual([(conflict["phone"],conflict["local"]["name"],conflict["remote"]["name"]) for conflict in result["conflicts"]],
+                                 [("0123456789","Local","Remote")])
+                self.assertEqual(self.state(here),[("0123456789",expected,None)])
+
+    def test_bad_deltas(self):
+        first, second = self.open_replica("first.json"), self.open_replica("second.json")
+        first.add_many([{"name":"Alice","phone":"0123456789"}])
+        delta = first.export_delta()
+        with self.assertRaises(ValueError):
+            first.apply_delta(delta)
+        with self.assertRaises(ValueError):
+            second.apply_delta(delta,"newest")
+        delta["changes"].append({"phone":"123","seq":2,"time":0,"origin":first.replica_id,"name":"Bob"})
+        result = second.apply_delta(delta)
+        self.assertEqual((result["applied"],[rejected["change"]["phone"] for rejected in result["rejected"]]),(1,["123"]))
+        with self.assertRaises(ValueError):
+            self.open_book("plain.json").export_delta()
+
+    def test_feed_survives_reopening(self):
+        book = self.open_replica("first.json")
+        book.add_many([{"name":"Alice","phone":"0123456789"},{"name":"Bob","phone":"0123456780"}])
+        book.save_contacts()
+        replica_id = book.replica_id
+        book.add_many([{"name":"Carol","phone":"0123456781"}])
+        book.close()
+        # Carol was never saved, her add is followed by a delete so the other replicas drop her too
+        reopened = self.open_replica("first.json")
+        self.assertEqual(reopened.replica_id,replica_id)
+        self.assertEqual([(change["phone"],change["seq"],change.get("deleted",False)) for change in reopened.export_delta(2)["changes"]],
+                         [("0123456781",4,True)])
+        # A change made with the feed off is picked up on the next open
+        plain = self.open_book("first.json",stable_ids=True)
+        plain.update_many([{"contact_id":2,"name":"Robert"}])
+        plain.save_contacts()
+        reopened.close()
+        reopened = self.open_replica("first.json")
+        self.assertEqual([(change["phone"],change["seq"],change["name"]) for change in reopened.export_delta(4)["changes"]],[("0123456780",5,"Robert")])
+
+class HistoryTest(ContactBookTestCase):
+    # Books load lazily by default, the first batch call must still be a single undo step
+    def test_batch_on_lazy_book_is_one_step(self):
+        book = self.open_book(history=True)
+        book.add_many([{"name":"Bob","phone":"0123456780"},{"name":"Carol","phone":"0123456781"}])
+        book.undo()
+        self.assertEqual(len(book.contacts),0)
+        book.redo()
+        self.assertEqual([contact.name for contact in book.contacts],["Bob","Carol"])
+
+    def test_stable_id_deletes_keep_order(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                book = self.open_book(f"{columnar}.json",history=True,columnar=columnar,stable_ids=True)
+                ids = lambda: [contact.contact_id for contact in book.contacts]
+                book.add_many([{"name":f"Person {number}","phone":f"012345678{number}"} for number in range(1,7)])
+                book.delete_contact_by_id(2)
+                book.delete_many([4,4,5])
+                book.add_many([{"name":"Person 7","phone":"0123456787"}])
+                self.assertEqual(ids(),[1,3,6,7])
+                for expected in ([1,3,6],[1,3,4,5,6],[1,2,3,4,5,6]):
+                    book.undo()
+                    self.assertEqual(ids(),expected)
+                book.delete_contact_by_id(3)
+                self.assertEqual([contact.name for contact in book.contacts],["Person 1","Person 2","Person 4","Person 5","Person 6"])
+
+    def test_undo_on_lazy_book(self):
+        book = self.open_book(history=True,stable_ids=True)
+        book.add_many([{"name":"Bob","phone":"0123456780"}])
+        book.save_contacts()
+        reopened = self.open_book(history=True,stable_ids=True)
+        with self.assertRaisesRegex(ValueError,"Nothing to undo"):
+            reopened.undo()
+
+    def test_import_is_one_step(self):
+        with open(self.path("people.csv"),'w',encoding='utf-8') as f:
+            f.write("name,phone,email\nBob,0123456780,\nCarol,0123456781,carol@example.com\n")
+        book = self.open_book(history=True)
+        report = import_contacts(book,self.path("people.csv"),workers=1)
+        self.assertEqual(report["imported"],2)
+        book.undo()
+        self.assertEqual(len(book.contacts),0)
+
+    def test_apply_delta_is_one_step(self):
+        source = self.open_book("source.json",change_feed=True)
+        source.add_many([{"name":"Bob","phone":"0123456780"},{"name":"Carol","phone":"0123456781"}])
+        book = self.open_book(history=True,change_feed=True)
+        self.assertEqual(book.apply_delta(source.export_delta())["applied"],2)
+        book.undo()
+        self.assertEqual(len(book.contacts),0)
+
+class SearchIndexTest(ContactBookTestCase):
+    # The substring indexes must find exactly what a scan over every contact finds
+    SYLLABLES = ["an","ber","cal","den","el","fi","ga","han","is","jo","ka","li","mar","no"]
+
+    def open_books(self):
+        books = [self.open_book("list.json",stable_ids=True),self.open_book("columns.json",stable_ids=True,columnar=True),
+                 SqliteContactBook(self.path("contacts.db"),stable_ids=True)]
+        self.addCleanup(books[2].close)
+        return books
+
+    def random_contacts(self,generator,count):
+        name = lambda: " ".join("".join(generator.choice(self.SYLLABLES) for _ in range(generator.randint(1,3))).title() for _ in range(2))
+        return [{"name":name(),"phone":f"0{generator.randrange(10 ** 9):09}"} for _ in range(count)]
+
+    def scan(self,book,query,is_name,is_phone):
+        return [contact.contact_id for contact in book.iter_contacts() if (is_name and query in contact.name.lower()) or (is_phone and query in contact.phone)]
+
+    def found(self,book,query,is_name=False,is_phone=False,limit=None):
+        try:
+            return [contact.contact_id for contact in book.contactss(query,is_name,is_phone,limit)]
+        except ValueError:
+            return []
+
+    def check_queries(self,books,generator):
+        names = [contact.name.lower() for contact in books[0].contacts]
+        phones = [contact.phone for contact in books[0].contacts]
+        for _ in range(150):
+            is_name = generator.random() < 0.5
+            text = generator.choice(names if is_name else phones)
+            start = generator.randrange(len(text))
+            query = text[start:start + generator.randint(1,5)]
+            expected = self.scan(books[0],query,is_name,not is_name)
+            for book in books:
+                self.assertEqual(self.found(book,query,is_name,not is_name),expected,(query,type(book).__name__,book.columnar))
+        for book in books:
+            self.assertEqual(self.found(book,"zzz",is_name=True),[])
+            self.assertEqual(self.found(book,"999999999999",is_phone=True),[])
+
+    def test_index_matches_scan(self):
+        generator = random.Random(2)
+        books = self.open_books()
+        contacts = self.random_contacts(generator,300)
+        for book in books:
+            book.add_many(contacts)
+        self.check_queries(books,generator)
+        # The indexes follow updates and deletes
+        updates = [{"contact_id":contact_id,"name":data["name"],"phone":data["phone"]}
+                   for contact_id, data in zip(generator.sample(range(1,301),60),self.random_contacts(generator,60))]
+        deleted = generator.sample(range(1,301),40)
+        for book in books:
+            book.update_many(updates)
+            book.delete_many(deleted)
+            book.get_contact_by_id(next(contact_id for contact_id in range(1,301) if contact_id not in deleted)).update("Zed Quorra","0999999999")
+        self.check_queries(books,generator)
+        for book in books:
+            self.assertEqual(self.found(book,"quorr",is_name=True),self.scan(books[0],"quorr",True,False))
+
+    def test_index_scans_only_candidates(self):
+        book = self.open_book(stats=True)
+        book.add_many(self.random_contacts(random.Random(3),200) + [{"name":"Quentin Xu","phone":"0777777777"}])
+        self.assertEqual([contact.name for contact in book.contactss("xu",is_name=True)],["Quentin Xu"])
+        self.assertLess(book.stats.totals["records_scanned.contactss"],10)
+
+    def test_limit_returns_first_matches(self):
+        books = self.open_books()
+        contacts = self.random_contacts(random.Random(4),100)
+        for book in books:
+            book.add_many(contacts)
+            everything = self.found(book,"an",is_name=True)
+            self.assertGreater(len(everything),5)
+            self.assertEqual(self.found(book,"an",is_name=True,limit=5),everything[:5])
+            self.assertEqual(self.found(book,"0",is_phone=True,limit=3),self.found(book,"0",is_phone=True)[:3])
+        with self.assertRaises(ValueError):
+            books[0].contactss("an",is_name=True,limit=0)
+
+class FuzzySearchTest(unittest.TestCase):
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance("kitten","sitting"),3)
+        self.assertEqual(edit_distance("","abc"),3)
+        self.assertEqual(edit_distance("abc",""),3)
+        self.assertEqual(edit_distance("a" * 80,"b" * 70),80)
+
+    def test_rank_matches_scoring_every_name(self):
+        rng = random.Random(3)
+        syllables = ["an","bo","ca","de","el","fi","ga","ho","is","ju"]
+        names = sorted({" ".join("".join(rng.choice(syllables) for _ in range(rng.randint(1,3))) for _ in range(2)) for _ in range(2000)})
+        index = FuzzyIndex()
+        for name in names:
+            index.add(name)
+        for name in rng.sample(names,50):
+            query = name[:3] + "x" + name[4:]
+            grams = name_trigrams(query)
+            scored = [(trigram_similarity(grams,name_trigrams(other)),other) for other in names]
+            for limit in (1,10,None):
+                self.assertEqual(index.rank(query,limit),rank_names(query,scored,limit))
+
+    def test_rank_with_trigrams_nobody_has(self):
+        index = FuzzyIndex()
+        index.add("ann lee")
+        self.assertEqual(index.rank("ann leqxzw"),["ann lee"])
+        self.assertEqual(index.rank("qxzwvy"),[])
+
+class SqliteContactBookTest(ContactBookTestCase):
+    def test_duplicate_phone_update_keeps_the_contact(self):
+        book = SqliteContactBook(self.path("contacts.db"))
+        self.addCleanup(book.close)
+        book.add_many([{"name":"Alice","phone":"0123456789"},{"name":"Bob","phone":"0123456780","email":"bob@example.com"}])
+        contact = book.get_contact_by_id(2)
+        with self.assertRaisesRegex(TypeError,"0123456789 already exists"):
+            contact.update("Robert","0123456789","robert@example.com")
+        self.assertEqual(contact.to_dict(),{"contact_id":2,"name":"Bob","phone":"0123456780","email":"bob@example.com"})
+        self.assertEqual(book.get_contact_by_id(2).to_dict(),contact.to_dict())
+
+    def test_has_the_contact_book_attributes(self):
+        book = SqliteContactBook(self.path("contacts.db"))
+        self.addCleanup(book.close)
+        for name in ("lock","conflicts","invalid_records","keeps_history","keeps_feed"):
+            self.assertTrue(hasattr(book,name),name)
+
+    def test_migrate_replays_the_journal(self):
+        for stable_ids in (False,True):
+            with self.subTest(stable_ids=stable_ids):
+                source = ContactBook(self.path(f"{stable_ids}.json"),journal=True,stable_ids=stable_ids)
+                source.add_many([{"name":"Alice","phone":"0123456789"},{"name":"Bob","phone":"0123456780"}])
+                source.delete_many([1])
+                # Left uncompacted, as after a crash
+                source.journal.close()
+                self.assertEqual(migrate_contacts(self.path(f"{stable_ids}.json"),self.path(f"{stable_ids}.db"),stable_ids),(1,[]))
+                book = SqliteContactBook(self.path(f"{stable_ids}.db"),stable_ids=stable_ids)
+                self.addCleanup(book.close)
+                self.assertEqual([contact.name for contact in book.contacts],["Bob"])
+
+class BackendParityTest(ContactBookTestCase):
+    # The same changes on a JSON and on a SQLite book must leave both in the same state
+    def run_changes(self,file_name,**options):
+        book = open_contact_book(self.path(file_name),**options)
+        seen = [book.add_many([
+            {"name":"Alice","phone":"0123456789","email":"alice@example.com"},
+            {"name":"Bob","phone":"0123456780"},
+            {"name":"alice","phone":"0123456781"},
+            {"name":"Carol","phone":"0123456789"},
+            {"name":"Dave","phone":"12"},
+            {"name":"Erin","phone":"0123456782"},
+        ])]
+        seen.append(book.update_many([
+            {"contact_id":2,"name":"Robert","email":"bob@example.com"},
+            {"contact_id":3,"phone":"0123456782"},
+            {"contact_id":3,"email":"not an email"},
+            {"contact_id":99,"name":"Nobody"},
+        ]))
+        seen.append(book.delete_many([1,1,99]))
+        book.add_contact("Frank","0123456783")
+        seen.append(self.state(book))
+        book.save_contacts()
+        book.close()
+        book = open_contact_book(self.path(file_name),**options)
+        self.addCleanup(book.close)
+        seen.append(self.state(book))
+        return seen
+
+    def state(self,book):
+        dicts = lambda contacts: [contact.to_dict() for contact in contacts or ()]
+        return {
+            "by_id":dicts(book.iter_contacts()),
+            "by_name":dicts(book.iter_contacts("name")),
+            "name_search":dicts(book.contactss("r",is_name=True)),
+            "phone_search":dicts(book.contactss("678",is_phone=True)),
+            "fuzzy":dicts(book.contactss("robrt",is_name=True,fuzzy=True,limit=2)),
+            "same_name":dicts(book.get_contact_by_name("ALICE ")),
+            "next_id":book.next_id,
+        }
+
+    def test_json_and_sqlite_books_agree(self):
+        for stable_ids in (False,True):
+            expected = self.run_changes(f"contacts{stable_ids}.db",stable_ids=stable_ids)
+            for columnar in (False,True):
+                with self.subTest(stable_ids=stable_ids,columnar=columnar):
+                    self.assertEqual(self.run_changes(f"contacts{stable_ids}{columnar}.json",stable_ids=stable_ids,columnar=columnar),expected)
+
+if __name__ == "__main__":
+    unittest.main()
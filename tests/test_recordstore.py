@@ -0,0 +1,173 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+from recordstore import BackgroundWriter, FileLock, RecordStream, fcntl, json_snapshot_is_intact, pages, render_page, write_file_atomically
+
+class RecordStreamTest(unittest.TestCase):
+    RECORDS = [{"task_id":1,"description":"Say \"hi\" to Zoë ✓","priority_level":"High","is_completed":False},
+               {"task_id":12345678901234,"description":"Numbers","score":1.5e10,"tags":[[1,2],{"a":None}]},
+               {"task_id":3,"description":"","priority_level":"Low","is_completed":True}]
+
+    def stream(self,text,chunk_size):
+        return RecordStream(io.StringIO(text),"tasks",chunk_size)
+
+    def test_matches_json_load(self):
+        documents = [self.RECORDS,{"next_id":7,"tasks":self.RECORDS},{"tasks":self.RECORDS,"next_id":7,"extra":{"a":[1,"]"]}},
+                     [],{"tasks":[]},{}]
+        for document in documents:
+            for indent in (None,5):
+                text = json.dumps(document,indent=indent,ensure_ascii=False)
+                # Small chunks cut strings, escapes and numbers at every possible place
+                for chunk_size in (1,2,3,7,64,1 << 16):
+                    with self.subTest(text=text[:40],chunk_size=chunk_size):
+                        stream = self.stream(text,chunk_size)
+                        records = document if isinstance(document,list) else document.get("tasks",[])
+                        self.assertEqual(list(stream),records)
+                        self.assertEqual(stream.header,{} if isinstance(document,list) else {key:value for key, value in document.items() if key != "tasks"})
+
+    def test_empty_file(self):
+        self.assertEqual(list(self.stream("",16)),[])
+
+    def test_records_come_one_at_a_time(self):
+        # Only what the next record needs is read from the file
+        text = json.dumps(self.RECORDS * 1000)
+        f = io.StringIO(text)
+        first = next(iter(RecordStream(f,"tasks",256)))
+        self.assertEqual(first,self.RECORDS[0])
+        self.assertLess(f.tell(),1024)
+
+    def test_damaged_input_raises(self):
+        for text in ('[{"task_id": 1},','{"tasks": [1 2]}','nope','{"tasks": [{"task_id": 1]}','[{"task_id": 1}'):
+            for chunk_size in (1,4,1 << 16):
+                with self.subTest(text=text,chunk_size=chunk_size):
+                    with self.assertRaises(json.decoder.JSONDecodeError):
+                        list(self.stream(text,chunk_size))
+
+class PagesTest(unittest.TestCase):
+    def test_page_sizes(self):
+        self.assertEqual(list(pages(range(7),3)),[[0,1,2],[3,4,5],[6]])
+        self.assertEqual(list(pages(range(6),3)),[[0,1,2],[3,4,5]])
+        self.assertEqual(list(pages(range(7))),[list(range(7))])
+        self.assertEqual(list(pages([],3)),[])
+
+    def test_records_are_taken_as_pages_are_asked_for(self):
+        taken = []
+        def records():
+            for number in range(100):
+                taken.append(number)
+                yield number
+        first = next(pages(records(),10))
+        self.assertEqual(first,list(range(10)))
+        self.assertEqual(taken,list(range(10)))
+
+    def test_render_page(self):
+        self.assertEqual(render_page([1,"two",None]),"1\ntwo\nNone")
+        self.assertEqual(render_page([]),"")
+
+class AtomicWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.file_name = os.path.join(self.directory,"tasks.json")
+
+    def test_writes_each_kind_of_data(self):
+        self.assertEqual(write_file_atomically(self.file_name,b"abc"),3)
+        with open(self.file_name,'rb') as f:
+            self.assertEqual(f.read(),b"abc")
+        write_file_atomically(self.file_name,[{"description":"Zoë"}])
+        with open(self.file_name,encoding='utf-8') as f:
+            self.assertEqual(json.load(f),[{"description":"Zoë"}])
+        write_file_atomically(self.file_name,{"next_id":2,"tasks":[{"task_id":1}]})
+        with open(self.file_name,'rb') as f:
+            self.assertTrue(json_snapshot_is_intact(f))
+            f.seek(0)
+            data = json.load(f)
+        self.assertEqual(data,{"schema":1,"checksum":data["checksum"],"next_id":2,"tasks":[{"task_id":1}]})
+        self.assertEqual(os.listdir(self.directory),["tasks.json"])
+
+    def test_failed_write_keeps_old_file(self):
+        write_file_atomically(self.file_name,[{"task_id":1}])
+        with self.assertRaises(TypeError):
+            # The first record is written before the second one fails
+            write_file_atomically(self.file_name,[{"task_id":2},{"task_id":object()}])
+        with open(self.file_name) as f:
+            self.assertEqual(json.load(f),[{"task_id":1}])
+        self.assertEqual(os.listdir(self.directory),["tasks.json"])
+
+    def test_damaged_snapshot_is_not_intact(self):
+        write_file_atomically(self.file_name,{"next_id":2,"tasks":[{"task_id":1}]})
+        with open(self.file_name,'rb') as f:
+            data = f.read()
+        with open(self.file_name,'wb') as f:
+            f.write(data.replace(b'"task_id": 1',b'"task_id": 7'))
+        with open(self.file_name,'rb') as f:
+            self.assertFalse(json_snapshot_is_intact(f))
+
+class BackgroundWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.flushes = []
+
+    def test_burst_is_one_write(self):
+        writer = BackgroundWriter(lambda: self.flushes.append(time.monotonic()),0.1)
+        self.addCleanup(writer.close)
+        for _ in range(20):
+            writer.request()
+        time.sleep(0.5)
+        self.assertEqual(len(self.flushes),1)
+        writer.request()
+        time.sleep(0.5)
+        self.assertEqual(len(self.flushes),2)
+
+    def test_close_writes_what_is_pending(self):
+        writer = BackgroundWriter(lambda: self.flushes.append(1),60)
+        writer.request()
+        writer.close()
+        self.assertEqual(self.flushes,[1])
+        self.assertFalse(writer.thread.is_alive())
+
+    def test_close_without_changes_does_not_write(self):
+        writer = BackgroundWriter(lambda: self.flushes.append(1),60)
+        writer.close()
+        self.assertEqual(self.flushes,[])
+
+    def test_flush_now_cancels_the_pending_write(self):
+        writer = BackgroundWriter(lambda: self.flushes.append(1),0.1)
+        writer.request()
+        writer.flush_now()
+        time.sleep(0.3)
+        writer.close()
+        self.assertEqual(self.flushes,[1])
+
+class FileLockTest(unittest.TestCase):
+    def setUp(self):
+        self.lock_file = os.path.join(self.enterContext(tempfile.TemporaryDirectory()),"tasks.json.lock")
+
+    def test_exclusive_lock_waits(self):
+        entered = threading.Event()
+        def take_lock():
+            with FileLock(self.lock_file):
+                entered.set()
+        with FileLock(self.lock_file):
+            thread = threading.Thread(target=take_lock)
+            thread.start()
+            time.sleep(0.2)
+            self.assertFalse(entered.is_set())
+        self.assertTrue(entered.wait(5))
+        thread.join(5)
+
+    @unittest.skipIf(fcntl is None,"Readers take exclusive locks on Windows")
+    def test_shared_locks_do_not_wait(self):
+        with FileLock(self.lock_file,exclusive=False):
+            with FileLock(self.lock_file,exclusive=False):
+                pass
+
+if __name__ == "__main__":
+    unittest.main()
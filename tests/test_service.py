@@ -0,0 +1,81 @@
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT,os.path.join(ROOT,"Contact Book App"),os.path.join(ROOT,"Todo List App")]
+
+from service import contact_service, task_service
+
+class StoreServiceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    async def test_writes_are_applied_and_saved_on_close(self):
+        service = contact_service(os.path.join(self.directory,"contacts.json"))
+        results = await asyncio.gather(*(service.write("add_many",contacts=[{"name":f"N{i}","phone":f"012345678{i}"}]) for i in range(5)))
+        self.assertTrue(all(result[0]["ok"] for result in results))
+        await service.close()
+        reopened = contact_service(os.path.join(self.directory,"contacts.json"))
+        self.assertEqual(await reopened.read("count"),5)
+        await reopened.close()
+
+    async def test_writes_after_close_are_refused(self):
+        service = contact_service(os.path.join(self.directory,"contacts.json"))
+        queued = asyncio.ensure_future(service.write("add_many",contacts=[{"name":"Alice","phone":"0123456789"}]))
+        await asyncio.sleep(0)
+        closing = asyncio.ensure_future(service.close())
+        await asyncio.sleep(0)
+        with self.assertRaisesRegex(ValueError,"closing"):
+            await service.write("add_many",contacts=[{"name":"Bob","phone":"0123456780"}])
+        await asyncio.wait_for(closing,5)
+        self.assertTrue((await queued)[0]["ok"])
+
+    async def test_nothing_waits_behind_the_stop(self):
+        service = contact_service(os.path.join(self.directory,"contacts.json"))
+        # A write that got into the queue behind the stop, e.g. from code going around write()
+        service.queue.put_nowait(None)
+        stray = asyncio.get_running_loop().create_future()
+        service.queue.put_nowait((service.writes["add_many"],{"contacts":[]},stray))
+        await asyncio.wait_for(service.writer_task,5)
+        with self.assertRaisesRegex(ValueError,"closing"):
+            await asyncio.wait_for(stray,5)
+        service.store.close()
+
+    async def test_snapshot_is_taken_off_the_loop(self):
+        service = contact_service(os.path.join(self.directory,"contacts.json"),save_delay=0)
+        threads = []
+        snapshot = service.store.snapshot
+        def recorded_snapshot():
+            threads.append(threading.current_thread())
+            return snapshot()
+        service.store.snapshot = recorded_snapshot
+        for i in range(3):
+            await service.write("add_many",contacts=[{"name":f"N{i}","phone":f"012345678{i}"}])
+            self.assertEqual(await service.read("count"),i + 1)
+        await service.close()
+        self.assertTrue(threads)
+        self.assertNotIn(threading.main_thread(),threads)
+        reopened = contact_service(os.path.join(self.directory,"contacts.json"))
+        self.assertEqual([contact["name"] for contact in await reopened.read("list")],["N0","N1","N2"])
+        await reopened.close()
+
+    async def test_count_on_every_backend(self):
+        for file_name in ("tasks.json","tasks.db"):
+            with self.subTest(file_name=file_name):
+                service = task_service(os.path.join(self.directory,file_name))
+                await service.write("add_many",tasks=[{"description":f"Task {i}","priority_level":"Low"} for i in range(4)])
+                await service.write("delete_many",task_ids=[2])
+                # Counting must not build every task
+                service.store._select = None
+                self.assertEqual(await service.read("count"),3)
+                await service.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import tracemalloc
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT,os.path.join(ROOT,"Contact Book App"),os.path.join(ROOT,"Todo List App")]
+
+import tenants
+from tenants import StoreManager
+
+class StoreManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def open_manager(self,**options):
+        manager = StoreManager(self.root,**options)
+        self.addCleanup(manager.close)
+        return manager
+
+    def test_store_that_fails_to_open(self):
+        os.makedirs(os.path.join(self.root,"bad"))
+        with open(os.path.join(self.root,"bad","contacts.json"),'w') as f:
+            f.write('{"contacts": [{"contact_id": 1,')
+        manager = self.open_manager()
+        with self.assertRaisesRegex(ValueError,"is damaged"):
+            with manager.contact_book("bad"):
+                pass
+        self.assertEqual(manager.pins,{})
+        self.assertNotIn(("contacts","bad"),manager.stores)
+        with manager.todo_list("bad") as todo_list:
+            todo_list.add_many([{"description":"Repair contacts","priority_level":"High"}])
+        self.assertEqual(manager.pins,{})
+
+    def test_lazy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            StoreManager(self.root,lazy=True)
+
+    def test_invalid_tenant_name(self):
+        manager = self.open_manager()
+        for tenant in ("../escape","",".hidden","a/b"):
+            with self.assertRaises(ValueError):
+                with manager.contact_book(tenant):
+                    pass
+        self.assertEqual(manager.pins,{})
+
+    def test_evicted_stores_keep_their_changes(self):
+        manager = self.open_manager(memory_budget=1)
+        for tenant in ("alice","bob","carol"):
+            with manager.contact_book(tenant) as book:
+                book.add_many([{"name":tenant.title(),"phone":"0123456789"}])
+        self.assertEqual(len(manager.stores),1)
+        self.assertGreater(manager.evictions,0)
+        for tenant in ("alice","bob","carol"):
+            with manager.contact_book(tenant) as book:
+                self.assertEqual([contact.name for contact in book.contacts],[tenant.title()])
+        self.assertEqual(manager.tenants(),["alice","bob","carol"])
+
+    def test_store_in_use_is_not_evicted(self):
+        manager = self.open_manager(memory_budget=1)
+        with manager.contact_book("alice") as book:
+            with manager.contact_book("bob"):
+                pass
+            manager.evict("alice")
+            self.assertIn(("contacts","alice"),manager.stores)
+            book.add_many([{"name":"Alice","phone":"0123456789"}])
+
+    def test_store_count_is_capped(self):
+        manager = self.open_manager(max_stores=2)
+        for tenant in ("alice","bob","carol"):
+            with manager.todo_list(tenant) as todo_list:
+                todo_list.add_many([{"description":f"Call {tenant}","priority_level":"High"}])
+            self.assertLessEqual(len(manager.stores),2)
+        self.assertNotIn(("tasks","alice"),manager.stores)
+        with manager.todo_list("alice") as todo_list:
+            self.assertEqual([task.description for task in todo_list.tasks],["Call alice"])
+
+    @unittest.skipIf(tenants.resource is None,"No open file limit to lower")
+    def test_many_tenants_within_open_file_limit(self):
+        resource = tenants.resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE,(128,hard))
+        self.addCleanup(resource.setrlimit,resource.RLIMIT_NOFILE,(soft,hard))
+        manager = self.open_manager()
+        for number in range(200):
+            with manager.contact_book(f"tenant{number}") as book:
+                book.add_many([{"name":"Alice","phone":"0123456789"}])
+        self.assertLessEqual(len(manager.stores),manager.max_stores)
+
+    def test_record_bytes_are_measured(self):
+        tracing = tracemalloc.is_tracing()
+        for kind in ("contacts","tasks"):
+            for columnar in (False,True):
+                self.assertGreater(tenants.record_bytes(kind,columnar),0)
+        self.assertEqual(tracemalloc.is_tracing(),tracing)
+        # Indexed list mode contacts take more memory than their columns
+        self.assertGreater(tenants.record_bytes("contacts",False),tenants.record_bytes("contacts",True))
+
+if __name__ == "__main__":
+    unittest.main()
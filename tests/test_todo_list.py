@@ -0,0 +1,625 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT,os.path.join(ROOT,"Todo List App")]
+
+from ToDoListApp import Task, TaskView, TodoList, check_due, check_repeat, next_occurrence
+from recordstore import StringColumn, write_file_atomically
+from ToDoListStorage import SqliteTodoList, migrate_tasks, open_todo_list
+
+def add_shared_tasks(file_name,worker,count):
+    # Runs in a separate process, saving after every task so the processes keep interleaving
+    with contextlib.redirect_stdout(io.StringIO()):
+        todo_list = TodoList(file_name,shared=True)
+        for number in range(count):
+            todo_list.add_task(f"Worker {worker} task {number}","Low")
+            todo_list.save_tasks()
+        todo_list.close()
+
+class TodoListTestCase(unittest.TestCase):
+    # Every test gets its own directory, the lists print their messages into a buffer
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def path(self,name):
+        return os.path.join(self.directory,name)
+
+    def open_list(self,name="tasks.json",**options):
+        todo_list = TodoList(self.path(name),**options)
+        self.addCleanup(todo_list.close)
+        return todo_list
+
+class JournalTest(TodoListTestCase):
+    def crash(self,todo_list):
+        # Like a process dying: the journal file is left as it is and nothing is saved
+        todo_list.journal.close()
+
+    def state(self,todo_list):
+        return [task.to_dict() for task in todo_list.tasks]
+
+    def test_replay_after_crash(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                name = f"{columnar}.json"
+                todo_list = TodoList(self.path(name),journal=True,columnar=columnar)
+                todo_list.add_many([{"description":"Write","priority_level":"High"},{"description":"Read","priority_level":"Low"},
+                                    {"description":"Call","priority_level":"Medium"}])
+                todo_list.update_many([{"task_id":2,"description":"Read more","priority_level":"High"}])
+                todo_list.mark_task_completed(3)
+                todo_list.delete_many([1])
+                expected = self.state(todo_list)
+                self.crash(todo_list)
+                reopened = self.open_list(name,journal=True,columnar=columnar)
+                self.assertEqual(self.state(reopened),expected)
+                self.assertEqual([task.description for task in reopened.get_tasks(status=True)],["Call"])
+
+    def test_undo_survives_crash(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                name = f"{columnar}.json"
+                todo_list = TodoList(self.path(name),journal=True,columnar=columnar,history=True)
+                todo_list.add_many([{"description":"Write","priority_level":"High"}])
+                todo_list.add_many([{"description":"Read","priority_level":"Low"}])
+                todo_list.undo()
+                expected = self.state(todo_list)
+                self.crash(todo_list)
+                reopened = self.open_list(name,journal=True,columnar=columnar)
+                self.assertEqual(self.state(reopened),expected)
+
+    def test_cleared_due_date_survives_crash(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                name = f"{columnar}.json"
+                todo_list = TodoList(self.path(name),journal=True,columnar=columnar)
+                todo_list.add_many([{"description":"Rent","priority_level":"High","due":"2030-01-31 09:00","repeat":"monthly"}])
+                todo_list.update_many([{"task_id":1,"due":"","repeat":""}])
+                self.crash(todo_list)
+                reopened = self.open_list(name,journal=True,columnar=columnar)
+                self.assertEqual(self.state(reopened),[{"description":"Rent","task_id":1,"priority_level":"High","is_completed":False}])
+                self.assertIsNone(reopened.next_due())
+
+class SqliteTodoListTest(TodoListTestCase):
+    def test_has_the_todo_list_attributes(self):
+        todo_list = SqliteTodoList(self.path("tasks.db"))
+        self.addCleanup(todo_list.close)
+        for name in ("lock","conflicts","keeps_history","file_format"):
+            self.assertTrue(hasattr(todo_list,name),name)
+
+    def test_migrate_replays_the_journal(self):
+        source = TodoList(self.path("tasks.json"),journal=True)
+        source.add_many([{"description":"Write","priority_level":"High","due":"2030-01-01 09:00","repeat":"daily"},
+                         {"description":"Read","priority_level":"Low"}])
+        source.mark_task_completed(2)
+        # Left uncompacted, as after a crash
+        source.journal.close()
+        self.assertEqual(migrate_tasks(self.path("tasks.json"),self.path("tasks.db")),(2,[]))
+        todo_list = SqliteTodoList(self.path("tasks.db"))
+        self.addCleanup(todo_list.close)
+        self.assertEqual([task.to_dict() for task in todo_list.tasks],
+                         [{"description":"Write","task_id":1,"priority_level":"High","is_completed":False,"due":"2030-01-01 09:00:00","repeat":"daily"},
+                          {"description":"Read","task_id":2,"priority_level":"Low","is_completed":True}])
+
+class StreamingLoadTest(TodoListTestCase):
+    def write_legacy_file(self,name,count):
+        # As saved before schema headers: a plain indented array
+        tasks = [{"task_id":number,"description":f"Task {number}","is_completed":number % 3 == 0,"priority_level":("High","Medium","Low")[number % 3]}
+                 for number in range(1,count + 1)]
+        with open(self.path(name),'w',encoding='utf-8') as f:
+            json.dump(tasks,f,indent=5,ensure_ascii=False)
+        return tasks
+
+    def test_legacy_file_loads_with_progress(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                tasks = self.write_legacy_file(f"{columnar}.json",20001)
+                progress = []
+                todo_list = self.open_list(f"{columnar}.json",columnar=columnar,progress=progress.append,lazy=False)
+                self.assertEqual(progress,[10000,20000,20001])
+                self.assertEqual([task.to_dict() for task in todo_list.tasks],tasks)
+                self.assertEqual(todo_list.next_id,20002)
+
+    def test_damaged_file_is_left_alone(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                self.write_legacy_file(f"{columnar}.json",10)
+                with open(self.path(f"{columnar}.json"),'rb+') as f:
+                    f.truncate(os.path.getsize(self.path(f"{columnar}.json")) - 40)
+                    f.seek(0)
+                    damaged = f.read()
+                todo_list = self.open_list(f"{columnar}.json",columnar=columnar)
+                with self.assertRaisesRegex(ValueError,"is damaged"):
+                    todo_list.get_tasks()
+                with open(self.path(f"{columnar}.json"),'rb') as f:
+                    self.assertEqual(f.read(),damaged)
+
+class SaveTest(TodoListTestCase):
+    def saved(self):
+        with open(self.path("tasks.json")) as f:
+            data = json.load(f)
+        # A new file starts out as an empty list
+        return [task["description"] for task in (data if isinstance(data,list) else data["tasks"])]
+
+    def test_write_behind_saves_later(self):
+        todo_list = self.open_list(write_behind=0.1)
+        todo_list.add_task("Write","High")
+        todo_list.add_task("Read","Low")
+        self.assertEqual(self.saved(),[])
+        time.sleep(0.5)
+        self.assertEqual(self.saved(),["Write","Read"])
+
+    def test_close_saves_pending_changes(self):
+        todo_list = TodoList(self.path("tasks.json"),write_behind=60)
+        todo_list.add_task("Write","High")
+        todo_list.close()
+        self.assertEqual(self.saved(),["Write"])
+
+    def test_save_tasks_writes_right_away(self):
+        todo_list = self.open_list(write_behind=60)
+        todo_list.add_task("Write","High")
+        todo_list.save_tasks()
+        self.assertEqual(self.saved(),["Write"])
+
+    def test_write_behind_needs_a_plain_list(self):
+        for options in ({"journal":True},{"shared":True}):
+            with self.assertRaises(ValueError):
+                TodoList(self.path("tasks.json"),write_behind=1,**options)
+
+    def test_damaged_file_is_not_overwritten(self):
+        with open(self.path("tasks.json"),'w') as f:
+            f.write('[{"description": "Wri')
+        todo_list = self.open_list()
+        with self.assertRaises(ValueError):
+            len(todo_list)
+        todo_list.add_task("Read","Low")
+        todo_list.save_tasks()
+        with open(self.path("tasks.json")) as f:
+            self.assertEqual(f.read(),'[{"description": "Wri')
+        self.assertEqual(os.listdir(self.directory),["tasks.json"])
+
+class TrustedLoadTest(TodoListTestCase):
+    TASKS = [{"task_id":1,"description":"Write","is_completed":False,"priority_level":"High","due":"2030-01-31 09:00:00","repeat":"monthly"},
+             {"task_id":2,"description":"Read","is_completed":True,"priority_level":"Low"}]
+
+    def test_checksummed_file_is_taken_as_it_is(self):
+        write_file_atomically(self.path("tasks.json"),{"tasks":[dict(self.TASKS[0],description="  "),self.TASKS[1]]})
+        todo_list = self.open_list()
+        self.assertEqual([task.description for task in todo_list.tasks],["  ","Read"])
+        self.assertEqual(todo_list.get_task_by_id(1).due,datetime(2030,1,31,9,0))
+
+    def test_changed_file_is_checked(self):
+        write_file_atomically(self.path("tasks.json"),{"tasks":self.TASKS})
+        with open(self.path("tasks.json")) as f:
+            text = f.read()
+        with open(self.path("tasks.json"),'w') as f:
+            f.write(text.replace('"Write"','"  "'))
+        todo_list = self.open_list()
+        with self.assertRaises(ValueError):
+            len(todo_list)
+
+    def test_unchanged_file_loads_the_same_either_way(self):
+        write_file_atomically(self.path("trusted.json"),{"tasks":self.TASKS})
+        write_file_atomically(self.path("checked.json"),self.TASKS)
+        self.assertEqual([task.to_dict() for task in self.open_list("trusted.json").tasks],self.TASKS)
+        self.assertEqual([task.to_dict() for task in self.open_list("checked.json").tasks],self.TASKS)
+
+class PagingTest(TodoListTestCase):
+    def listing(self,todo_list,*args,answers=()):
+        answers = list(answers)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            todo_list.display_tasks(*args,more=lambda: answers.pop(0))
+        return out.getvalue().splitlines(), answers
+
+    def test_display_pages(self):
+        todo_list = self.open_list()
+        todo_list.add_many([{"description":f"Task {number}","priority_level":("Low","High")[number % 2]} for number in range(1,8)])
+        todo_list.mark_task_completed(7)
+        by_priority = [str(task) for task in todo_list.iter_tasks(False,"priority")]
+        self.assertEqual([task.task_id for task in todo_list.iter_tasks(False,"priority")],[1,3,5,2,4,6])
+        lines, left = self.listing(todo_list,False,"priority",4,answers=[True,True])
+        self.assertEqual((lines,left),(by_priority,[True]))
+        lines, left = self.listing(todo_list,None,"id",3,answers=[False,True])
+        self.assertEqual((len(lines),left),(3,[True]))
+
+    def test_empty_listings(self):
+        todo_list = self.open_list()
+        self.assertEqual(self.listing(todo_list,None,"id",5)[0],["Your task list is empty. Add a few tasks to get started!"])
+        todo_list.add_task("Write","High")
+        self.assertEqual(self.listing(todo_list,True,"id",5)[0],["No completed tasks found. Get some tasks done!"])
+        todo_list.mark_task_completed(1)
+        self.assertEqual(self.listing(todo_list,False,"due",5)[0],["No incomplete tasks found. Add some new tasks!"])
+        with self.assertRaises(ValueError):
+            next(todo_list.iter_tasks(None,"name"))
+
+class SharedTest(TodoListTestCase):
+    def test_processes_adding_at_once_lose_nothing(self):
+        processes = [multiprocessing.Process(target=add_shared_tasks,args=(self.path("tasks.json"),worker,10)) for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            self.assertEqual(process.exitcode,0)
+        todo_list = self.open_list(shared=True)
+        self.assertEqual(sorted(task.description for task in todo_list.tasks),
+                         sorted(f"Worker {worker} task {number}" for worker in range(4) for number in range(10)))
+        self.assertEqual([task.task_id for task in todo_list.tasks],list(range(1,41)))
+
+    def test_changed_task_is_a_conflict(self):
+        first = self.open_list(shared=True)
+        first.add_many([{"description":"Write","priority_level":"High"},{"description":"Read","priority_level":"Low"}])
+        first.save_tasks()
+        second = self.open_list(shared=True)
+        self.assertEqual(len(second.tasks),2)
+        first.delete_task(1)
+        first.save_tasks()
+        second.update_many([{"task_id":1,"description":"Write more"},{"task_id":2,"priority_level":"High"}])
+        second.save_tasks()
+        self.assertEqual(second.conflicts,[{"task_id":1,"change":"upsert","error":"Task with ID 1 was changed by another process."}])
+        reopened = self.open_list(shared=True)
+        self.assertEqual([task.to_dict() for task in reopened.tasks],[{"description":"Read","task_id":2,"priority_level":"High","is_completed":False}])
+
+class HistoryTest(TodoListTestCase):
+    # Lists load lazily by default, the first batch call must still be a single undo step
+    def test_batch_on_lazy_list_is_one_step(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                todo_list = self.open_list(f"{columnar}.json",history=True,columnar=columnar)
+                todo_list.add_many([{"description":"Write","priority_level":"High"},{"description":"Read","priority_level":"Low"}])
+                todo_list.undo()
+                self.assertEqual(len(todo_list.tasks),0)
+                todo_list.redo()
+                self.assertEqual([task.description for task in todo_list.tasks],["Write","Read"])
+
+    def test_stable_id_deletes_keep_order(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                todo_list = self.open_list(f"{columnar}.json",history=True,columnar=columnar,stable_ids=True)
+                ids = lambda: [task.task_id for task in todo_list.tasks]
+                todo_list.add_many([{"description":f"Task {number}","priority_level":"Low"} for number in range(1,7)])
+                todo_list.mark_task_completed(1)
+                todo_list.delete_task(2)
+                todo_list.delete_many([4,4,5])
+                todo_list.delete_task(all_completed=True)
+                todo_list.add_task("Task 7","High")
+                self.assertEqual(ids(),[3,6,7])
+                self.assertEqual(todo_list.next_task().task_id,7)
+                for expected in ([3,6],[1,3,6],[1,3,4,5,6],[1,2,3,4,5,6]):
+                    todo_list.undo()
+                    self.assertEqual(ids(),expected)
+                self.assertEqual([task.description for task in todo_list.tasks],["Task 1","Task 2","Task 3","Task 4","Task 5","Task 6"])
+
+class ColumnarTest(TodoListTestCase):
+    def fill(self,todo_list):
+        todo_list.add_many([{"description":"Write","priority_level":"High","due":"2030-01-31 09:00","repeat":"monthly"},
+                            {"description":"Read","priority_level":"Low"},
+                            {"description":"Walk","priority_level":"Someday","due":"2029-05-01 08:00"},
+                            {"description":"Call","priority_level":"Medium"}])
+        todo_list.mark_task_completed(4)
+
+    def test_no_instance_dicts(self):
+        todo_list = self.open_list(columnar=True)
+        self.fill(todo_list)
+        for task in (Task("Write",1,"High"),todo_list.get_task_by_id(1)):
+            self.assertFalse(hasattr(task,"__dict__"))
+            with self.assertRaises(AttributeError):
+                task.note = "x"
+
+    def test_views_behave_like_tasks(self):
+        tasks = self.open_list("list.json",stable_ids=True)
+        columns = self.open_list("columns.json",stable_ids=True,columnar=True)
+        for todo_list in (tasks,columns):
+            self.fill(todo_list)
+            todo_list.get_task_by_id(2).update(description="Read more",priority_level="High",due="2030-02-01 10:00")
+        self.assertIsInstance(columns.get_task_by_id(1),TaskView)
+        self.assertEqual([task.to_dict() for task in columns.tasks],[task.to_dict() for task in tasks.tasks])
+        self.assertEqual([str(task) for task in columns.tasks],[str(task) for task in tasks.tasks])
+        self.assertIs(columns.get_task_by_id(1).repeat,"monthly")
+
+    def test_removed_view_keeps_its_values(self):
+        todo_list = self.open_list(stable_ids=True,columnar=True)
+        self.fill(todo_list)
+        columns = todo_list.tasks
+        view = columns.get(2)
+        columns.remove(view)
+        self.assertEqual(view.to_dict(),{"description":"Read","task_id":2,"priority_level":"Low","is_completed":False})
+        self.assertEqual(columns.get(3).description,"Walk")
+        self.assertIsNone(columns.get(2))
+        self.assertEqual([task.task_id for task in columns],[1,3,4])
+
+    def test_columns_take_less_memory(self):
+        def measure(columnar):
+            tracemalloc.start()
+            try:
+                todo_list = self.open_list(f"{columnar}.json",columnar=columnar,lazy=False)
+                before = tracemalloc.get_traced_memory()[0]
+                todo_list.add_many([{"description":f"Task number {number}","priority_level":("High","Medium","Low")[number % 3]} for number in range(5000)])
+                return tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+        self.assertLess(measure(True),measure(False) * 0.7)
+
+class SnapshotTest(TodoListTestCase):
+    def fill(self,todo_list):
+        todo_list.add_many([{"description":"Write ✓","priority_level":"High","due":"2030-01-31 09:00","repeat":"monthly"},
+                            {"description":"Read","priority_level":"Low"},
+                            {"description":"Walk","priority_level":"Someday","due":"2029-05-01 08:00"}])
+        # The monthly task comes back as task 4
+        todo_list.mark_task_completed(1)
+        todo_list.save_tasks()
+        return [task.to_dict() for task in todo_list.tasks]
+
+    def test_round_trip(self):
+        for columnar in (False,True):
+            with self.subTest(columnar=columnar):
+                name = f"{columnar}.bin"
+                saved = self.fill(self.open_list(name,columnar=columnar,file_format="binary"))
+                self.assertEqual(len(saved),4)
+                with open(self.path(name),'rb') as f:
+                    self.assertEqual(f.read(4),b"TLS1")
+                # Both modes read what either mode wrote
+                for reopened in (self.open_list(name),self.open_list(name,columnar=True)):
+                    self.assertEqual([task.to_dict() for task in reopened.tasks],saved)
+                    self.assertEqual(reopened.file_format,"binary")
+
+    def test_next_id_is_kept(self):
+        todo_list = self.open_list("tasks.bin",stable_ids=True,file_format="binary")
+        self.fill(todo_list)
+        todo_list.delete_task(4)
+        todo_list.save_tasks()
+        reopened = self.open_list("tasks.bin",stable_ids=True)
+        reopened.add_task("Call","Low")
+        self.assertEqual([task.task_id for task in reopened.tasks],[1,2,3,5])
+
+    def test_existing_file_keeps_its_format(self):
+        self.fill(self.open_list())
+        todo_list = self.open_list(file_format="binary")
+        todo_list.add_task("Call","Low")
+        todo_list.save_tasks()
+        self.assertEqual(todo_list.file_format,"json")
+        with open(self.path("tasks.json")) as f:
+            self.assertEqual(len(json.load(f)["tasks"]),5)
+
+    def test_descriptions_are_decoded_when_used(self):
+        self.fill(self.open_list("tasks.bin",file_format="binary"))
+        todo_list = self.open_list("tasks.bin",columnar=True)
+        descriptions = todo_list.tasks.descriptions
+        self.assertIsInstance(descriptions,StringColumn)
+        self.assertEqual(todo_list.get_task_by_id(1).description,"Write ✓")
+        self.assertIsNone(descriptions.values)
+        todo_list.get_task_by_id(3).update(description="Run")
+        self.assertEqual(list(descriptions),["Write ✓","Read","Run","Write ✓"])
+
+    def test_damaged_snapshot_is_not_overwritten(self):
+        self.fill(self.open_list("tasks.bin",file_format="binary"))
+        with open(self.path("tasks.bin"),'rb') as f:
+            data = f.read()
+        for damaged in (data[:-8],data[:20]):
+            with self.subTest(size=len(damaged)):
+                with open(self.path("tasks.bin"),'wb') as f:
+                    f.write(damaged)
+                todo_list = self.open_list("tasks.bin")
+                with self.assertRaises(ValueError):
+                    len(todo_list)
+                todo_list.save_tasks()
+                with open(self.path("tasks.bin"),'rb') as f:
+                    self.assertEqual(f.read(),damaged)
+
+class StatsTest(TodoListTestCase):
+    def test_memory_tracing_started_elsewhere_keeps_running(self):
+        self.assertFalse(tracemalloc.is_tracing())
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        todo_list = self.open_list(stats=False)
+        todo_list.enable_stats(trace_memory=True)
+        todo_list.add_task("Write","High")
+        todo_list.disable_stats()
+        self.assertTrue(tracemalloc.is_tracing())
+
+    def test_memory_tracing_stops_with_the_stats(self):
+        todo_list = self.open_list()
+        todo_list.enable_stats(trace_memory=True)
+        self.assertTrue(tracemalloc.is_tracing())
+        todo_list.add_task("Write","High")
+        self.assertGreater(todo_list.stats.as_dict()["memory"]["peak_bytes"],0)
+        todo_list.disable_stats()
+        self.assertFalse(tracemalloc.is_tracing())
+
+class RecurrenceTest(unittest.TestCase):
+    def test_next_occurrence(self):
+        cases = [
+            ("2030-01-01 09:00","hourly","2030-01-01 10:00"),
+            ("2030-01-01 09:00","daily","2030-01-02 09:00"),
+            ("2030-01-01 09:00","weekly","2030-01-08 09:00"),
+            ("2030-01-31 09:00","monthly","2030-02-28 09:00"),
+            ("2032-01-31 09:00","monthly","2032-02-29 09:00"),
+            ("2030-12-15 09:00","monthly","2031-01-15 09:00"),
+        ]
+        for due, repeat, expected in cases:
+            with self.subTest(due=due,repeat=repeat):
+                self.assertEqual(next_occurrence(check_due(due),repeat,now=datetime(2000,1,1)),check_due(expected))
+
+    def test_missed_occurrences_are_skipped(self):
+        due = check_due("2030-01-31 09:00")
+        self.assertEqual(next_occurrence(due,"daily",now=datetime(2030,3,5,12,0)),datetime(2030,3,6,9,0))
+        self.assertEqual(next_occurrence(due,"hourly",now=datetime(2030,3,5,12,0)),datetime(2030,3,5,13,0))
+        # Months are counted from the original date, so the 31st comes back after February
+        self.assertEqual(next_occurrence(due,"monthly",now=datetime(2030,3,5,12,0)),datetime(2030,3,31,9,0))
+        self.assertEqual(next_occurrence(due,"monthly",now=datetime(2030,3,31,9,0)),datetime(2030,4,30,9,0))
+        self.assertEqual(next_occurrence(due,"weekly",now=datetime(2030,2,7,9,0)),datetime(2030,2,14,9,0))
+
+    def test_due_and_repeat_checks(self):
+        self.assertEqual(check_due(" 2030-01-31 09:00:59.5 "),datetime(2030,1,31,9,0,59))
+        self.assertIsNone(check_due(None))
+        aware = datetime(2030,1,31,9,0,tzinfo=timezone(timedelta(hours=5)))
+        self.assertEqual(check_due(aware),aware.astimezone().replace(tzinfo=None))
+        for due in ("31/01/2030","",5):
+            with self.assertRaises((ValueError,TypeError)):
+                check_due(due)
+        self.assertEqual(check_repeat(" Monthly ",datetime(2030,1,31)),"monthly")
+        with self.assertRaises(ValueError):
+            check_repeat("yearly",datetime(2030,1,31))
+        with self.assertRaises(ValueError):
+            check_repeat("daily",None)
+
+class BackendParityTest(TodoListTestCase):
+    # The same changes on a JSON and on a SQLite list must leave both in the same state
+    def run_changes(self,file_name,**options):
+        todo_list = open_todo_list(self.path(file_name),**options)
+        seen = [todo_list.add_many([
+            {"description":"Pay rent","priority_level":"High","due":"2099-01-31 09:00","repeat":"monthly"},
+            {"description":"Read","priority_level":"Low"},
+            {"description":"Call Bob","priority_level":"Medium","due":"2029-06-01 12:00"},
+            {"description":" ","priority_level":"High"},
+            {"description":"Walk","priority_level":"Someday","due":"2029-05-01 08:00"},
+            {"description":"Water plants","priority_level":"High","repeat":"daily"},
+        ])]
+        seen.append(todo_list.update_many([
+            {"task_id":1,"is_completed":True},
+            {"task_id":2,"priority_level":"High","due":"2029-07-01 10:00"},
+            {"task_id":3,"due":"not a date"},
+            {"task_id":99,"description":"Nothing"},
+        ]))
+        todo_list.mark_task_completed(3)
+        seen.append(todo_list.delete_many([4,4,99]))
+        seen.append(self.state(todo_list))
+        todo_list.delete_task(all_completed=True)
+        seen.append(self.state(todo_list))
+        todo_list.save_tasks()
+        todo_list.close()
+        todo_list = open_todo_list(self.path(file_name),**options)
+        self.addCleanup(todo_list.close)
+        seen.append(self.state(todo_list))
+        return seen
+
+    def state(self,todo_list):
+        dicts = lambda tasks: [task.to_dict() for task in tasks]
+        to_dict = lambda task: None if task is None else task.to_dict()
+        return {
+            "by_id":dicts(todo_list.iter_tasks()),
+            "by_priority":dicts(todo_list.iter_tasks(False,"priority")),
+            "by_due":dicts(todo_list.iter_tasks(sort_by="due")),
+            "completed":dicts(todo_list.get_tasks(status=True)),
+            "high":dicts(todo_list.get_tasks(priority_level="High")),
+            "next_task":to_dict(todo_list.next_task()),
+            "next_due":to_dict(todo_list.next_due()),
+            "overdue":dicts(todo_list.overdue(now="2029-06-15 00:00")),
+            "next_id":todo_list.next_id,
+        }
+
+    def open_backends(self,history=False):
+        # List, columnar and, without history, SQLite
+        todo_lists = [self.open_list("list.json",history=history),self.open_list("columns.json",history=history,columnar=True)]
+        if not history:
+            todo_lists.append(SqliteTodoList(self.path("tasks.db")))
+            self.addCleanup(todo_lists[-1].close)
+        return todo_lists
+
+    def test_next_task_after_undo_renumbers(self):
+        for todo_list in self.open_backends(history=True):
+            todo_list.add_many([{"description":description,"priority_level":"High"} for description in "ABC"])
+            todo_list.delete_task(1)
+            todo_list.delete_task(1)
+            todo_list.undo()
+            self.assertEqual((todo_list.next_task().task_id,todo_list.next_task().description),(1,"B"))
+
+    def test_next_task_through_changes_and_undo(self):
+        seen = []
+        for todo_list in self.open_backends(history=True):
+            steps = [
+                lambda: todo_list.add_many([{"description":description,"priority_level":level} for description, level in (("A","Low"),("B","High"),("C","High"),("D","Medium"),("E","High"))]),
+                lambda: todo_list.delete_many([2,3]),
+                lambda: todo_list.undo(),
+                lambda: todo_list.mark_task_completed(2),
+                lambda: todo_list.delete_task(all_completed=True),
+                lambda: todo_list.undo(),
+                lambda: todo_list.delete_task(1),
+                lambda: todo_list.undo(),
+            ]
+            found = []
+            for step in steps:
+                step()
+                found.append((todo_list.next_task().task_id,todo_list.next_task().description))
+            seen.append(found)
+        self.assertEqual(seen[0],seen[1])
+
+    def test_next_due_ties_after_renumbering(self):
+        for todo_list in self.open_backends():
+            todo_list.add_many([{"description":f"Undated {number}","priority_level":"Low"} for number in range(4)])
+            todo_list.add_task("Old","High","2030-01-01 09:00")
+            for _ in range(4):
+                todo_list.delete_task(1)
+            todo_list.add_task("New","High","2030-01-01 09:00")
+            self.assertEqual((todo_list.next_due().task_id,todo_list.next_due().description),(1,"Old"))
+            self.assertEqual([task.description for task in todo_list.overdue(now="2030-01-01 10:00")],["Old","New"])
+
+    def test_clear_due_and_repeat(self):
+        for todo_list in self.open_backends():
+            todo_list.add_task("Rent","High","2030-01-31 09:00","monthly")
+            result = todo_list.update_many([{"task_id":1,"due":""}])
+            self.assertEqual(result,[{"ok":False,"task_id":1,"error":"A repeating task needs a due date."}])
+            self.assertEqual((todo_list.next_due().due.isoformat(" "),todo_list.next_due().repeat),("2030-01-31 09:00:00","monthly"))
+            self.assertEqual(todo_list.update_many([{"task_id":1,"due":"","repeat":""}]),[{"ok":True,"task_id":1}])
+            task = todo_list.get_task_by_id(1)
+            self.assertEqual((task.due,task.repeat),(None,None))
+            self.assertIsNone(todo_list.next_due())
+            self.assertEqual(todo_list.overdue(now="2031-01-01 00:00"),[])
+
+    def test_due_windows(self):
+        dues = ["2090-01-01 00:00","2030-01-01 10:15","2001-05-01 08:00","2030-01-01 09:30"]
+        for todo_list in self.open_backends():
+            todo_list.add_many([{"description":due,"priority_level":"Low","due":due} for due in dues])
+            descriptions = lambda tasks: [task.description for task in tasks]
+            self.assertEqual(descriptions(todo_list.overdue(now="2030-01-01 10:00")),["2001-05-01 08:00","2030-01-01 09:30"])
+            self.assertEqual(descriptions(todo_list.due_within(3600,now="2030-01-01 09:30")),["2030-01-01 09:30","2030-01-01 10:15"])
+            self.assertEqual(descriptions(todo_list.due_within(3600,now="2050-01-01 00:00")),[])
+            todo_list.delete_task(3)
+            todo_list.update_many([{"task_id":1,"due":"2030-01-01 09:45"}])
+            self.assertEqual(descriptions(todo_list.overdue(now="2030-01-01 10:00")),["2030-01-01 09:30","2090-01-01 00:00"])
+
+    def test_repeating_task_comes_back(self):
+        for todo_list in self.open_backends():
+            todo_list.add_task("Rent","High","2099-01-31 09:00","monthly")
+            todo_list.add_task("Call","Low","2099-01-15 09:00")
+            todo_list.mark_task_completed(1)
+            # Completing it again does not add another one
+            todo_list.mark_task_completed(1)
+            todo_list.mark_task_completed(2)
+            self.assertEqual([task.to_dict() for task in todo_list.iter_tasks()],[
+                {"task_id":1,"description":"Rent","is_completed":True,"priority_level":"High","due":"2099-01-31 09:00:00","repeat":"monthly"},
+                {"task_id":2,"description":"Call","is_completed":True,"priority_level":"Low","due":"2099-01-15 09:00:00","repeat":None},
+                {"task_id":3,"description":"Rent","is_completed":False,"priority_level":"High","due":"2099-02-28 09:00:00","repeat":"monthly"},
+            ])
+            self.assertEqual(todo_list.next_due().task_id,3)
+            # Each task only keeps its own due date, so the one after the 28th is on the 28th
+            todo_list.mark_task_completed(3)
+            self.assertEqual(todo_list.next_due().due,datetime(2099,3,28,9,0))
+
+    def test_repeat_survives_a_crash(self):
+        todo_list = self.open_list(journal=True)
+        todo_list.add_task("Rent","High","2099-01-31 09:00","monthly")
+        todo_list.mark_task_completed(1)
+        todo_list.journal.close()
+        reopened = self.open_list(journal=True)
+        self.assertEqual([(task.task_id,task.is_completed,task.due) for task in reopened.tasks],
+                         [(1,True,datetime(2099,1,31,9,0)),(2,False,datetime(2099,2,28,9,0))])
+        self.assertEqual(reopened.next_due().task_id,2)
+
+    def test_json_and_sqlite_lists_agree(self):
+        for stable_ids in (False,True):
+            expected = self.run_changes(f"tasks{stable_ids}.db",stable_ids=stable_ids)
+            for columnar in (False,True):
+                with self.subTest(stable_ids=stable_ids,columnar=columnar):
+                    self.assertEqual(self.run_changes(f"tasks{stable_ids}{columnar}.json",stable_ids=stable_ids,columnar=columnar),expected)
+
+if __name__ == "__main__":
+    unittest.main()